@@ -2,6 +2,8 @@ from dataclasses import dataclass
 
 import toml
 
+from shared.http import UpstreamConfig, load_upstreams
+
 
 @dataclass
 class BotConfig:
@@ -26,6 +28,7 @@ class Config:
     profile_service_url: str
     rating_service_url: str
     matching_service_url: str
+    upstreams: dict[str, UpstreamConfig]
 
 
 def load_config(config_path: str) -> Config:
@@ -37,4 +40,5 @@ def load_config(config_path: str) -> Config:
         profile_service_url=data["profile_service_url"],
         rating_service_url=data["rating_service_url"],
         matching_service_url=data["matching_service_url"],
+        upstreams=load_upstreams(data),
     )
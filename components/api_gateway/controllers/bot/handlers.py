@@ -1,5 +1,4 @@
 import logging
-from datetime import datetime, timedelta
 
 import httpx
 from aiogram import Router, F, Bot
@@ -19,6 +18,8 @@ from aiogram.filters import CommandStart, CommandObject
 from aiogram.utils.deep_linking import decode_payload
 from aiogram.utils.deep_linking import create_start_link
 
+from shared.http import UpstreamClients
+
 
 
 router = Router()
@@ -27,7 +28,8 @@ DEFAULT_PROFILE_PHOTO_ID = "AgACAgIAAxkBAAIvm2gPP8rF5_7hyL1m5ytSeCg5BStxAALO8jEb
 
 
 @router.message(CommandStart(deep_link=True))
-async def handler(message: types.Message, command: CommandObject, state: FSMContext, bot: Bot, cfg: FromDishka[Config]):
+async def handler(message: types.Message, command: CommandObject, state: FSMContext, bot: Bot, cfg: FromDishka[Config],
+                  http: FromDishka[UpstreamClients]):
     user_id = message.from_user.id
     first_name = message.from_user.first_name
 
@@ -36,73 +38,70 @@ async def handler(message: types.Message, command: CommandObject, state: FSMCont
     args = command.args
     inviter_id = decode_payload(args)
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{cfg.profile_service_url}/profiles/{user_id}")
+    response = await http["profile_service"].get(f"{cfg.profile_service_url}/profiles/{user_id}")
 
-        if response.status_code == 404:
-            await state.update_data(
-                user_id=user_id,
-            )
-            await state.set_state(ProfileCreationStates.waiting_for_first_name)
-            await message.answer(
-                f"Привет, {first_name}! 👋 Добро пожаловать в Дэйтинг Бот!\n"
-                "Чтобы другие могли тебя найти, давай создадим твою анкету.\n\n"
-                "📝 <b>Как тебя зовут</b> (Это имя будут видеть другие пользователи)",
-                parse_mode="HTML",
-            )
-            ref_rating_response = await client.post(
-                cfg.rating_service_url + f'/stats/ref/{inviter_id}'
-            )
-            if ref_rating_response.status_code != 200:
-                logging.warning('Update rating when join by ref link: %s', ref_rating_response.json())
+    if response.status_code == 404:
+        await state.update_data(
+            user_id=user_id,
+        )
+        await state.set_state(ProfileCreationStates.waiting_for_first_name)
+        await message.answer(
+            f"Привет, {first_name}! 👋 Добро пожаловать в Дэйтинг Бот!\n"
+            "Чтобы другие могли тебя найти, давай создадим твою анкету.\n\n"
+            "📝 <b>Как тебя зовут</b> (Это имя будут видеть другие пользователи)",
+            parse_mode="HTML",
+        )
+        ref_rating_response = await http["rating_service"].post(
+            cfg.rating_service_url + f'/stats/ref/{inviter_id}'
+        )
+        if ref_rating_response.status_code != 200:
+            logging.warning('Update rating when join by ref link: %s', ref_rating_response.json())
 
-            await bot.send_message(
-                inviter_id,
-                text=f'Пользователь {message.from_user.username} присоединился по твоей реферальной ссылке. 📈Твой рейтинг повышен'
-            )
-        elif response.status_code == 200:
-            await message.answer(
-                "Ваша анкета активна. Можете посмотреть свою анкету командой /profile или начать просмотр других анкет командой /view")
-        else:
-            await message.answer(f"Произошла ошибка при проверке профиля: {response.status_code}")
+        await bot.send_message(
+            inviter_id,
+            text=f'Пользователь {message.from_user.username} присоединился по твоей реферальной ссылке. 📈Твой рейтинг повышен'
+        )
+    elif response.status_code == 200:
+        await message.answer(
+            "Ваша анкета активна. Можете посмотреть свою анкету командой /profile или начать просмотр других анкет командой /view")
+    else:
+        await message.answer(f"Произошла ошибка при проверке профиля: {response.status_code}")
 
 
 @router.message(CommandStart(deep_link=False))
-async def start_cmd(message: types.Message, state: FSMContext, cfg: FromDishka[Config]):
+async def start_cmd(message: types.Message, state: FSMContext, cfg: FromDishka[Config], http: FromDishka[UpstreamClients]):
     user_id = message.from_user.id
     first_name = message.from_user.first_name
 
     await state.set_state(None)
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{cfg.profile_service_url}/profiles/{user_id}")
+    response = await http["profile_service"].get(f"{cfg.profile_service_url}/profiles/{user_id}")
 
-        if response.status_code == 404:
-            await state.update_data(
-                user_id=user_id,
-            )
-            await state.set_state(ProfileCreationStates.waiting_for_first_name)
-            await message.answer(
-                f"Привет, {first_name}! 👋 Добро пожаловать в Дэйтинг Бот!\n"
-                "Чтобы другие могли тебя найти, давай создадим твою анкету.\n\n"
-                "📝 <b>Как тебя зовут</b> (Это имя будут видеть другие пользователи)",
-                parse_mode="HTML",
-            )
-        elif response.status_code == 200:
-            await message.answer("Ваша анкета активна. Можете посмотреть свою анкету командой /profile или начать просмотр других анкет командой /view")
-        else:
-            await message.answer(f"Произошла ошибка при проверке профиля: {response.status_code}")
+    if response.status_code == 404:
+        await state.update_data(
+            user_id=user_id,
+        )
+        await state.set_state(ProfileCreationStates.waiting_for_first_name)
+        await message.answer(
+            f"Привет, {first_name}! 👋 Добро пожаловать в Дэйтинг Бот!\n"
+            "Чтобы другие могли тебя найти, давай создадим твою анкету.\n\n"
+            "📝 <b>Как тебя зовут</b> (Это имя будут видеть другие пользователи)",
+            parse_mode="HTML",
+        )
+    elif response.status_code == 200:
+        await message.answer("Ваша анкета активна. Можете посмотреть свою анкету командой /profile или начать просмотр других анкет командой /view")
+    else:
+        await message.answer(f"Произошла ошибка при проверке профиля: {response.status_code}")
 
 
 @router.message(Command('referral'))
-async def get_ref_link(message: types.Message, bot: Bot, cfg: FromDishka[Config]):
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{cfg.profile_service_url}/profiles/{message.from_user.id}")
-        if response.status_code == 200:
-            link = await create_start_link(bot, str(message.from_user.id), encode=True)
-            await message.answer(f"Ваша реферальная ссылка: {link}. Отправьте другу, чтобы повысить свой рейтинг :)")
-        elif response.status_code == 404:
-            await message.answer("Сначала вам нужно создать свою анкету. Введите /start")
+async def get_ref_link(message: types.Message, bot: Bot, cfg: FromDishka[Config], http: FromDishka[UpstreamClients]):
+    response = await http["profile_service"].get(f"{cfg.profile_service_url}/profiles/{message.from_user.id}")
+    if response.status_code == 200:
+        link = await create_start_link(bot, str(message.from_user.id), encode=True)
+        await message.answer(f"Ваша реферальная ссылка: {link}. Отправьте другу, чтобы повысить свой рейтинг :)")
+    elif response.status_code == 404:
+        await message.answer("Сначала вам нужно создать свою анкету. Введите /start")
 
 
 @router.message(ProfileCreationStates.waiting_for_first_name)
@@ -226,7 +225,8 @@ async def waiting_for_age_preference(message: types.Message, state: FSMContext):
 
 
 @router.message(ProfileCreationStates.waiting_for_photo, F.photo | F.media_group_id | (F.text.lower() == "пропустить"))
-async def waiting_for_photo(message: types.Message, state: FSMContext, cfg: FromDishka[Config], media_group: list[types.PhotoSize] | None = None):
+async def waiting_for_photo(message: types.Message, state: FSMContext, cfg: FromDishka[Config], http: FromDishka[UpstreamClients],
+                            media_group: list[types.PhotoSize] | None = None):
     profile_data = await state.get_data()
     print('cosn:', profile_data)
 
@@ -295,9 +295,8 @@ async def waiting_for_photo(message: types.Message, state: FSMContext, cfg: From
     if refill:
         logging.info("refill: %s. Deleting profile..", refill)
 
-        async with httpx.AsyncClient() as client:
-            response = await client.delete(f"{cfg.profile_service_url}/profiles/{profile_data['user_id']}")
-            logging.info("Deletion status: %d; data: %s", response.status_code, response.json())
+        response = await http["profile_service"].delete(f"{cfg.profile_service_url}/profiles/{profile_data['user_id']}")
+        logging.info("Deletion status: %d; data: %s", response.status_code, response.json())
 
         await state.update_data(
             refill=None,
@@ -305,76 +304,76 @@ async def waiting_for_photo(message: types.Message, state: FSMContext, cfg: From
 
     print('Trying to create profile...')
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            form_data_str = {k: str(v) for k, v in new_profile_data.items()}
-            print('Form data:', form_data_str)
-
-            files = []
-            if len(photo_file_bytes) > 0:
-                for i, photo_bytes in enumerate(photo_file_bytes):
-                    # Each file is a tuple: (field_name, (filename, content, content_type))
-                    files.append(("photos", (f"profile_photo_{i + 1}.jpg", photo_bytes, "image/jpeg")))
-
-            response = await client.post(
-                cfg.profile_service_url + '/profiles',
-                data=form_data_str,
-                files=files
-            )
-            print('Create profile resp:', response.json())
+        form_data_str = {k: str(v) for k, v in new_profile_data.items()}
+        print('Form data:', form_data_str)
+
+        files = []
+        if len(photo_file_bytes) > 0:
+            for i, photo_bytes in enumerate(photo_file_bytes):
+                # Each file is a tuple: (field_name, (filename, content, content_type))
+                files.append(("photos", (f"profile_photo_{i + 1}.jpg", photo_bytes, "image/jpeg")))
+
+        response = await http["profile_service"].post(
+            cfg.profile_service_url + '/profiles',
+            data=form_data_str,
+            files=files,
+            timeout=30.0
+        )
+        print('Create profile resp:', response.json())
 
-            if response.status_code not in (200, 201):
-                logging.error(f"Ошибка при создании анкеты: {response.status_code} {response.text}")
-                await message.answer(f"❌ Произошла ошибка при создании анкеты: {response.status_code} {response.text}")
-                return
+        if response.status_code not in (200, 201):
+            logging.error(f"Ошибка при создании анкеты: {response.status_code} {response.text}")
+            await message.answer(f"❌ Произошла ошибка при создании анкеты: {response.status_code} {response.text}")
+            return
 
-            try:
-                if refill:
-                    rating_response = await client.put(
-                        cfg.rating_service_url + '/ratings',
-                        json=new_profile_data
-                    )
-                else:
-                    rating_response = await client.post(
-                        cfg.rating_service_url + '/ratings',
-                        json=new_profile_data
-                    )
-
-                rating_info = rating_response.json()
-                new_preferences_data["rating"] = rating_info["rating_score"]
-
-                if rating_response.status_code not in (200, 201):
-                    logging.warning(
-                            f"Не удалось создать рейтинг: {rating_response.status_code} {rating_response.text}")
-            except Exception as e:
-                logging.error(f"Ошибка при создании рейтинга: {e}")
-
-            try:
-                if refill:
-                    user_id = new_preferences_data['user_id']
-                    del new_preferences_data['user_id']
-                    matching_response = await client.put(
-                        cfg.matching_service_url + f"/users/info/{user_id}",
-                        json=new_preferences_data
-                    )
-                else:
-                    matching_response = await client.post(
-                        cfg.matching_service_url + "/users/info",
-                        json=new_preferences_data
-                    )
-
-                if matching_response.status_code not in (200, 201):
-                    logging.warning(
-                        f"Не удалось создать предпочтения: {matching_response.status_code} {matching_response.text}")
-            except Exception as e:
-                logging.error(f"Ошибка при создании предпочтения: {e}")
-
-            if response.status_code not in (200, 201):
-                await message.answer(f"❌ Произошла ошибка при создании анкеты: {response.status_code} {response.text}")
-                return
+        try:
+            if refill:
+                rating_response = await http["rating_service"].put(
+                    cfg.rating_service_url + '/ratings',
+                    json=new_profile_data
+                )
+            else:
+                rating_response = await http["rating_service"].post(
+                    cfg.rating_service_url + '/ratings',
+                    json=new_profile_data
+                )
 
-            await message.answer(
-                "✅ Ваша анкета успешно создана! Можете начать просмотр других анкет командой /view")
-            await state.clear()
+            rating_info = rating_response.json()
+            new_preferences_data["rating"] = rating_info["rating_score"]
+
+            if rating_response.status_code not in (200, 201):
+                logging.warning(
+                        f"Не удалось создать рейтинг: {rating_response.status_code} {rating_response.text}")
+        except Exception as e:
+            logging.error(f"Ошибка при создании рейтинга: {e}")
+
+        try:
+            if refill:
+                user_id = new_preferences_data['user_id']
+                del new_preferences_data['user_id']
+                matching_response = await http["matching_service"].put(
+                    cfg.matching_service_url + f"/users/info/{user_id}",
+                    json=new_preferences_data
+                )
+            else:
+                matching_response = await http["matching_service"].post(
+                    cfg.matching_service_url + "/users/info",
+                    json=new_preferences_data
+                )
+
+            if matching_response.status_code not in (200, 201):
+                logging.warning(
+                    f"Не удалось создать предпочтения: {matching_response.status_code} {matching_response.text}")
+        except Exception as e:
+            logging.error(f"Ошибка при создании предпочтения: {e}")
+
+        if response.status_code not in (200, 201):
+            await message.answer(f"❌ Произошла ошибка при создании анкеты: {response.status_code} {response.text}")
+            return
+
+        await message.answer(
+            "✅ Ваша анкета успешно создана! Можете начать просмотр других анкет командой /view")
+        await state.clear()
     except httpx.RequestError as e:
         await message.answer(f"❌ Ошибка сети при создании анкеты: {e}")
     except Exception as e:
@@ -382,38 +381,40 @@ async def waiting_for_photo(message: types.Message, state: FSMContext, cfg: From
         await state.clear()
 
 
-async def load_suitable_profiles(message: types.Message, offset: int, cfg: Config):
+async def load_suitable_profiles(message: types.Message, cursor: str | None, cfg: Config, http: UpstreamClients):
     current_user_id = message.chat.id
-    match_profiles_url = f"{cfg.matching_service_url}/match/profiles/{current_user_id}?offset={offset}&limit=50"
+    match_profiles_url = f"{cfg.matching_service_url}/match/profiles/{current_user_id}"
+    params = {"limit": 50}
+    if cursor:
+        params["cursor"] = cursor
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(match_profiles_url)
+    response = await http["matching_service"].get(match_profiles_url, params=params)
 
-        if response.status_code == 200:
-            profiles_data = response.json()
+    if response.status_code == 200:
+        page = response.json()
 
-            return profiles_data
-        elif response.status_code == 404:
-            return []
-        raise Exception(f"{response.json()}")
+        return page["profiles"], page["next_cursor"]
+    elif response.status_code == 404:
+        return [], None
+    raise Exception(f"{response.json()}")
 
 
-async def show_next_profile(message: types.Message, state: FSMContext, cfg: Config):
-    current_user_id = message.chat.id
+async def show_next_profile(message: types.Message, state: FSMContext, cfg: Config, http: UpstreamClients):
     data = await state.get_data()
 
     try:
         profiles_data = data.get('matched_profiles')
-        last_loaded = data.get('last_loaded')
-        offset = data.get('matched_profiles_offset', 0)
-        viewing_profile_idx = data.get('viewing_profile_idx')
+        feed_cursor = data.get('feed_cursor')
+        viewing_profile_idx = data.get('viewing_profile_idx', 0)
 
-        print(profiles_data, last_loaded, offset,viewing_profile_idx)
+        if profiles_data is None or viewing_profile_idx >= len(profiles_data):
+            if profiles_data is not None and feed_cursor is None:
+                profiles_data = []
+            else:
+                profiles_data, feed_cursor = await load_suitable_profiles(message, feed_cursor, cfg, http)
 
-        if (profiles_data is None) or (last_loaded is not None and (datetime.now() - datetime.fromisoformat(last_loaded) > timedelta(minutes=1))):
-            profiles_data = await load_suitable_profiles(message, offset, cfg)
             if len(profiles_data) == 0:
-                await state.clear()
+                await state.set_state(None)
                 await message.answer("🤷‍♀️ Анкеты для просмотра закончились. Попробуйте позже.", reply_markup=remove_kb)
                 return
 
@@ -421,16 +422,10 @@ async def show_next_profile(message: types.Message, state: FSMContext, cfg: Conf
 
             await state.update_data(
                 matched_profiles=profiles_data,
-                matched_profiles_offset=viewing_profile_idx,
+                feed_cursor=feed_cursor,
                 viewing_profile_idx=viewing_profile_idx,
-                last_loaded=datetime.now()
             )
 
-        if viewing_profile_idx >= len(profiles_data):
-            await state.set_state(None)
-            await message.answer("🤷‍♀️ Анкеты для просмотра закончились. Попробуйте позже.", reply_markup=remove_kb)
-            return
-
         current_profile = profiles_data[viewing_profile_idx]
 
         await state.update_data(
@@ -493,40 +488,41 @@ async def send_view_profile_msg(current_profile, message, keyboard):
 
 
 @router.message(Command("view"), StateFilter(None))
-async def view_profiles_command(message: types.Message, state: FSMContext, cfg: FromDishka[Config]):
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{cfg.profile_service_url}/profiles/{message.from_user.id}")
-        if response.status_code == 200:
-            delete_likes_response = await client.delete(f"{cfg.matching_service_url}/like/delete/{message.from_user.id}")
-            print(delete_likes_response.json())
-
-            await message.answer("Начинаем просмотр анкет...")
-            await show_next_profile(message, state, cfg)
-        elif response.status_code == 404:
-            await message.answer("Сначала вам нужно создать свою анкету. Введите /start")
-        else:
-            await message.answer(f"Не удалось проверить вашу анкету. Ошибка: {response.status_code}")
+async def view_profiles_command(message: types.Message, state: FSMContext, cfg: FromDishka[Config], http: FromDishka[UpstreamClients]):
+    response = await http["profile_service"].get(f"{cfg.profile_service_url}/profiles/{message.from_user.id}")
+    if response.status_code == 200:
+        # a new feed epoch shows already rated profiles again, the likes themselves are kept
+        reset_response = await http["matching_service"].post(f"{cfg.matching_service_url}/feed/reset/{message.from_user.id}")
+        if reset_response.status_code != 200:
+            logging.warning('Feed reset failed: %s', reset_response.text)
+
+        await state.update_data(matched_profiles=None, feed_cursor=None, viewing_profile_idx=0)
+        await message.answer("Начинаем просмотр анкет...")
+        await show_next_profile(message, state, cfg, http)
+    elif response.status_code == 404:
+        await message.answer("Сначала вам нужно создать свою анкету. Введите /start")
+    else:
+        await message.answer(f"Не удалось проверить вашу анкету. Ошибка: {response.status_code}")
 
 
 @router.message(Command("top"), StateFilter(None))
-async def view_top_profiles(message: types.Message, state: FSMContext, cfg: FromDishka[Config]):
+async def view_top_profiles(message: types.Message, state: FSMContext, cfg: FromDishka[Config], http: FromDishka[UpstreamClients]):
     await state.clear()
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{cfg.rating_service_url}/top")
-        if response.status_code == 200:
-            print(response.json())
-
-            text = "🔝Топы по рейтингу\n\n"
-            for i, profile in enumerate(response.json()):
-                text += f"{i + 1}. {profile['first_name']} {profile['last_name']} - {round(profile['rating'], 2)}\n"
-            await message.answer(text)
-        else:
-            await message.answer(f"Что-то пошло не так. Ошибка: {response.status_code}")
+    response = await http["rating_service"].get(f"{cfg.rating_service_url}/top")
+    if response.status_code == 200:
+        print(response.json())
+
+        text = "🔝Топы по рейтингу\n\n"
+        for i, profile in enumerate(response.json()):
+            text += f"{i + 1}. {profile['first_name']} {profile['last_name']} - {round(profile['rating'], 2)}\n"
+        await message.answer(text)
+    else:
+        await message.answer(f"Что-то пошло не так. Ошибка: {response.status_code}")
 
 
 
 @router.callback_query(StateFilter(ViewingStates.viewing), F.data.startswith("rate:"))
-async def process_rating_callback(callback: types.CallbackQuery, state: FSMContext, cfg: FromDishka[Config]):
+async def process_rating_callback(callback: types.CallbackQuery, state: FSMContext, cfg: FromDishka[Config], http: FromDishka[UpstreamClients]):
     action = callback.data.split(":")[1]
     current_user_id = callback.from_user.id
     state_data = await state.get_data()
@@ -553,25 +549,23 @@ async def process_rating_callback(callback: types.CallbackQuery, state: FSMConte
     }
 
     try:
-        async with httpx.AsyncClient() as client:
-            rating_response = await client.post(
-                f"{cfg.rating_service_url}/ratings/{action}",
-                json=payload
-            )
+        rating_response = await http["rating_service"].post(
+            f"{cfg.rating_service_url}/ratings/{action}",
+            json=payload
+        )
 
         if rating_response.status_code == 200:
-            async with httpx.AsyncClient() as client:
-                matching_response = await client.post(
-                    f"{cfg.matching_service_url}/match/check",
-                    json={
-                        "rater_user_id": current_user_id,
-                        "rated_user_id": viewing_profile_id,
-                        "rater_username": callback.from_user.username,
-                        "rated_username": viewing_profile_username,
-                        "like_type": action
-                    }
-                )
-                print('Matching response:', matching_response.json())
+            matching_response = await http["matching_service"].post(
+                f"{cfg.matching_service_url}/match/check",
+                json={
+                    "rater_user_id": current_user_id,
+                    "rated_user_id": viewing_profile_id,
+                    "rater_username": callback.from_user.username,
+                    "rated_username": viewing_profile_username,
+                    "like_type": action
+                }
+            )
+            print('Matching response:', matching_response.json())
 
             if matching_response.status_code == 200:
                 await callback.answer(f"Вы поставили {('лайк' if action == 'like' else 'дизлайк')}!")
@@ -581,7 +575,7 @@ async def process_rating_callback(callback: types.CallbackQuery, state: FSMConte
             await state.update_data(
                 viewing_profile_idx=state_data.get('viewing_profile_idx') + 1
             )
-            await show_next_profile(callback.message, state, cfg)
+            await show_next_profile(callback.message, state, cfg, http)
         else:
             await callback.answer(f"Ошибка при отправке оценки: {rating_response.status_code}", show_alert=True)
             await callback.message.answer("Не удалось обработать ваш голос. Попробуйте позже.")
@@ -598,18 +592,17 @@ async def process_rating_callback(callback: types.CallbackQuery, state: FSMConte
 
 
 @router.message(Command("profile"), StateFilter(None))
-async def get_my_profile(message: types.Message, cfg: FromDishka[Config]):
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{cfg.profile_service_url}/profiles/{message.from_user.id}")
-
-        if response.status_code == 200:
-            profile_data = response.json()
-            keyboard = get_my_profile_keyboard()
-            await send_view_profile_msg(profile_data, message, keyboard)
-        elif response.status_code == 404:
-            await message.answer("Сначала вам нужно создать свою анкету. Введите /start")
-        else:
-            await message.answer(f"Не удалось проверить вашу анкету. Ошибка: {response.status_code}")
+async def get_my_profile(message: types.Message, cfg: FromDishka[Config], http: FromDishka[UpstreamClients]):
+    response = await http["profile_service"].get(f"{cfg.profile_service_url}/profiles/{message.from_user.id}")
+
+    if response.status_code == 200:
+        profile_data = response.json()
+        keyboard = get_my_profile_keyboard()
+        await send_view_profile_msg(profile_data, message, keyboard)
+    elif response.status_code == 404:
+        await message.answer("Сначала вам нужно создать свою анкету. Введите /start")
+    else:
+        await message.answer(f"Не удалось проверить вашу анкету. Ошибка: {response.status_code}")
 
 
 @router.callback_query(F.data == 'my_profile-reset')
@@ -625,17 +618,16 @@ async def fill_profile_again(callback: types.CallbackQuery, state: FSMContext):
     )
 
 @router.callback_query(F.data == 'my_profile-delete')
-async def fill_profile_again(callback: types.CallbackQuery, state: FSMContext, cfg: FromDishka[Config]):
-    async with httpx.AsyncClient() as client:
-        response = await client.delete(url=cfg.profile_service_url + f"/profiles/{callback.from_user.id}")
-        if response.status_code not in (200, 204):
-            logging.error('Something went wrong: %s', response.json())
-            await callback.message.answer('Что-то пошло не так, попробуйте позже')
-            return
+async def fill_profile_again(callback: types.CallbackQuery, state: FSMContext, cfg: FromDishka[Config], http: FromDishka[UpstreamClients]):
+    response = await http["profile_service"].delete(url=cfg.profile_service_url + f"/profiles/{callback.from_user.id}")
+    if response.status_code not in (200, 204):
+        logging.error('Something went wrong: %s', response.json())
+        await callback.message.answer('Что-то пошло не так, попробуйте позже')
+        return
 
-        delete_rating_response = await client.delete(url=cfg.rating_service_url + f"/ratings/{callback.from_user.id}")
-        if delete_rating_response.status_code not in (200, 204):
-            logging.error('Something went wrong: %s', delete_rating_response.json())
+    delete_rating_response = await http["rating_service"].delete(url=cfg.rating_service_url + f"/ratings/{callback.from_user.id}")
+    if delete_rating_response.status_code not in (200, 204):
+        logging.error('Something went wrong: %s', delete_rating_response.json())
 
 
     await state.clear()
@@ -648,13 +640,12 @@ async def fill_profile_again(callback: types.CallbackQuery, state: FSMContext, c
 
 
 @router.callback_query(F.data == 'my_profile-stats')
-async def get_my_profile_stats(callback: types.CallbackQuery, cfg: FromDishka[Config]):
-    async with httpx.AsyncClient() as client:
-        response = await client.post(url=cfg.rating_service_url + f"/stats/info/{callback.from_user.id}")
-        if response.status_code not in (200, 204):
-            logging.error('Something went wrong: %s', response.json())
-            await callback.message.answer('Что-то пошло не так, попробуйте позже')
-            return
+async def get_my_profile_stats(callback: types.CallbackQuery, cfg: FromDishka[Config], http: FromDishka[UpstreamClients]):
+    response = await http["rating_service"].post(url=cfg.rating_service_url + f"/stats/info/{callback.from_user.id}")
+    if response.status_code not in (200, 204):
+        logging.error('Something went wrong: %s', response.json())
+        await callback.message.answer('Что-то пошло не так, попробуйте позже')
+        return
 
     stats_data = response.json()
 
@@ -667,6 +658,14 @@ async def get_my_profile_stats(callback: types.CallbackQuery, cfg: FromDishka[Co
         f'Приглашенных друзей: {stats_data["refs_count"]}'
     )
 
+    rank_response = await http["rating_service"].get(f"{cfg.rating_service_url}/ratings/{callback.from_user.id}/rank")
+    if rank_response.status_code == 200:
+        rank_data = rank_response.json()
+        text += (
+            f'\nМесто в рейтинге: {rank_data["rank"]} из {rank_data["total"]} '
+            f'(выше, чем у {rank_data["percentile"]}% анкет)'
+        )
+
     if callback.message.caption:
         return await callback.message.edit_caption(
             caption=text,
@@ -687,13 +686,12 @@ async def get_my_profile_stats(callback: types.CallbackQuery, cfg: FromDishka[Co
 
 
 @router.callback_query(F.data == 'my_profile-stats-back')
-async def back_to_profile(callback: types.CallbackQuery, cfg: FromDishka[Config]):
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{cfg.profile_service_url}/profiles/{callback.from_user.id}")
+async def back_to_profile(callback: types.CallbackQuery, cfg: FromDishka[Config], http: FromDishka[UpstreamClients]):
+    response = await http["profile_service"].get(f"{cfg.profile_service_url}/profiles/{callback.from_user.id}")
 
-        if response.status_code != 200:
-            await callback.message.answer(f"Что-то пошло не так. Ошибка: {response.status_code}")
-            return
+    if response.status_code != 200:
+        await callback.message.answer(f"Что-то пошло не так. Ошибка: {response.status_code}")
+        return
 
     keyboard = get_my_profile_keyboard()
     if callback.message.text or callback.message.caption is None:
@@ -718,25 +716,24 @@ async def back_to_profile(callback: types.CallbackQuery, cfg: FromDishka[Config]
 
 
 @router.callback_query(F.data.startswith("show_username"))
-async def show_username_in_match(callback: types.CallbackQuery, cfg: FromDishka[Config]):
+async def show_username_in_match(callback: types.CallbackQuery, cfg: FromDishka[Config], http: FromDishka[UpstreamClients]):
     watcher_id = callback.from_user.id
     watched_id = callback.data.split(':')[1]
 
-    async with httpx.AsyncClient() as client:
-        watched_user_profile_resp = await client.get(cfg.profile_service_url + f"/profiles/{watched_id}")
-        if watched_user_profile_resp.status_code != 200:
-            logging.warning('Something went wrong during watched user profile retrieving: %s', watched_user_profile_resp.json())
-            return
+    watched_user_profile_resp = await http["profile_service"].get(cfg.profile_service_url + f"/profiles/{watched_id}")
+    if watched_user_profile_resp.status_code != 200:
+        logging.warning('Something went wrong during watched user profile retrieving: %s', watched_user_profile_resp.json())
+        return
 
-        dialog_rating_response = await client.post(
-            cfg.rating_service_url + '/stats/chat',
-            json={
-                'watcher_id': watcher_id,
-                'watched_id': watched_id,
-            }
-        )
-        if dialog_rating_response.status_code != 200:
-            logging.warning('Update rating when opening dialog failed: %s', dialog_rating_response.json())
+    dialog_rating_response = await http["rating_service"].post(
+        cfg.rating_service_url + '/stats/chat',
+        json={
+            'watcher_id': watcher_id,
+            'watched_id': watched_id,
+        }
+    )
+    if dialog_rating_response.status_code != 200:
+        logging.warning('Update rating when opening dialog failed: %s', dialog_rating_response.json())
 
     watcher_user_profile = watched_user_profile_resp.json()
     username = watcher_user_profile['tg_username']
@@ -748,7 +745,8 @@ async def show_username_in_match(callback: types.CallbackQuery, cfg: FromDishka[
 
 
 @router.callback_query(F.data.startswith("my_likers"))
-async def show_username_in_match(callback: types.CallbackQuery, state: FSMContext, bot: Bot, cfg: FromDishka[Config]):
+async def show_username_in_match(callback: types.CallbackQuery, state: FSMContext, bot: Bot, cfg: FromDishka[Config],
+                                 http: FromDishka[UpstreamClients]):
     liker_ids = eval(callback.data.split('-')[1])
     await state.update_data(
         current_likers=liker_ids
@@ -756,11 +754,12 @@ async def show_username_in_match(callback: types.CallbackQuery, state: FSMContex
 
     await callback.message.edit_reply_markup(reply_markup=None)
     await callback.message.answer("Начинаем просмотр анкет лайкеров...")
-    await show_next_liker_profile(callback.message, callback.from_user.id, state, bot, cfg)
+    await show_next_liker_profile(callback.message, callback.from_user.id, state, bot, cfg, http)
 
 
 @router.callback_query(StateFilter(ViewingLikerProfiles.viewing), F.data.startswith("rate_liker:"))
-async def process_rating_callback(callback: types.CallbackQuery, state: FSMContext, bot: Bot, cfg: FromDishka[Config]):
+async def process_rating_callback(callback: types.CallbackQuery, state: FSMContext, bot: Bot, cfg: FromDishka[Config],
+                                  http: FromDishka[UpstreamClients]):
     action = callback.data.split(":")[1]
     current_user_id = callback.from_user.id
     state_data = await state.get_data()
@@ -778,32 +777,31 @@ async def process_rating_callback(callback: types.CallbackQuery, state: FSMConte
         return
 
     try:
-        async with httpx.AsyncClient() as client:
-            liker_profile = await client.get(
-                cfg.profile_service_url + f"/profiles/{current_liker_id}"
-            )
-            liker_profile_data = liker_profile.json()
-            logging.debug('Profile response:', liker_profile_data)
+        liker_profile = await http["profile_service"].get(
+            cfg.profile_service_url + f"/profiles/{current_liker_id}"
+        )
+        liker_profile_data = liker_profile.json()
+        logging.debug('Profile response:', liker_profile_data)
 
 
-            rating_response = await client.post(
-                f"{cfg.rating_service_url}/ratings/{action}",
-                json={
-                    "rater_user_id": current_user_id,
-                    "rated_user_id": current_liker_id
-                }
-            )
-            matching_response = await client.post(
-                f"{cfg.matching_service_url}/match/check",
-                json={
-                    "rater_user_id": current_user_id,
-                    "rated_user_id": current_liker_id,
-                    "rater_username": callback.from_user.username,
-                    "rated_username": liker_profile_data['tg_username'],
-                    "like_type": action
-                }
-            )
-            logging.debug('Matching response:', matching_response.json())
+        rating_response = await http["rating_service"].post(
+            f"{cfg.rating_service_url}/ratings/{action}",
+            json={
+                "rater_user_id": current_user_id,
+                "rated_user_id": current_liker_id
+            }
+        )
+        matching_response = await http["matching_service"].post(
+            f"{cfg.matching_service_url}/match/check",
+            json={
+                "rater_user_id": current_user_id,
+                "rated_user_id": current_liker_id,
+                "rater_username": callback.from_user.username,
+                "rated_username": liker_profile_data['tg_username'],
+                "like_type": action
+            }
+        )
+        logging.debug('Matching response:', matching_response.json())
 
         if rating_response.status_code == 200:
             await callback.answer(f"Вы поставили {('лайк' if action == 'like' else 'дизлайк')}!")
@@ -812,7 +810,7 @@ async def process_rating_callback(callback: types.CallbackQuery, state: FSMConte
             await state.update_data(
                 current_liker_idx=current_liker_idx + 1
             )
-            await show_next_liker_profile(callback.message, current_user_id, state, bot, cfg)
+            await show_next_liker_profile(callback.message, current_user_id, state, bot, cfg, http)
         else:
             await callback.answer(f"Ошибка при отправке оценки: {rating_response.status_code}", show_alert=True)
             await callback.message.answer("Не удалось обработать ваш голос. Попробуйте позже.")
@@ -829,7 +827,7 @@ async def process_rating_callback(callback: types.CallbackQuery, state: FSMConte
         await state.clear()
 
 
-async def show_next_liker_profile(message, liked_id, state, bot, cfg):
+async def show_next_liker_profile(message, liked_id, state, bot, cfg, http):
     data = await state.get_data()
 
     try:
@@ -842,9 +840,8 @@ async def show_next_liker_profile(message, liked_id, state, bot, cfg):
             return
 
         current_liker_id = current_likers[current_liker_idx]
-        async with httpx.AsyncClient() as client:
-            liker_profile_resp = await client.get(f"{cfg.profile_service_url}/profiles/{current_liker_id}")
-            liker_data = liker_profile_resp.json()
+        liker_profile_resp = await http["profile_service"].get(f"{cfg.profile_service_url}/profiles/{current_liker_id}")
+        liker_data = liker_profile_resp.json()
         print(liker_data)
         await send_like_msg(liker_data, bot, liked_id)
 
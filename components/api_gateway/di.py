@@ -1,9 +1,11 @@
 import os
+from collections.abc import AsyncIterable
 
 from dishka import Provider, Scope, make_async_container, provide
 from redis.asyncio import Redis
 
 from components.api_gateway.config import Config, load_config
+from shared.http import UpstreamClients
 
 
 def config_provider() -> Provider:
@@ -23,8 +25,17 @@ class RedisProvider(Provider):
         return Redis.from_url(cfg.redis.uri)
 
 
+class HttpProvider(Provider):
+    @provide(scope=Scope.APP)
+    async def get_upstream_clients(self, cfg: Config) -> AsyncIterable[UpstreamClients]:
+        http = UpstreamClients(cfg.upstreams)
+        yield http
+        await http.close()
+
+
 def setup_di():
     return make_async_container(
         config_provider(),
-        RedisProvider()
+        RedisProvider(),
+        HttpProvider(),
     )
@@ -53,7 +53,10 @@ async def start_polling():
 
     dp.include_router(handler_router)
 
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await container.close()
 
 
 class DTOJSONEncoder(json.JSONEncoder):
@@ -0,0 +1,85 @@
+import argparse
+import asyncio
+
+from loguru import logger
+
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
+
+from components.matching_service.config import Config
+from components.matching_service.di import setup_di
+from components.matching_service.migrations import repartition as repartition_tables
+from components.matching_service.repositories import LikeMatchRepository
+
+
+async def reconcile_counters(args: argparse.Namespace) -> None:
+    container = setup_di()
+    try:
+        sessionmaker = await container.get(async_sessionmaker)
+        async with sessionmaker() as session:
+            users = await LikeMatchRepository(session).reconcile_counters()
+        logger.info(f"Reconciled counters of {users} users")
+    finally:
+        await container.close()
+
+
+async def archive_likes(args: argparse.Namespace) -> None:
+    container = setup_di()
+    try:
+        sessionmaker = await container.get(async_sessionmaker)
+        archived = 0
+        while True:
+            async with sessionmaker() as session:
+                moved = await LikeMatchRepository(session).archive_likes(args.batch_size)
+            archived += moved
+            if moved < args.batch_size:
+                break
+            await asyncio.sleep(args.pause_ms / 1000)
+        logger.info(f"Archived {archived} dislikes from past feed epochs")
+    finally:
+        await container.close()
+
+
+async def repartition(args: argparse.Namespace) -> None:
+    container = setup_di()
+    try:
+        cfg = await container.get(Config)
+        engine = await container.get(AsyncEngine)
+        async with engine.begin() as conn:
+            await repartition_tables(conn, args.partitions or cfg.db.partitions)
+    finally:
+        await container.close()
+
+
+COMMANDS = {
+    "reconcile-counters": reconcile_counters,
+    "archive-likes": archive_likes,
+    "repartition": repartition,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m components.matching_service.commands",
+        description="Maintenance commands of the matching service",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("reconcile-counters", help="recompute user_counters from the likes and matches tables")
+    archive_parser = subparsers.add_parser(
+        "archive-likes",
+        help="move dislikes from feed epochs their liker has left into likes_archive, in small batches",
+    )
+    archive_parser.add_argument("--batch-size", type=int, default=5000)
+    archive_parser.add_argument("--pause-ms", type=int, default=100, help="pause between batches")
+    repartition_parser = subparsers.add_parser(
+        "repartition",
+        help="rebuild likes and matches with a new number of hash partitions; locks both tables while it runs",
+    )
+    repartition_parser.add_argument("--partitions", type=int, help="defaults to db.partitions from the config")
+
+    args = parser.parse_args()
+    logger.info(f"Running {args.command}")
+    asyncio.run(COMMANDS[args.command](args))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,8 @@ from dataclasses import dataclass
 
 import toml
 
+from shared.http import UpstreamConfig, load_upstreams
+
 
 @dataclass
 class DatabaseConfig:
@@ -10,6 +12,7 @@ class DatabaseConfig:
     name: str
     host: str
     port: int
+    partitions: int
 
     def __post_init__(self) -> None:
         self.uri = (
@@ -31,12 +34,77 @@ class RMQConfig:
         )
 
 
+@dataclass
+class RedisConfig:
+    host: str
+    port: int
+
+    def __post_init__(self) -> None:
+        self.uri = (
+            f"redis://{self.host}:{self.port}/"
+        )
+
+
+@dataclass
+class MatchingConfig:
+    backend: str
+    mutual_preferences: bool
+
+
+@dataclass
+class FeedConfig:
+    batch_size: int
+    low_watermark: int
+    ttl_seconds: int
+
+
+@dataclass
+class SeenFilterConfig:
+    capacity: int
+    error_rate: float
+    ttl_seconds: int
+
+
+@dataclass
+class RankingConfig:
+    enabled: bool
+    recency_half_life_days: float
+    weights: dict[str, float]
+
+
+@dataclass
+class LikeWriterConfig:
+    max_batch_size: int
+    max_delay_ms: float
+
+
+@dataclass
+class OutboxConfig:
+    batch_size: int
+    poll_interval_ms: float
+
+
+@dataclass
+class RatingSyncConfig:
+    apply_interval_ms: float
+    prefetch_count: int
+
+
 @dataclass
 class Config:
     profile_service_url: str
     rating_service_url: str
     db: DatabaseConfig
     rabbitmq: RMQConfig
+    redis: RedisConfig
+    matching: MatchingConfig
+    feed: FeedConfig
+    seen: SeenFilterConfig
+    ranking: RankingConfig
+    like_writer: LikeWriterConfig
+    outbox: OutboxConfig
+    rating_sync: RatingSyncConfig
+    upstreams: dict[str, UpstreamConfig]
 
 
 def load_config(config_path: str) -> Config:
@@ -47,4 +115,13 @@ def load_config(config_path: str) -> Config:
         rating_service_url=data["rating_service_url"],
         db=DatabaseConfig(**data["db"]),
         rabbitmq=RMQConfig(**data["rmq"]),
+        redis=RedisConfig(**data["redis"]),
+        matching=MatchingConfig(**data["matching"]),
+        feed=FeedConfig(**data["feed"]),
+        seen=SeenFilterConfig(**data["seen"]),
+        ranking=RankingConfig(**data["ranking"]),
+        like_writer=LikeWriterConfig(**data["like_writer"]),
+        outbox=OutboxConfig(**data["outbox"]),
+        rating_sync=RatingSyncConfig(**data["rating_sync"]),
+        upstreams=load_upstreams(data),
     )
@@ -1,14 +1,24 @@
 import os
-from collections.abc import AsyncGenerator
+from collections.abc import AsyncGenerator, AsyncIterable
 
 from dishka import Provider, Scope, make_async_container, provide
+from redis.asyncio import Redis
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import (AsyncEngine, AsyncSession,
                                     async_sessionmaker, create_async_engine)
 
 from components.matching_service.config import Config, load_config
+from components.matching_service.engine import CandidateSource, ColumnarMatchingEngine, PostgisCandidateSource
+from components.matching_service.migrations import run_migrations
 from components.matching_service.models import Base, Like, Match  # noqa
+from components.matching_service.ranking import RankingPipeline
 from components.matching_service.repositories import LikeMatchRepository
+from components.matching_service.services import (CandidateFeed, LikeWriter, OutboxRelay, RatingSync,
+                                                  SeenFilter)
+from shared.amqp import AMQPClient
+from shared.http import UpstreamClients
+
+AMQP_ROUTES = ("likes", "matches", RatingSync.route)
 
 
 def config_provider() -> Provider:
@@ -27,10 +37,11 @@ class MatchingServiceProvider(Provider):
         return create_async_engine(cfg.db.uri, echo=True)
 
     @provide(scope=Scope.APP)
-    async def get_sessionmaker(self, engine: AsyncEngine) -> async_sessionmaker:
+    async def get_sessionmaker(self, engine: AsyncEngine, cfg: Config) -> async_sessionmaker:
         async with engine.begin() as conn:
-            await conn.run_sync(Base.metadata.create_all)
             await conn.execute(text("CREATE EXTENSION IF NOT EXISTS postgis"))
+            await conn.run_sync(Base.metadata.create_all)
+            await run_migrations(conn, cfg.db.partitions)
         return async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
     @provide(scope=Scope.REQUEST)
@@ -45,6 +56,93 @@ class MatchingServiceProvider(Provider):
     async def get_repository(self, session: AsyncSession) -> LikeMatchRepository:
         return LikeMatchRepository(db=session)
 
+    @provide(scope=Scope.APP)
+    async def get_redis_client(self, cfg: Config) -> AsyncIterable[Redis]:
+        redis = Redis.from_url(cfg.redis.uri)
+        yield redis
+        await redis.aclose()
+
+    @provide(scope=Scope.APP)
+    async def get_seen_filter(
+            self,
+            redis: Redis,
+            sessionmaker: async_sessionmaker,
+            cfg: Config
+    ) -> SeenFilter:
+        return SeenFilter(redis=redis, sessionmaker=sessionmaker, cfg=cfg.seen)
+
+    @provide(scope=Scope.APP)
+    async def get_candidate_source(self, sessionmaker: async_sessionmaker, cfg: Config) -> CandidateSource:
+        if cfg.matching.backend == "memory":
+            engine = ColumnarMatchingEngine(mutual=cfg.matching.mutual_preferences)
+            await engine.load(sessionmaker)
+            return engine
+        return PostgisCandidateSource(sessionmaker, mutual=cfg.matching.mutual_preferences)
+
+    @provide(scope=Scope.APP)
+    async def get_ranking_pipeline(
+            self,
+            source: CandidateSource,
+            seen: SeenFilter,
+            cfg: Config
+    ) -> RankingPipeline:
+        return RankingPipeline(source=source, seen=seen, cfg=cfg.ranking)
+
+    @provide(scope=Scope.APP)
+    async def get_candidate_feed(
+            self,
+            redis: Redis,
+            pipeline: RankingPipeline,
+            cfg: Config
+    ) -> AsyncIterable[CandidateFeed]:
+        feed = CandidateFeed(redis=redis, pipeline=pipeline, cfg=cfg.feed)
+        yield feed
+        await feed.close()
+
+    @provide(scope=Scope.APP)
+    async def get_like_writer(self, sessionmaker: async_sessionmaker, cfg: Config) -> AsyncIterable[LikeWriter]:
+        writer = LikeWriter(sessionmaker=sessionmaker, cfg=cfg.like_writer)
+        yield writer
+        await writer.close()
+
+    @provide(scope=Scope.APP)
+    async def get_upstream_clients(self, cfg: Config) -> AsyncIterable[UpstreamClients]:
+        http = UpstreamClients(cfg.upstreams)
+        yield http
+        await http.close()
+
+    @provide(scope=Scope.APP)
+    async def get_amqp_client(self, cfg: Config) -> AsyncIterable[AMQPClient]:
+        amqp = AMQPClient(cfg.rabbitmq.uri, routes=AMQP_ROUTES)
+        await amqp.connect()
+        yield amqp
+        await amqp.close()
+
+    @provide(scope=Scope.APP)
+    async def get_outbox_relay(
+            self,
+            sessionmaker: async_sessionmaker,
+            amqp: AMQPClient,
+            cfg: Config
+    ) -> AsyncIterable[OutboxRelay]:
+        relay = OutboxRelay(sessionmaker=sessionmaker, amqp=amqp, cfg=cfg.outbox)
+        relay.start()
+        yield relay
+        await relay.close()
+
+    @provide(scope=Scope.APP)
+    async def get_rating_sync(
+            self,
+            sessionmaker: async_sessionmaker,
+            amqp: AMQPClient,
+            source: CandidateSource,
+            cfg: Config
+    ) -> AsyncIterable[RatingSync]:
+        sync = RatingSync(sessionmaker=sessionmaker, amqp=amqp, source=source, cfg=cfg.rating_sync)
+        await sync.start()
+        yield sync
+        await sync.close()
+
 
 def setup_di():
     return make_async_container(
@@ -0,0 +1,219 @@
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import NamedTuple
+
+import numpy as np
+from geoalchemy2.shape import to_shape
+from loguru import logger
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.future import select
+
+from components.matching_service.models import UserInfo
+from components.matching_service.repositories import LikeMatchRepository, MAX_RADIUS_KM
+
+EARTH_RADIUS_M = 6371008.8
+ANY_GENDER = 0
+
+
+class Candidate(NamedTuple):
+    user_id: int
+    distance: float
+    rating: float
+
+    @property
+    def key(self) -> tuple[float, float, int]:
+        """Keyset position of the candidate in (distance, rating desc, user_id) order"""
+        return self.distance, self.rating, self.user_id
+
+
+class CandidateSource(ABC):
+    """Ranked candidate lookup used to fill viewers' feeds."""
+
+    @abstractmethod
+    async def find_matching_users(
+            self,
+            user_id: int,
+            after: tuple[float, float, int] | None = None,
+            limit: int = 50
+    ) -> list[Candidate]:
+        ...
+
+    @abstractmethod
+    async def fetch_features(self, viewer_id: int, user_ids: list[int]) -> dict[str, np.ndarray]:
+        """Returns distance, rating and age_seconds columns aligned with user_ids"""
+
+    @abstractmethod
+    def upsert(self, info: UserInfo) -> None:
+        """Takes a changed user_infos row into account"""
+
+    @abstractmethod
+    def update_ratings(self, ratings: dict[int, float]) -> None:
+        """Takes new ratings into account"""
+
+
+class PostgisCandidateSource(CandidateSource):
+    def __init__(self, sessionmaker: async_sessionmaker, mutual: bool = False):
+        self.sessionmaker = sessionmaker
+        self.mutual = mutual
+
+    async def find_matching_users(
+            self,
+            user_id: int,
+            after: tuple[float, float, int] | None = None,
+            limit: int = 50
+    ) -> list[Candidate]:
+        async with self.sessionmaker() as session:
+            rows = await LikeMatchRepository(session).find_matching_users(user_id, after, limit, mutual=self.mutual)
+        return [Candidate(row.user_id, row.distance, row.rating) for row in rows]
+
+    # candidates are queried from user_infos directly, so there is nothing to keep in sync
+    def upsert(self, info: UserInfo) -> None:
+        pass
+
+    def update_ratings(self, ratings: dict[int, float]) -> None:
+        pass
+
+    async def fetch_features(self, viewer_id: int, user_ids: list[int]) -> dict[str, np.ndarray]:
+        async with self.sessionmaker() as session:
+            rows = await LikeMatchRepository(session).get_candidate_features(viewer_id, user_ids)
+
+        by_id = {row.user_id: row for row in rows}
+        now = datetime.now()
+        return {
+            "distance": np.array([by_id[i].distance for i in user_ids], dtype=np.float64),
+            "rating": np.array([by_id[i].rating or 0 for i in user_ids], dtype=np.float64),
+            "age_seconds": np.array(
+                [(now - by_id[i].updated_at).total_seconds() if by_id[i].updated_at else np.inf for i in user_ids],
+                dtype=np.float64
+            ),
+        }
+
+
+class ColumnarMatchingEngine(CandidateSource):
+    """In-memory copy of user_infos stored as NumPy columns.
+
+    A query is a vectorized haversine over every row, boolean masks for
+    the preferences and an argpartition for the next limit rows after the
+    keyset position, so it never touches Postgres. Rows are kept current through upsert()
+    and update_ratings(); the state is per process.
+    """
+
+    def __init__(self, mutual: bool = False, capacity: int = 1024):
+        self.mutual = mutual
+        self._size = 0
+        self._index: dict[int, int] = {}
+        self._gender_codes: dict[str, int] = {"any": ANY_GENDER}
+        self._allocate(capacity)
+
+    def _allocate(self, capacity: int) -> None:
+        columns = {
+            "user_id": np.zeros(capacity, dtype=np.int64),
+            "lat": np.full(capacity, np.nan, dtype=np.float64),
+            "lon": np.full(capacity, np.nan, dtype=np.float64),
+            "age": np.zeros(capacity, dtype=np.int16),
+            "gender": np.zeros(capacity, dtype=np.int8),
+            "preferred_gender": np.zeros(capacity, dtype=np.int8),
+            "preferred_min_age": np.zeros(capacity, dtype=np.int16),
+            "preferred_max_age": np.zeros(capacity, dtype=np.int16),
+            "rating": np.zeros(capacity, dtype=np.float32),
+            "updated_at": np.zeros(capacity, dtype=np.float64),
+        }
+        for name, column in columns.items():
+            if hasattr(self, name):
+                column[:self._size] = getattr(self, name)[:self._size]
+            setattr(self, name, column)
+
+    def _gender_code(self, gender: str | None) -> int:
+        if gender is None:
+            return -1
+        return self._gender_codes.setdefault(gender, len(self._gender_codes))
+
+    async def load(self, sessionmaker: async_sessionmaker) -> None:
+        async with sessionmaker() as session:
+            result = await session.stream(select(UserInfo))
+            async for info in result.scalars():
+                self.upsert(info)
+        logger.info(f"Loaded {self._size} user infos into the columnar matching engine")
+
+    def upsert(self, info: UserInfo) -> None:
+        row = self._index.get(info.user_id)
+        if row is None:
+            if self._size == len(self.user_id):
+                self._allocate(len(self.user_id) * 2)
+            row = self._size
+            self._index[info.user_id] = row
+            self._size += 1
+
+        self.user_id[row] = info.user_id
+        if info.location is not None:
+            point = to_shape(info.location)
+            self.lat[row] = np.radians(point.y)
+            self.lon[row] = np.radians(point.x)
+        self.age[row] = info.age or 0
+        self.gender[row] = self._gender_code(info.gender)
+        self.preferred_gender[row] = self._gender_code(info.preferred_gender)
+        self.preferred_min_age[row] = info.preferred_min_age or 0
+        self.preferred_max_age[row] = info.preferred_max_age or 0
+        self.rating[row] = info.rating or 0
+        self.updated_at[row] = (info.updated_at or datetime.now()).timestamp()
+
+    def update_ratings(self, ratings: dict[int, float]) -> None:
+        for user_id, rating in ratings.items():
+            row = self._index.get(user_id)
+            if row is not None:
+                self.rating[row] = rating
+
+    async def find_matching_users(
+            self,
+            user_id: int,
+            after: tuple[float, float, int] | None = None,
+            limit: int = 50
+    ) -> list[Candidate]:
+        viewer = self._index.get(user_id)
+        if viewer is None or np.isnan(self.lat[viewer]):
+            return []
+
+        n = self._size
+        distance = self._distances(viewer, slice(0, n))
+        rating, user_ids = self.rating[:n], self.user_id[:n]
+
+        mask = distance <= MAX_RADIUS_KM * 1000
+        mask &= (self.age[:n] >= self.preferred_min_age[viewer]) & (self.age[:n] <= self.preferred_max_age[viewer])
+        if self.preferred_gender[viewer] != ANY_GENDER:
+            mask &= self.gender[:n] == self.preferred_gender[viewer]
+        if self.mutual:
+            mask &= (self.preferred_gender[:n] == self.gender[viewer]) | (self.preferred_gender[:n] == ANY_GENDER)
+            mask &= (self.preferred_min_age[:n] <= self.age[viewer]) & (self.preferred_max_age[:n] >= self.age[viewer])
+        if after:
+            after_distance, after_rating, after_user_id = after
+            mask &= (distance > after_distance) | (distance == after_distance) & (
+                (rating < after_rating) | (rating == after_rating) & (user_ids > after_user_id)
+            )
+        mask[viewer] = False
+
+        rows = np.flatnonzero(mask)
+        if len(rows) > limit:
+            # keep ties at the cut-off distance, lexsort orders them below
+            cutoff = np.partition(distance[rows], limit - 1)[limit - 1]
+            rows = rows[distance[rows] <= cutoff]
+        rows = rows[np.lexsort((user_ids[rows], -rating[rows], distance[rows]))][:limit]
+
+        return [
+            Candidate(int(user_ids[row]), float(distance[row]), float(rating[row]))
+            for row in rows
+        ]
+
+    async def fetch_features(self, viewer_id: int, user_ids: list[int]) -> dict[str, np.ndarray]:
+        rows = np.array([self._index[user_id] for user_id in user_ids], dtype=np.int64)
+        return {
+            "distance": self._distances(self._index[viewer_id], rows),
+            "rating": self.rating[rows].astype(np.float64),
+            "age_seconds": datetime.now().timestamp() - self.updated_at[rows],
+        }
+
+    def _distances(self, viewer: int, rows) -> np.ndarray:
+        lat, lon = self.lat[rows], self.lon[rows]
+        sin_dlat = np.sin((lat - self.lat[viewer]) / 2)
+        sin_dlon = np.sin((lon - self.lon[viewer]) / 2)
+        a = sin_dlat ** 2 + np.cos(self.lat[viewer]) * np.cos(lat) * sin_dlon ** 2
+        return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
@@ -0,0 +1,70 @@
+import math
+
+GEOCELL_PRECISION = 4
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_KM_PER_DEGREE = 111.32
+
+
+def encode_geohash(latitude: float, longitude: float, precision: int = GEOCELL_PRECISION) -> str:
+    """Geohash of the point, the same as PostGIS ST_GeoHash returns"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    cell = []
+    char, bit = 0, 0
+
+    for i in range(precision * 5):
+        value_range, value = (lon_range, longitude) if i % 2 == 0 else (lat_range, latitude)
+        mid = (value_range[0] + value_range[1]) / 2
+        char <<= 1
+        if value >= mid:
+            char |= 1
+            value_range[0] = mid
+        else:
+            value_range[1] = mid
+
+        bit += 1
+        if bit == 5:
+            cell.append(_BASE32[char])
+            char, bit = 0, 0
+
+    return "".join(cell)
+
+
+def _cell_size(precision: int) -> tuple[float, float]:
+    lon_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def covering_geocells(
+        latitude: float,
+        longitude: float,
+        radius_km: float,
+        precision: int = GEOCELL_PRECISION
+) -> list[str]:
+    """Geohash cells covering the circle of radius_km around the point"""
+    lat_step, lon_step = _cell_size(precision)
+
+    lat_delta = radius_km / _KM_PER_DEGREE
+    min_lat = max(latitude - lat_delta, -90.0)
+    max_lat = min(latitude + lat_delta, 90.0)
+
+    widest_lat = min(max(abs(min_lat), abs(max_lat)), 89.9)
+    lon_delta = min(radius_km / (_KM_PER_DEGREE * math.cos(math.radians(widest_lat))), 180.0)
+
+    cells = set()
+    lat = min_lat
+    while True:
+        lon = longitude - lon_delta
+        while True:
+            wrapped_lon = (lon + 180.0) % 360.0 - 180.0
+            cells.add(encode_geohash(min(lat, 90.0 - 1e-9), wrapped_lon, precision))
+            if lon >= longitude + lon_delta:
+                break
+            lon = min(lon + lon_step, longitude + lon_delta)
+        if lat >= max_lat:
+            break
+        lat = min(lat + lat_step, max_lat)
+
+    return sorted(cells)
@@ -8,7 +8,9 @@ from loguru import logger
 from prometheus_fastapi_instrumentator import Instrumentator
 
 from components.matching_service.di import setup_di
+from components.matching_service.engine import CandidateSource
 from components.matching_service.routers import router as rating_router
+from components.matching_service.services import OutboxRelay, RatingSync
 from shared.logging_config import setup_logging
 
 SERVICE_NAME = "matching-service"
@@ -17,6 +19,9 @@ setup_logging(SERVICE_NAME)
 
 @asynccontextmanager
 async def lifespan(app_: FastAPI) -> AsyncGenerator[None, None]:
+    await app_.container.get(CandidateSource)
+    await app_.container.get(OutboxRelay)
+    await app_.container.get(RatingSync)
     yield
 
     await app_.container.close()
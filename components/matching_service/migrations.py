@@ -0,0 +1,223 @@
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from components.matching_service.geo import GEOCELL_PRECISION
+from components.matching_service.models import DISLIKE, LIKE
+from components.matching_service.repositories import counters_aggregate_sql
+
+# create_all() only creates missing tables, so changes to existing tables
+# are applied here. Every statement must be safe to run on each startup.
+MIGRATIONS = [
+    # user_infos.location: geometry -> geography, so that `<->` and
+    # ST_DWithin work in metres on the sphere
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'user_infos'
+              AND column_name = 'location'
+              AND udt_name = 'geometry'
+        ) THEN
+            ALTER TABLE user_infos
+                ALTER COLUMN location TYPE geography(Point, 4326)
+                USING location::geography;
+        END IF;
+    END $$
+    """,
+    # user_infos.geocell + (gender, geocell, age) index for candidate retrieval
+    f"ALTER TABLE user_infos ADD COLUMN IF NOT EXISTS geocell VARCHAR({GEOCELL_PRECISION})",
+    f"""
+    UPDATE user_infos
+    SET geocell = ST_GeoHash(location::geometry, {GEOCELL_PRECISION})
+    WHERE geocell IS NULL AND location IS NOT NULL
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_user_candidate ON user_infos (gender, geocell, age)",
+    # candidate-side preferred_gender, for two-sided filtering
+    """
+    CREATE INDEX IF NOT EXISTS idx_user_candidate_mutual
+        ON user_infos (gender, preferred_gender, geocell, age)
+    """,
+    # user_infos.updated_at, the recency feature of the ranking pipeline
+    "ALTER TABLE user_infos ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT now()",
+    # likes: (liker, liked) primary key and a smallint reaction instead of
+    # like_type; keeps the latest swipe of each pair, loaded in time order
+    # for the BRIN index, and empties user_counters to be refilled below
+    f"""
+    DO $$
+    BEGIN
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'likes' AND column_name = 'like_type'
+        ) THEN
+            CREATE TABLE likes_compact (
+                liker_telegram_id BIGINT NOT NULL,
+                liked_telegram_id BIGINT NOT NULL,
+                reaction SMALLINT NOT NULL,
+                created_at TIMESTAMP NOT NULL DEFAULT now(),
+                CONSTRAINT likes_compact_pkey PRIMARY KEY (liker_telegram_id, liked_telegram_id)
+            );
+            INSERT INTO likes_compact
+            SELECT * FROM (
+                SELECT DISTINCT ON (liker_telegram_id, liked_telegram_id)
+                    liker_telegram_id,
+                    liked_telegram_id,
+                    CASE like_type WHEN 'like' THEN {LIKE} ELSE {DISLIKE} END,
+                    created_at
+                FROM likes
+                ORDER BY liker_telegram_id, liked_telegram_id, created_at DESC
+            ) latest
+            ORDER BY created_at;
+
+            DROP TABLE likes;
+            ALTER TABLE likes_compact RENAME TO likes;
+            ALTER TABLE likes RENAME CONSTRAINT likes_compact_pkey TO likes_pkey;
+            TRUNCATE user_counters;
+        END IF;
+    END $$
+    """,
+    # hash partitioning of likes and matches; the partition count comes
+    # from the matching.partitions setting (see run_migrations)
+    """
+    CREATE OR REPLACE FUNCTION create_hash_partitions(parent text, partitions int) RETURNS void AS $$
+    BEGIN
+        FOR i IN 0 .. partitions - 1 LOOP
+            EXECUTE format(
+                'CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES WITH (MODULUS %s, REMAINDER %s)',
+                parent || '_p' || i, parent, partitions, i
+            );
+        END LOOP;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    # copies parent into a new table with the given number of hash
+    # partitions and swaps it in; secondary indexes are recreated by the
+    # CREATE INDEX IF NOT EXISTS statements below
+    """
+    CREATE OR REPLACE FUNCTION hash_repartition(parent text, key text, pk text, partitions int) RETURNS void AS $$
+    DECLARE
+        staging text := parent || '_repartitioned';
+    BEGIN
+        EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS) PARTITION BY HASH (%I)', staging, parent, key);
+        PERFORM create_hash_partitions(staging, partitions);
+        EXECUTE format('INSERT INTO %I SELECT * FROM %I', staging, parent);
+        EXECUTE format('DROP TABLE %I', parent);
+        EXECUTE format('ALTER TABLE %I RENAME TO %I', staging, parent);
+        FOR i IN 0 .. partitions - 1 LOOP
+            EXECUTE format('ALTER TABLE %I RENAME TO %I', staging || '_p' || i, parent || '_p' || i);
+        END LOOP;
+        EXECUTE format('ALTER TABLE %I ADD PRIMARY KEY (%s)', parent, pk);
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    # matches: one row per user instead of one per pair
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'matches' AND column_name = 'user1_telegram_id'
+        ) THEN
+            ALTER TABLE matches RENAME TO matches_pairs;
+            ALTER TABLE matches_pairs RENAME CONSTRAINT matches_pkey TO matches_pairs_pkey;
+            CREATE TABLE matches (
+                user_telegram_id BIGINT NOT NULL,
+                partner_telegram_id BIGINT NOT NULL,
+                partner_username VARCHAR NOT NULL,
+                matched_at TIMESTAMP DEFAULT now(),
+                CONSTRAINT matches_pkey PRIMARY KEY (user_telegram_id, partner_telegram_id)
+            ) PARTITION BY HASH (user_telegram_id);
+            PERFORM create_hash_partitions('matches', current_setting('matching.partitions')::int);
+
+            INSERT INTO matches
+            SELECT user1_telegram_id, user2_telegram_id, user2_username, matched_at FROM matches_pairs
+            UNION ALL
+            SELECT user2_telegram_id, user1_telegram_id, user1_username, matched_at FROM matches_pairs
+            ON CONFLICT DO NOTHING;
+            DROP TABLE matches_pairs;
+        END IF;
+    END $$
+    """,
+    # likes: plain table -> partitioned by liker
+    """
+    DO $$
+    BEGIN
+        IF (SELECT relkind FROM pg_class WHERE oid = 'likes'::regclass) = 'r' THEN
+            PERFORM hash_repartition(
+                'likes', 'liker_telegram_id', 'liker_telegram_id, liked_telegram_id',
+                current_setting('matching.partitions')::int
+            );
+        END IF;
+    END $$
+    """,
+    # partitions of tables just created by create_all()
+    """
+    SELECT create_hash_partitions(parent, current_setting('matching.partitions')::int)
+    FROM unnest(ARRAY['likes', 'matches']) AS parent
+    WHERE NOT EXISTS (SELECT 1 FROM pg_inherits WHERE inhparent = parent::regclass)
+    """,
+    # feed epochs: a feed reset bumps user_infos.feed_epoch instead of
+    # deleting the viewer's likes
+    "ALTER TABLE user_infos ADD COLUMN IF NOT EXISTS feed_epoch INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE likes ADD COLUMN IF NOT EXISTS feed_epoch INTEGER NOT NULL DEFAULT 0",
+    """
+    CREATE INDEX IF NOT EXISTS idx_liked_liker
+        ON likes (liked_telegram_id, liker_telegram_id) INCLUDE (reaction)
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_like_created_brin ON likes USING brin (created_at)",
+    # user_infos.rating_changed_at, keeps RatingSync from applying an older rating
+    "ALTER TABLE user_infos ADD COLUMN IF NOT EXISTS rating_changed_at DOUBLE PRECISION",
+    """
+    CREATE INDEX IF NOT EXISTS idx_match_user_time
+        ON matches (user_telegram_id, matched_at, partner_telegram_id)
+    """,
+    # initial fill of user_counters, the reconcile-counters command redoes it
+    f"""
+    INSERT INTO user_counters (
+        user_id, likes_given, dislikes_given, likes_received, dislikes_received, matches_count
+    )
+    SELECT * FROM ({counters_aggregate_sql()}) counts
+    WHERE NOT EXISTS (SELECT 1 FROM user_counters)
+    """,
+]
+
+
+# partitioned table -> (partition key, primary key)
+PARTITIONED_TABLES = {
+    "likes": ("liker_telegram_id", "liker_telegram_id, liked_telegram_id"),
+    "matches": ("user_telegram_id", "user_telegram_id, partner_telegram_id"),
+}
+
+
+async def run_migrations(conn: AsyncConnection, partitions: int) -> None:
+    await conn.execute(text("SELECT set_config('matching.partitions', :partitions, true)"), {"partitions": str(partitions)})
+    for statement in MIGRATIONS:
+        await conn.execute(text(statement))
+
+    result = await conn.execute(
+        text("""
+        SELECT inhparent::regclass::text, count(*)
+        FROM pg_inherits
+        WHERE inhparent::regclass::text = ANY(CAST(:tables AS TEXT[]))
+        GROUP BY inhparent
+        """),
+        {"tables": list(PARTITIONED_TABLES)}
+    )
+    for table, count in result.all():
+        if count != partitions:
+            logger.warning(
+                f"{table} has {count} partitions, config asks for {partitions}; "
+                f"run 'python -m components.matching_service.commands repartition'"
+            )
+
+
+async def repartition(conn: AsyncConnection, partitions: int) -> None:
+    """Rebuilds every partitioned table with the given number of partitions"""
+    for table, (key, primary_key) in PARTITIONED_TABLES.items():
+        logger.info(f"Repartitioning {table} into {partitions} partitions")
+        await conn.execute(
+            text("SELECT hash_repartition(:table, :key, :primary_key, :partitions)"),
+            {"table": table, "key": key, "primary_key": primary_key, "partitions": partitions}
+        )
+    await run_migrations(conn, partitions)
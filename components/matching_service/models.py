@@ -1,45 +1,100 @@
-from geoalchemy2 import Geometry
-from sqlalchemy import Column, Integer, BigInteger, String, TIMESTAMP, Index, Float
+from geoalchemy2 import Geography
+from sqlalchemy import Column, Integer, BigInteger, SmallInteger, String, TIMESTAMP, Index, Float
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 
+from components.matching_service.geo import GEOCELL_PRECISION
+
 Base = declarative_base()
 
+DISLIKE = 0
+LIKE = 1
+REACTIONS = {'dislike': DISLIKE, 'like': LIKE}
+
 
 class Like(Base):
     __tablename__ = 'likes'
     __table_args__ = (
-        Index('idx_liker', 'liker_telegram_id'),
-        Index('idx_liked', 'liked_telegram_id'),
+        Index('idx_liked_liker', 'liked_telegram_id', 'liker_telegram_id', postgresql_include=['reaction']),
+        Index('idx_like_created_brin', 'created_at', postgresql_using='brin'),
+        {'postgresql_partition_by': 'HASH (liker_telegram_id)'},
     )
 
-    liker_telegram_id = Column(BigInteger, primary_key=True, nullable=False)
-    liked_telegram_id = Column(BigInteger, primary_key=True, nullable=False)
-    like_type = Column(String(10), nullable=False)
-    created_at = Column(TIMESTAMP, server_default=func.now(), primary_key=True, nullable=False)
+    liker_telegram_id = Column(BigInteger, primary_key=True)
+    liked_telegram_id = Column(BigInteger, primary_key=True)
+    reaction = Column(SmallInteger, nullable=False)
+    created_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
+    # the liker's feed_epoch at the time of the swipe
+    feed_epoch = Column(Integer, server_default="0", nullable=False)
+
+
+class LikeArchive(Base):
+    """Dislikes from feed epochs the liker has left, moved out of likes by the archive-likes command"""
+    __tablename__ = 'likes_archive'
+
+    liker_telegram_id = Column(BigInteger, primary_key=True)
+    liked_telegram_id = Column(BigInteger, primary_key=True)
+    feed_epoch = Column(Integer, primary_key=True)
+    reaction = Column(SmallInteger, nullable=False)
+    created_at = Column(TIMESTAMP, nullable=False)
+    archived_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
 
 
 class Match(Base):
+    """One row per side of a match, so every per-user query hits a single partition"""
     __tablename__ = 'matches'
+    __table_args__ = (
+        Index('idx_match_user_time', 'user_telegram_id', 'matched_at', 'partner_telegram_id'),
+        {'postgresql_partition_by': 'HASH (user_telegram_id)'},
+    )
 
-    user1_telegram_id = Column(BigInteger, primary_key=True, nullable=False)
-    user2_telegram_id = Column(BigInteger, primary_key=True, nullable=False)
-    user1_username = Column(String, primary_key=True, nullable=False)
-    user2_username = Column(String, primary_key=True, nullable=False)
+    user_telegram_id = Column(BigInteger, primary_key=True)
+    partner_telegram_id = Column(BigInteger, primary_key=True)
+    partner_username = Column(String, nullable=False)
     matched_at = Column(TIMESTAMP, server_default=func.now())
 
 
+class UserCounter(Base):
+    __tablename__ = 'user_counters'
+
+    user_id = Column(BigInteger, primary_key=True)
+    likes_given = Column(Integer, nullable=False, server_default='0')
+    dislikes_given = Column(Integer, nullable=False, server_default='0')
+    likes_received = Column(Integer, nullable=False, server_default='0')
+    dislikes_received = Column(Integer, nullable=False, server_default='0')
+    matches_count = Column(Integer, nullable=False, server_default='0')
+
+
+class OutboxEvent(Base):
+    __tablename__ = 'outbox'
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    routing_key = Column(String, nullable=False)
+    payload = Column(JSONB, nullable=False)
+    created_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
+
+
 class UserInfo(Base):
     __tablename__ = "user_infos"
     __table_args__ = (
         Index('idx_user_location', 'location', postgresql_using='gist'),
+        Index('idx_user_candidate', 'gender', 'geocell', 'age'),
+        Index('idx_user_candidate_mutual', 'gender', 'preferred_gender', 'geocell', 'age'),
     )
 
     user_id = Column(BigInteger, primary_key=True)
     age = Column(Integer)
     gender = Column(String)
     rating = Column(Float)
+    # epoch seconds of the rating_service change rating came from, an older
+    # change arriving later is not applied
+    rating_changed_at = Column(Float)
     preferred_gender = Column(String)
     preferred_min_age = Column(Integer)
     preferred_max_age = Column(Integer)
-    location = Column(Geometry(geometry_type="POINT", srid=4326))
+    location = Column(Geography(geometry_type="POINT", srid=4326))
+    geocell = Column(String(GEOCELL_PRECISION))
+    updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
+    # bumped by a feed reset; swipes from earlier epochs no longer hide candidates
+    feed_epoch = Column(Integer, server_default="0", nullable=False)
@@ -0,0 +1,111 @@
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from loguru import logger
+from prometheus_client import Histogram
+
+from components.matching_service.config import RankingConfig
+from components.matching_service.engine import CandidateSource
+from components.matching_service.services import SeenFilter
+
+STAGE_LATENCY = Histogram(
+    "matching_ranking_stage_seconds",
+    "Latency of each stage of the matching feed ranking pipeline",
+    ["stage"],
+)
+
+
+def _normalize(values: np.ndarray) -> np.ndarray:
+    values = np.nan_to_num(values, nan=0.0, posinf=0.0, neginf=0.0)
+    span = values.max() - values.min()
+    if span == 0:
+        return np.zeros_like(values)
+    return (values - values.min()) / span
+
+
+class RankingPipeline:
+    """Builds the next batch of a viewer's feed.
+
+    Stages: candidate generation (nearest eligible users, minus the
+    viewer's seen filter), one batched feature fetch for the whole batch,
+    vectorized scoring as a weighted sum of normalized features and
+    selection in score order. Every scanned candidate stays in the feed,
+    so the batch itself is the top-K. Features with a zero weight are
+    not scored; with ranking disabled the generation order is kept.
+    """
+
+    def __init__(self, source: CandidateSource, seen: SeenFilter, cfg: RankingConfig):
+        self.source = source
+        self.seen = seen
+        self.cfg = cfg
+        self.scorers = {
+            "distance": lambda features: 1 - _normalize(features["distance"]),
+            "rating": lambda features: _normalize(features["rating"]),
+            "recency": lambda features: 0.5 ** (
+                features["age_seconds"] / (self.cfg.recency_half_life_days * 24 * 60 * 60)
+            ),
+        }
+        unknown = set(cfg.weights) - set(self.scorers)
+        if unknown:
+            raise ValueError(
+                f"Unknown [ranking].weights {', '.join(sorted(unknown))}, expected some of {', '.join(self.scorers)}"
+            )
+
+    @contextmanager
+    def _stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            STAGE_LATENCY.labels(stage=name).observe(elapsed)
+            logger.debug(f"Ranking stage {name} took {elapsed * 1000:.1f} ms")
+
+    async def next_batch(
+            self,
+            viewer_id: int,
+            after: tuple[float, float, int] | None,
+            size: int
+    ) -> tuple[list[int], tuple[float, float, int] | None, bool]:
+        """Returns ranked candidate ids, keyset position of the last scanned candidate and exhaustion flag"""
+        with self._stage("generate"):
+            candidate_ids, after, exhausted = await self._generate(viewer_id, after, size)
+
+        weights = {name: weight for name, weight in self.cfg.weights.items() if weight}
+        if not self.cfg.enabled or not weights or len(candidate_ids) < 2:
+            return candidate_ids, after, exhausted
+
+        with self._stage("features"):
+            features = await self.source.fetch_features(viewer_id, candidate_ids)
+
+        with self._stage("score"):
+            scores = np.zeros(len(candidate_ids), dtype=np.float64)
+            for name, weight in weights.items():
+                scores += weight * self.scorers[name](features)
+
+        with self._stage("select"):
+            ids = np.array(candidate_ids, dtype=np.int64)
+            ranked = ids[np.argsort(-scores, kind="stable")].tolist()
+
+        return ranked, after, exhausted
+
+    async def _generate(
+            self,
+            viewer_id: int,
+            after: tuple[float, float, int] | None,
+            size: int
+    ) -> tuple[list[int], tuple[float, float, int] | None, bool]:
+        exhausted, candidate_ids = False, []
+        while len(candidate_ids) < size and not exhausted:
+            batch = await self.source.find_matching_users(user_id=viewer_id, after=after, limit=size)
+            exhausted = len(batch) < size
+            if not batch:
+                break
+            after = batch[-1].key
+
+            batch_ids = [candidate.user_id for candidate in batch]
+            seen = await self.seen.contains_many(viewer_id, batch_ids)
+            candidate_ids.extend(profile_id for profile_id, is_seen in zip(batch_ids, seen) if not is_seen)
+
+        return candidate_ids, after, exhausted
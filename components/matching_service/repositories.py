@@ -1,11 +1,247 @@
-from geoalchemy2 import WKTElement
 from geoalchemy2.functions import ST_Distance, ST_DWithin
+from geoalchemy2.shape import to_shape
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import and_, or_, func, case, delete
+from loguru import logger
+from sqlalchemy import BigInteger, Float, and_, column, func, delete, or_, text, tuple_, update, values
+from sqlalchemy.orm import aliased
 from datetime import datetime
 
-from components.matching_service.models import Like, Match, UserInfo
+from components.matching_service.geo import covering_geocells, encode_geohash
+from components.matching_service.models import (DISLIKE, LIKE, REACTIONS, Like, LikeArchive, Match, OutboxEvent, UserCounter,
+                                                UserInfo)
+from components.matching_service.schemas import LikeDislikePayload, LikeResult, UserMatch
+
+MAX_RADIUS_KM = 100
+
+# Stores a batch of swipes and creates the matches they form in a single
+# statement. A repeated swipe on the same person replaces the previous
+# reaction, and only the last swipe of a pair in the batch is stored. A
+# like forms a match when the reciprocal like was stored before the batch
+# or comes earlier in the same batch (ord); the data modifying CTEs do not
+# see each other's rows, so `likes` is read as it was before the batch. Of
+# several swipes forming the same match only the first one gets "match".
+# user_counters gets the new reactions minus the replaced ones and the new
+# matches, and like and match events go to the outbox, all in the same
+# statement. Each stored swipe is stamped with the liker's feed epoch.
+LIKE_BATCH_SQL = f"""
+WITH batch AS (
+    SELECT *
+    FROM unnest(
+        CAST(:liker_ids AS BIGINT[]),
+        CAST(:liked_ids AS BIGINT[]),
+        CAST(:reactions AS SMALLINT[]),
+        CAST(:liker_usernames AS VARCHAR[]),
+        CAST(:liked_usernames AS VARCHAR[])
+    ) WITH ORDINALITY AS b(liker_id, liked_id, reaction, liker_username, liked_username, ord)
+),
+latest AS (
+    SELECT DISTINCT ON (liker_id, liked_id) liker_id, liked_id, reaction
+    FROM batch
+    ORDER BY liker_id, liked_id, ord DESC
+),
+previous AS (
+    SELECT t.liker_id, t.liked_id, l.reaction
+    FROM latest t
+    JOIN likes l ON l.liker_telegram_id = t.liker_id AND l.liked_telegram_id = t.liked_id
+),
+upserted AS (
+    INSERT INTO likes (liker_telegram_id, liked_telegram_id, reaction, created_at, feed_epoch)
+    SELECT t.liker_id, t.liked_id, t.reaction, CAST(:created_at AS TIMESTAMP), coalesce(u.feed_epoch, 0)
+    FROM latest t
+    LEFT JOIN user_infos u ON u.user_id = t.liker_id
+    ON CONFLICT (liker_telegram_id, liked_telegram_id) DO UPDATE
+        SET reaction = EXCLUDED.reaction, created_at = EXCLUDED.created_at, feed_epoch = EXCLUDED.feed_epoch
+),
+decided AS (
+    SELECT
+        b.*,
+        LEAST(b.liker_id, b.liked_id) AS user1_id,
+        GREATEST(b.liker_id, b.liked_id) AS user2_id,
+        EXISTS (
+            SELECT 1 FROM matches m
+            WHERE m.user_telegram_id = b.liker_id
+              AND m.partner_telegram_id = b.liked_id
+        ) AS match_exists,
+        EXISTS (
+            SELECT 1 FROM likes l
+            WHERE l.liker_telegram_id = b.liked_id
+              AND l.liked_telegram_id = b.liker_id
+              AND l.reaction = {LIKE}
+        ) OR EXISTS (
+            SELECT 1 FROM batch r
+            WHERE r.liker_id = b.liked_id
+              AND r.liked_id = b.liker_id
+              AND r.reaction = {LIKE}
+              AND r.ord < b.ord
+        ) AS reciprocal
+    FROM batch b
+),
+forming AS (
+    SELECT
+        ord,
+        user1_id,
+        user2_id,
+        CASE WHEN user1_id = liker_id THEN liker_username ELSE liked_username END AS user1_username,
+        CASE WHEN user2_id = liker_id THEN liker_username ELSE liked_username END AS user2_username,
+        row_number() OVER (PARTITION BY user1_id, user2_id ORDER BY ord) AS rn
+    FROM decided
+    WHERE reaction = {LIKE} AND reciprocal AND NOT match_exists
+),
+new_matches AS (
+    INSERT INTO matches (user_telegram_id, partner_telegram_id, partner_username, matched_at)
+    SELECT sides.*, CAST(:created_at AS TIMESTAMP)
+    FROM forming
+    CROSS JOIN LATERAL (
+        VALUES (user1_id, user2_id, user2_username), (user2_id, user1_id, user1_username)
+    ) AS sides
+    WHERE rn = 1
+    ON CONFLICT DO NOTHING
+    RETURNING user_telegram_id, partner_telegram_id
+),
+counted AS (
+    INSERT INTO user_counters AS c (
+        user_id, likes_given, dislikes_given, likes_received, dislikes_received, matches_count
+    )
+    SELECT user_id, sum(likes_given), sum(dislikes_given), sum(likes_received), sum(dislikes_received), sum(matches)
+    FROM (
+        SELECT
+            liker_id AS user_id,
+            (reaction = {LIKE})::int AS likes_given,
+            (reaction = {DISLIKE})::int AS dislikes_given,
+            0 AS likes_received,
+            0 AS dislikes_received,
+            0 AS matches
+        FROM latest
+        UNION ALL
+        SELECT liked_id, 0, 0, (reaction = {LIKE})::int, (reaction = {DISLIKE})::int, 0 FROM latest
+        UNION ALL
+        SELECT liker_id, -((reaction = {LIKE})::int), -((reaction = {DISLIKE})::int), 0, 0, 0 FROM previous
+        UNION ALL
+        SELECT liked_id, 0, 0, -((reaction = {LIKE})::int), -((reaction = {DISLIKE})::int), 0 FROM previous
+        UNION ALL
+        SELECT user_telegram_id, 0, 0, 0, 0, 1 FROM new_matches
+    ) deltas
+    GROUP BY user_id
+    ORDER BY user_id
+    ON CONFLICT (user_id) DO UPDATE SET
+        likes_given = c.likes_given + EXCLUDED.likes_given,
+        dislikes_given = c.dislikes_given + EXCLUDED.dislikes_given,
+        likes_received = c.likes_received + EXCLUDED.likes_received,
+        dislikes_received = c.dislikes_received + EXCLUDED.dislikes_received,
+        matches_count = c.matches_count + EXCLUDED.matches_count
+),
+outboxed AS (
+    INSERT INTO outbox (routing_key, payload)
+    SELECT routing_key, payload
+    FROM (
+        SELECT
+            ord,
+            0 AS kind,
+            'likes' AS routing_key,
+            jsonb_build_object(
+                'liker_id', liker_id,
+                'liked_id', liked_id,
+                'like_date', CAST(:created_at AS TIMESTAMP)::text
+            ) AS payload
+        FROM batch
+        WHERE reaction = {LIKE}
+        UNION ALL
+        SELECT
+            f.ord,
+            1,
+            'matches',
+            jsonb_build_object(
+                'user1_id', f.user1_id,
+                'user2_id', f.user2_id,
+                'user1_username', f.user1_username,
+                'user2_username', f.user2_username,
+                'matched_at', CAST(:created_at AS TIMESTAMP)::text
+            )
+        FROM forming f
+        JOIN new_matches n ON n.user_telegram_id = f.user1_id AND n.partner_telegram_id = f.user2_id
+    ) events
+    ORDER BY ord, kind
+)
+SELECT
+    CASE
+        WHEN d.reaction <> {LIKE} THEN 'no-match'
+        WHEN f.rn = 1 AND n.user_telegram_id IS NOT NULL THEN 'match'
+        WHEN d.match_exists OR f.rn IS NOT NULL THEN 'match-exists'
+        ELSE 'half-match'
+    END AS status,
+    d.user1_id,
+    d.user2_id,
+    f.user1_username,
+    f.user2_username
+FROM decided d
+LEFT JOIN forming f ON f.ord = d.ord
+LEFT JOIN new_matches n
+    ON n.user_telegram_id = d.user1_id AND n.partner_telegram_id = d.user2_id
+ORDER BY d.ord
+"""
+
+
+# archived swipes still count, as user_counters never subtracts them
+SWIPES_SQL = """
+    (
+        SELECT liker_telegram_id, liked_telegram_id, reaction FROM likes
+        UNION ALL
+        SELECT liker_telegram_id, liked_telegram_id, reaction FROM likes_archive
+    ) swipes
+"""
+
+# Moves a batch of dislikes from feed epochs their liker has left into
+# likes_archive. Likes stay, they can still form a match.
+ARCHIVE_LIKES_SQL = f"""
+WITH stale AS (
+    SELECT l.liker_telegram_id, l.liked_telegram_id
+    FROM likes l
+    JOIN user_infos u ON u.user_id = l.liker_telegram_id
+    WHERE l.reaction = {DISLIKE} AND l.feed_epoch < u.feed_epoch
+    LIMIT :batch_size
+),
+moved AS (
+    DELETE FROM likes l
+    USING stale s
+    WHERE l.liker_telegram_id = s.liker_telegram_id AND l.liked_telegram_id = s.liked_telegram_id
+    RETURNING l.liker_telegram_id, l.liked_telegram_id, l.feed_epoch, l.reaction, l.created_at
+)
+INSERT INTO likes_archive (liker_telegram_id, liked_telegram_id, feed_epoch, reaction, created_at)
+SELECT * FROM moved
+ON CONFLICT DO NOTHING
+"""
+
+
+def counters_aggregate_sql(scoped: bool = False) -> str:
+    """SELECT of user_counters rows recomputed from likes, likes_archive and matches, limited to :user_ids when scoped"""
+    scope = "WHERE user_id = ANY(CAST(:user_ids AS BIGINT[]))" if scoped else ""
+    return f"""
+    SELECT user_id, sum(likes_given), sum(dislikes_given), sum(likes_received), sum(dislikes_received), sum(matches)
+    FROM (
+        SELECT
+            liker_telegram_id AS user_id,
+            count(*) FILTER (WHERE reaction = {LIKE}) AS likes_given,
+            count(*) FILTER (WHERE reaction = {DISLIKE}) AS dislikes_given,
+            0 AS likes_received,
+            0 AS dislikes_received,
+            0 AS matches
+        FROM {SWIPES_SQL}
+        GROUP BY liker_telegram_id
+        UNION ALL
+        SELECT
+            liked_telegram_id, 0, 0,
+            count(*) FILTER (WHERE reaction = {LIKE}),
+            count(*) FILTER (WHERE reaction = {DISLIKE}),
+            0
+        FROM {SWIPES_SQL}
+        GROUP BY liked_telegram_id
+        UNION ALL
+        SELECT user_telegram_id, 0, 0, 0, 0, count(*) FROM matches GROUP BY user_telegram_id
+    ) counts
+    {scope}
+    GROUP BY user_id
+    """
 
 
 class LikeMatchRepository:
@@ -24,94 +260,40 @@ class LikeMatchRepository:
         )
         return result.scalars().first()
 
-    async def create_like(
-            self,
-            rater_user_id: int,
-            rated_user_id: int,
-            like_type: str = 'like'
-    ) -> Like:
-
-        new_like = Like(
-            liker_telegram_id=rater_user_id,
-            liked_telegram_id=rated_user_id,
-            like_type=like_type,
-            created_at=datetime.now()
-        )
-
-        self.db.add(new_like)
-        await self.db.commit()
-        await self.db.refresh(new_like)
-        print(f"Пользователь {rater_user_id} лайкнул пользователя {rated_user_id}.")
-        return new_like
-
-    async def get_match_by_users_id(self, user1_id: int, user2_id) -> Match:
-        user1_id = min(user1_id, user2_id)
-        user2_id = max(user2_id, user1_id)
-        result = await self.db.execute(
-            select(Match)
-            .where(
-                and_(Match.user1_telegram_id == user1_id,
-                     Match.user2_telegram_id == user2_id
-                     )
-            )
-        )
-        return result.scalars().first()
-
-    async def is_match(
-            self,
-            rater_user_id: int,
-            rated_user_id: int,
-            rater_username: str,
-            rated_username: str,
-    ) -> bool:
-        mutual_like_result = await self.db.execute(
-            select(Like).where(
-                Like.liker_telegram_id == rated_user_id,
-                Like.liked_telegram_id == rater_user_id
-            )
-        )
-        mutual_like = mutual_like_result.scalars().first()
-        print(mutual_like)
-
-        if mutual_like:
-            print(f"Взаимный лайк обнаружен между {rater_user_id} и {rated_user_id}!")
-
-            user_id_to_username = {
-                rater_user_id: rater_username,
-                rated_user_id: rated_username,
+    async def create_likes(self, likes: list[LikeDislikePayload]) -> list[LikeResult]:
+        """Writes a batch of swipes and reports, per swipe, whether it formed a match.
+
+        The whole decision is one statement (see LIKE_BATCH_SQL), run in
+        autocommit mode, so a batch costs a single round trip.
+        """
+        created_at = datetime.now()
+        conn = await self.db.connection(execution_options={"isolation_level": "AUTOCOMMIT"})
+        result = await conn.execute(
+            text(LIKE_BATCH_SQL),
+            {
+                "liker_ids": [like.rater_user_id for like in likes],
+                "liked_ids": [like.rated_user_id for like in likes],
+                "reactions": [REACTIONS[like.like_type] for like in likes],
+                "liker_usernames": [like.rater_username for like in likes],
+                "liked_usernames": [like.rated_username for like in likes],
+                "created_at": created_at,
             }
+        )
 
-            user1 = min(rater_user_id, rated_user_id)
-            user2 = max(rater_user_id, rated_user_id)
-
-            existing_match_result = await self.db.execute(
-                select(Match).where(
-                    Match.user1_telegram_id == user1,
-                    Match.user2_telegram_id == user2
-                )
-            )
-            existing_match = existing_match_result.scalars().first()
-
-            if not existing_match:
-                new_match = Match(
-                    user1_telegram_id=user1,
-                    user2_telegram_id=user2,
-                    user1_username=user_id_to_username[user1],
-                    user2_username=user_id_to_username[user2],
-                    matched_at=datetime.now()
+        results = []
+        for row in result.mappings().all():
+            match = None
+            if row["status"] == "match":
+                match = UserMatch(
+                    user1_id=row["user1_id"],
+                    user2_id=row["user2_id"],
+                    user1_username=row["user1_username"],
+                    user2_username=row["user2_username"],
                 )
-                self.db.add(new_match)
-                await self.db.commit()
-                await self.db.refresh(new_match)
-
-                print(f"Создана запись о совпадении между {user1} и {user2}.")
-                return True
-            else:
-                print(f"Запись о совпадении между {user1} и {user2} уже существует.")
-                return False
-        else:
-            print(f"Взаимный лайк от пользователя {rated_user_id} не найден.")
-            return False
+            results.append(LikeResult(status=row["status"], created_at=created_at, match=match))
+
+        logger.info(f"Stored {len(likes)} swipes, {sum(r['match'] is not None for r in results)} new matches")
+        return results
 
     async def get_info_by_user_id(self, user_id: int) -> UserInfo:
         result = await self.db.execute(
@@ -141,7 +323,8 @@ class LikeMatchRepository:
             preferred_gender=preferred_gender,
             preferred_min_age=preferred_min_age,
             preferred_max_age=preferred_max_age,
-            location=f"POINT({longitude} {latitude})"
+            location=f"POINT({longitude} {latitude})",
+            geocell=encode_geohash(latitude, longitude)
         )
 
         self.db.add(info)
@@ -174,7 +357,9 @@ class LikeMatchRepository:
         info.preferred_gender = preferred_gender if preferred_gender else info.preferred_gender
         info.preferred_min_age = preferred_min_age if preferred_min_age else info.preferred_min_age
         info.preferred_max_age = preferred_max_age if preferred_max_age else info.preferred_max_age
-        info.location = f"POINT({longitude} {latitude})" if longitude and latitude else info.location
+        if longitude and latitude:
+            info.location = f"POINT({longitude} {latitude})"
+            info.geocell = encode_geohash(latitude, longitude)
 
         await self.db.commit()
         await self.db.refresh(info)
@@ -189,235 +374,238 @@ class LikeMatchRepository:
     #
     #
     async def get_match(self, user1_id: int, user2_id: int) -> Match:
-        user1 = min(user1_id, user2_id)
-        user2 = max(user1_id, user2_id)
+        return await self.db.get(Match, (user1_id, user2_id))
 
-        match_result = await self.db.execute(
-            select(Match).where(
-                Match.user1_telegram_id == user1,
-                Match.user2_telegram_id == user2
-            )
-        )
-        return match_result.scalars().first()
-
-    async def get_user_match(self, user_id: int) -> list[dict]:
-        matches = await self.db.execute(
-            select(Match).where(
-                or_(
-                    Match.user1_telegram_id == user_id,
-                    Match.user2_telegram_id == user_id
-                )
+    async def get_user_match(
+            self,
+            user_id: int,
+            after: tuple[datetime, int] | None = None,
+            limit: int = 100
+    ) -> list[dict]:
+        """Returns matches of user_id, newest first, after the (matched_at, partner_id) keyset position"""
+        query = (
+            select(
+                Match.partner_telegram_id.label('user_id'),
+                Match.partner_username.label('username'),
+                Match.matched_at
             )
+            .where(Match.user_telegram_id == user_id)
+            .order_by(Match.matched_at.desc(), Match.partner_telegram_id.desc())
+            .limit(limit)
         )
-        matches = matches.scalars().all()
-
-        result = []
-        for match in matches:
-            if match.user1_telegram_id == user_id:
-                partner_data = {
-                    "username": match.user2_username,
-                    "user_id": match.user2_telegram_id,
-                    "matched_at": match.matched_at
-                }
-            else:
-                partner_data = {
-                    "username": match.user1_username,
-                    "user_id": match.user1_telegram_id,
-                    "matched_at": match.matched_at
-                }
-            result.append(partner_data)
-
-        return result
+        if after:
+            query = query.where(tuple_(Match.matched_at, Match.partner_telegram_id) < tuple_(*after))
+
+        result = await self.db.execute(query)
+        return [dict(row) for row in result.mappings().all()]
 
     async def find_matching_users(
             self,
             user_id: int,
-            offset: int = 0,
-            limit: int = 50
-    ) -> list[int]:
-        initial_radius_km = 20
-        max_radius_km = 100
-        radius_step_km = 20
-        min_profiles = 50
-
-        user_query = select(
-            UserInfo.preferred_gender,
-            UserInfo.preferred_min_age,
-            UserInfo.preferred_max_age,
-            func.ST_X(UserInfo.location).label('longitude'),
-            func.ST_Y(UserInfo.location).label('latitude')
-        ).where(UserInfo.user_id == user_id)
-
-        user = (await self.db.execute(user_query)).first()
-
-        if not user or user.longitude is None or user.latitude is None:
+            after: tuple[float, float, int] | None = None,
+            limit: int = 50,
+            mutual: bool = False
+    ):
+        """Returns (user_id, distance, rating) of the nearest eligible users after the keyset position.
+
+        Candidates are ordered by distance, then rating descending, then
+        user_id, and ``after`` is the (distance, rating, user_id) of the
+        last candidate of the previous batch.
+        """
+        viewer = await self.get_info_by_user_id(user_id)
+        if not viewer or viewer.location is None:
             return []
 
-        user_point = WKTElement(f'SRID=4326;POINT({user.longitude} {user.latitude})', extended=True)
-
-        # matched_query = select(
-        #     case(
-        #         (Match.user1_telegram_id == user_id, Match.user2_telegram_id),
-        #         else_=Match.user1_telegram_id
-        #     )
-        # ).where(
-        #     or_(
-        #         Match.user1_telegram_id == user_id,
-        #         Match.user2_telegram_id == user_id
-        #     )
-        # )
-
-        # matched_users_list = (await self.db.execute(matched_query)).all()
-        # matched_users = {row[0] for row in matched_users_list}
-        #
-        # matched_users.add(user_id)
-
-        found_users = []
-        current_radius = initial_radius_km
-
-        while current_radius <= max_radius_km:
-            query = (
-                select(
-                    UserInfo.user_id,
-                    ST_Distance(
-                        UserInfo.location,
-                        user_point,
-                        use_spheroid=True
-                    ).label('distance'),
-                    UserInfo.rating
-                )
-                .where(
-                    and_(
-                        UserInfo.user_id != user_id,
-                        # UserInfo.user_id.not_in(matched_users),
-                        ST_DWithin(
-                            UserInfo.location,
-                            user_point,
-                            current_radius * 0.01,
-                            use_spheroid=True
-                        ),
-                        or_(
-                            UserInfo.gender == user.preferred_gender,
-                            user.preferred_gender == "any"
-                        ),
-                        UserInfo.age.between(
-                            user.preferred_min_age,
-                            user.preferred_max_age
-                        )
-                    )
-                )
-                .order_by('distance', UserInfo.rating)
-                .limit(min_profiles * 2)
-            )
-
-            result = await self.db.execute(query)
-            batch = result.all()
-
-            new_users = [
-                (row.user_id, row.distance, row.rating)
-                for row in batch
-                if row.user_id not in {u[0] for u in found_users}
-            ]
+        viewer_point = to_shape(viewer.location)
+        viewer_info = aliased(UserInfo, name="viewer")
+        viewer_location = (
+            select(viewer_info.location)
+            .where(viewer_info.user_id == user_id)
+            .scalar_subquery()
+        )
 
-            found_users.extend(new_users)
-            current_radius += radius_step_km
+        distance = ST_Distance(UserInfo.location, viewer_location)
+        rating = func.coalesce(UserInfo.rating, 0)
 
-        sorted_users = sorted(
-            found_users,
-            key=lambda x: (x[1], -x[2])
+        query = (
+            select(UserInfo.user_id, distance.label('distance'), rating.label('rating'))
+            .where(
+                UserInfo.user_id != user_id,
+                UserInfo.geocell.in_(covering_geocells(viewer_point.y, viewer_point.x, MAX_RADIUS_KM)),
+                UserInfo.age.between(viewer.preferred_min_age, viewer.preferred_max_age),
+                ST_DWithin(UserInfo.location, viewer_location, MAX_RADIUS_KM * 1000),
+            )
+            .order_by(distance, rating.desc(), UserInfo.user_id)
+            .limit(limit)
         )
+        if after:
+            after_distance, after_rating, after_user_id = after
+            query = query.where(
+                tuple_(distance, -rating, UserInfo.user_id) > tuple_(after_distance, -after_rating, after_user_id)
+            )
+        if viewer.preferred_gender != "any":
+            query = query.where(UserInfo.gender == viewer.preferred_gender)
+        if mutual:
+            query = query.where(
+                UserInfo.preferred_gender.in_([viewer.gender, "any"]),
+                UserInfo.preferred_min_age <= viewer.age,
+                UserInfo.preferred_max_age >= viewer.age,
+            )
 
-        return [u[0] for u in sorted_users][offset:offset + limit]
+        result = await self.db.execute(query)
+        return result.all()
+
+    async def get_candidate_features(self, viewer_id: int, user_ids: list[int]):
+        viewer_info = aliased(UserInfo, name="viewer")
+        viewer_location = (
+            select(viewer_info.location)
+            .where(viewer_info.user_id == viewer_id)
+            .scalar_subquery()
+        )
 
-    async def update_rating(self, user_id, new_rating):
-        stmt = select(UserInfo).where(UserInfo.user_id == user_id)
-        result = await self.db.execute(stmt)
-        info = result.scalar_one_or_none()
+        result = await self.db.execute(
+            select(
+                UserInfo.user_id,
+                ST_Distance(UserInfo.location, viewer_location).label('distance'),
+                UserInfo.rating,
+                UserInfo.updated_at
+            )
+            .where(UserInfo.user_id.in_(user_ids))
+        )
+        return result.all()
 
-        info.rating = new_rating if new_rating else info.rating
+    async def get_rated_user_ids(self, user_id: int) -> list[int]:
+        """Returns the profiles the user has rated in the current feed epoch"""
+        result = await self.db.execute(
+            select(Like.liked_telegram_id)
+            .join(UserInfo, UserInfo.user_id == Like.liker_telegram_id)
+            .where(Like.liker_telegram_id == user_id, Like.feed_epoch == UserInfo.feed_epoch)
+        )
+        return list(result.scalars().all())
 
+    async def reset_feed(self, user_id: int) -> int | None:
+        """Starts a new feed epoch for the user, returns it or None without user info"""
+        result = await self.db.execute(
+            update(UserInfo)
+            .where(UserInfo.user_id == user_id)
+            .values(feed_epoch=UserInfo.feed_epoch + 1, updated_at=UserInfo.updated_at)
+            .returning(UserInfo.feed_epoch)
+        )
+        epoch = result.scalar_one_or_none()
         await self.db.commit()
-        await self.db.refresh(info)
+        return epoch
 
-        return info
+    async def archive_likes(self, batch_size: int) -> int:
+        """Archives one batch of dislikes from past feed epochs, returns how many were moved"""
+        result = await self.db.execute(text(ARCHIVE_LIKES_SQL), {"batch_size": batch_size})
+        await self.db.commit()
+        return result.rowcount
 
-    async def get_stats(self, user_id):
-        likes_given_query = select(func.count()).where(
-            Like.liker_telegram_id == user_id,
-            Like.like_type == 'like'
+    async def lock_outbox_batch(self, limit: int) -> list[OutboxEvent]:
+        """Locks the oldest outbox events not locked by another relay"""
+        result = await self.db.execute(
+            select(OutboxEvent)
+            .order_by(OutboxEvent.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
         )
-        likes_given = await self.db.scalar(likes_given_query)
+        return list(result.scalars().all())
 
-        likes_received_query = select(func.count()).where(
-            Like.liked_telegram_id == user_id,
-            Like.like_type == 'like'
-        )
-        likes_received = await self.db.scalar(likes_received_query)
+    async def delete_outbox_events(self, event_ids: list[int]) -> None:
+        await self.db.execute(delete(OutboxEvent).where(OutboxEvent.id.in_(event_ids)))
 
-        dislikes_given_query = select(func.count()).where(
-            Like.liker_telegram_id == user_id,
-            Like.like_type == 'dislike'
-        )
-        dislikes_given = await self.db.scalar(dislikes_given_query)
+    async def update_rating(self, ratings: dict[int, tuple[float, float]]) -> dict[int, float]:
+        """Writes (rating, changed_at) of many users with one UPDATE ... FROM (VALUES ...), keeps updated_at.
 
-        dislikes_received_query = select(func.count()).where(
-            Like.liked_telegram_id == user_id,
-            Like.like_type == 'dislike'
-        )
-        dislikes_received = await self.db.scalar(dislikes_received_query)
+        A rating changed before the stored one is skipped. Returns the
+        ratings that were written.
+        """
+        if not ratings:
+            return {}
 
-        matches_query = select(func.count()).where(
-            or_(
-                Match.user1_telegram_id == user_id,
-                Match.user2_telegram_id == user_id
+        new_ratings = values(
+            column("user_id", BigInteger), column("rating", Float), column("changed_at", Float), name="new_ratings"
+        ).data([(user_id, rating, changed_at) for user_id, (rating, changed_at) in ratings.items()])
+        result = await self.db.execute(
+            update(UserInfo)
+            .where(
+                UserInfo.user_id == new_ratings.c.user_id,
+                or_(UserInfo.rating_changed_at.is_(None), UserInfo.rating_changed_at <= new_ratings.c.changed_at),
             )
+            .values(rating=new_ratings.c.rating, rating_changed_at=new_ratings.c.changed_at,
+                    updated_at=UserInfo.updated_at)
+            .returning(UserInfo.user_id, UserInfo.rating)
         )
-        matches_count = await self.db.scalar(matches_query)
+        updated = {row.user_id: row.rating for row in result}
+        await self.db.commit()
+
+        return updated
+
+    async def get_stats(self, user_id):
+        counters = await self.db.get(UserCounter, user_id)
 
         return {
-            "likes_given": likes_given or 0,
-            "dislikes_given": dislikes_given or 0,
-            "likes_received": likes_received or 0,
-            "dislikes_received": dislikes_received or 0,
-            "matches_count": matches_count or 0
+            "likes_given": counters.likes_given if counters else 0,
+            "dislikes_given": counters.dislikes_given if counters else 0,
+            "likes_received": counters.likes_received if counters else 0,
+            "dislikes_received": counters.dislikes_received if counters else 0,
+            "matches_count": counters.matches_count if counters else 0
         }
 
-    async def check_dislike(self, user_id):
-        query = (
-            select(Like)
-            .where(
-                or_(
-                    and_(
-                        Like.liker_telegram_id == user_id,
-                        Like.like_type == 'dislike'
-                    ),
-                    and_(
-                        Like.liked_telegram_id == user_id,
-                        Like.like_type == 'dislike'
-                    )
-                )
+    async def reconcile_counters(self, user_ids: list[int] | None = None) -> int:
+        """Recomputes user_counters of user_ids, or of everyone, from likes and matches"""
+        reset = update(UserCounter).values(
+            likes_given=0,
+            dislikes_given=0,
+            likes_received=0,
+            dislikes_received=0,
+            matches_count=0
+        )
+        if user_ids is not None:
+            reset = reset.where(UserCounter.user_id.in_(user_ids))
+        await self.db.execute(reset)
+
+        result = await self.db.execute(
+            text(f"""
+            INSERT INTO user_counters AS c (
+                user_id, likes_given, dislikes_given, likes_received, dislikes_received, matches_count
             )
+            {counters_aggregate_sql(scoped=user_ids is not None)}
+            ON CONFLICT (user_id) DO UPDATE SET
+                likes_given = EXCLUDED.likes_given,
+                dislikes_given = EXCLUDED.dislikes_given,
+                likes_received = EXCLUDED.likes_received,
+                dislikes_received = EXCLUDED.dislikes_received,
+                matches_count = EXCLUDED.matches_count
+            """),
+            {"user_ids": user_ids} if user_ids is not None else {}
         )
-        result = await self.db.execute(query)
-        return result.scalar_one_or_none()
+        await self.db.commit()
+        return result.rowcount
 
     async def delete_like(self, user_id):
-        stmt = delete(Like).where(Like.liker_telegram_id == user_id)
+        liked_ids = []
+        for table in (Like, LikeArchive):
+            stmt = delete(table).where(table.liker_telegram_id == user_id).returning(table.liked_telegram_id)
+            result = await self.db.execute(stmt)
+            liked_ids.extend(result.scalars().all())
+        await self.reconcile_counters(list({user_id, *liked_ids}))
 
-        result = await self.db.execute(stmt)
-        await self.db.commit()
-
-        return result.rowcount
+        return len(liked_ids)
 
     async def delete_match(self, user_id):
-        stmt = delete(Match).where(
-            or_(
-                Match.user1_telegram_id == user_id,
-                Match.user2_telegram_id == user_id
-            )
-        )
-
+        stmt = delete(Match).where(Match.user_telegram_id == user_id).returning(Match.partner_telegram_id)
         result = await self.db.execute(stmt)
-        await self.db.commit()
+        partner_ids = result.scalars().all()
 
-        return result.rowcount
+        if partner_ids:
+            await self.db.execute(
+                delete(Match).where(
+                    tuple_(Match.user_telegram_id, Match.partner_telegram_id).in_(
+                        [(partner_id, user_id) for partner_id in partner_ids]
+                    )
+                )
+            )
+        await self.reconcile_counters(list({user_id, *partner_ids}))
+
+        return len(partner_ids)
@@ -1,7 +1,3 @@
-import aio_pika
-import httpx
-import msgpack
-from aio_pika import ExchangeType
 from dishka import FromDishka
 from dishka.integrations.fastapi import DishkaRoute
 from fastapi import APIRouter, HTTPException
@@ -9,9 +5,12 @@ from geoalchemy2.shape import to_shape
 from loguru import logger
 
 from components.matching_service.config import Config
+from components.matching_service.engine import CandidateSource
 from components.matching_service.repositories import LikeMatchRepository
-from components.matching_service.schemas import LikeDislikePayload, UserMatch, UserInfoCreate, UserInfoUpdate, \
-    UserInfoResponse, UserLike
+from components.matching_service.schemas import LikeDislikePayload, UserInfoCreate, UserInfoUpdate, \
+    UserInfoResponse
+from components.matching_service.services import CandidateFeed, LikeWriter, SeenFilter, decode_match_cursor, encode_match_cursor
+from shared.http import UpstreamClients
 
 router = APIRouter(route_class=DishkaRoute)
 
@@ -19,8 +18,8 @@ router = APIRouter(route_class=DishkaRoute)
 @router.post("/match/check", tags=["matching"])
 async def create_like(
         payload: LikeDislikePayload,
-        matching_repo: FromDishka[LikeMatchRepository],
-        cfg: FromDishka[Config],
+        like_writer: FromDishka[LikeWriter],
+        seen: FromDishka[SeenFilter],
 ):
     logger.info(
         f"Received /match/check request: rater={payload.rater_user_id}, rated={payload.rated_user_id}, type={payload.like_type}")
@@ -29,110 +28,44 @@ async def create_like(
     # if check_like:
     #     raise HTTPException(status_code=404, detail="Like has already created")
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            url=f"{cfg.rating_service_url}/ratings/{payload.rated_user_id}"
-        )
-
-        rating = response.json()
-
-    like = await matching_repo.create_like(
-        rated_user_id=payload.rated_user_id,
-        rater_user_id=payload.rater_user_id,
-        like_type=payload.like_type,
-    )
+    result = await like_writer.submit(payload)
+    await seen.add(payload.rater_user_id, [payload.rated_user_id])
 
     if payload.like_type == "like":
         logger.info(f"Processing 'like' from {payload.rater_user_id} to {payload.rated_user_id}")
 
-        connection = await aio_pika.connect_robust(cfg.rabbitmq.uri)
-        async with connection:
-            routing_key = "likes"
-            channel = await connection.channel()
-            exchange = await channel.declare_exchange('likes', ExchangeType.DIRECT)
-            queue = await channel.declare_queue('likes')
-            await queue.bind(exchange, routing_key)
-
-            await exchange.publish(
-                aio_pika.Message(
-                    msgpack.packb(
-                        UserLike(
-                            liker_id=like.liker_telegram_id,
-                            liked_id=like.liked_telegram_id,
-                            like_date=str(like.created_at)
-                        )
-                    )
-                ),
-                routing_key=routing_key
-            )
-
-        check_dislike = await matching_repo.check_dislike(payload.rater_user_id)
-        if check_dislike:
-            return {"status": "no-match"}
-
-        check_match = await matching_repo.get_match_by_users_id(payload.rater_user_id, payload.rated_user_id)
-        if check_match:
+        if result["status"] == "match-exists":
             logger.warning(
                 f"Match already exists between {payload.rater_user_id} and {payload.rated_user_id}. Like processed, but no new match created.")
 
             raise HTTPException(status_code=404, detail="Match has already created")
 
-        logger.debug(f"Checking if a new match is formed between {payload.rater_user_id} and {payload.rated_user_id}")
-        is_match = await matching_repo.is_match(payload.rater_user_id, payload.rated_user_id, payload.rater_username,
-                                                payload.rated_username)
-        if is_match:
-            match = await matching_repo.get_match(payload.rater_user_id, payload.rated_user_id)
-            print('-----------------------', match)
-            async with httpx.AsyncClient() as client:
-                await client.post(
-                    f"{cfg.rating_service_url}/stats/match",
-                    json={
-                        "user1_id": payload.rater_user_id,
-                        "user2_id": payload.rated_user_id
-                    }
-                )
-
-            connection = await aio_pika.connect_robust(cfg.rabbitmq.uri)
-            async with connection:
-                routing_key = "matches"
-                channel = await connection.channel()
-                exchange = await channel.declare_exchange('matches', ExchangeType.DIRECT)
-                queue = await channel.declare_queue('matches')
-                await queue.bind(exchange, routing_key)
-
-                await exchange.publish(
-                    aio_pika.Message(
-                        msgpack.packb(
-                            UserMatch(
-                                user1_id=match.user1_telegram_id,
-                                user2_id=match.user2_telegram_id,
-                                user1_username=match.user1_username,
-                                user2_username=match.user2_username,
-                            )
-                        )
-                    ),
-                    routing_key=routing_key
-                )
+        if result["status"] == "match":
+            # rating_service applies the match bonus from the outboxed match event
+            match = result["match"]
             return {
                 "match":
                     {
-                        "matcher1": match.user1_telegram_id,
-                        "matcher2": match.user2_telegram_id
+                        "matcher1": match["user1_id"],
+                        "matcher2": match["user2_id"]
                     }
             }
-        return {"status": "half-match"}
-    return {"status": "no-match"}
+    return {"status": result["status"]}
 
 @router.post("/users/info", tags=["users"])
 async def create_preferences(
         info: UserInfoCreate,
-        matching_repo: FromDishka[LikeMatchRepository]
+        matching_repo: FromDishka[LikeMatchRepository],
+        feed: FromDishka[CandidateFeed],
+        source: FromDishka[CandidateSource],
 ) -> UserInfoResponse:
     logger.info(f"Received POST /users/info request for user_id: {info.user_id}")
     created = await matching_repo.get_info_by_user_id(info.user_id)
     if created:
         raise HTTPException(status_code=404, detail="Info has already created")
     new_info = await matching_repo.create_info(**info.model_dump())
+    source.upsert(new_info)
+    await feed.invalidate(info.user_id)
 
     point = to_shape(new_info.location)
     return UserInfoResponse(
@@ -152,6 +85,8 @@ async def update_preferences(
         user_id: int,
         info: UserInfoUpdate,
         matching_repo: FromDishka[LikeMatchRepository],
+        feed: FromDishka[CandidateFeed],
+        source: FromDishka[CandidateSource],
 ) -> UserInfoResponse:
     logger.info(f"Received PUT /users/info/{user_id} request.")
     logger.debug(f"Update data for user_id {user_id}: {info.model_dump(exclude_unset=True)}")
@@ -161,6 +96,8 @@ async def update_preferences(
         raise HTTPException(status_code=404, detail="Info not found")
 
     new_info = await matching_repo.update_info(user_id=user_id, **info.model_dump())
+    source.upsert(new_info)
+    await feed.invalidate(user_id)
 
     point = to_shape(new_info.location)
     return UserInfoResponse(
@@ -178,29 +115,33 @@ async def update_preferences(
 @router.get("/match/profiles/{viewer_id}", tags=["matching"])
 async def get_next_profile_to_view(
         viewer_id: int,
-        matching_repo: FromDishka[LikeMatchRepository],
+        feed: FromDishka[CandidateFeed],
         cfg: FromDishka[Config],
-        offset: int = 0,
+        http: FromDishka[UpstreamClients],
+        cursor: str | None = None,
         limit: int = 50
 ):
-    logger.info(f"Received GET /match/profiles/{viewer_id} request with offset={offset}, limit={limit}")
-    profile_ids = await matching_repo.find_matching_users(user_id=viewer_id, offset=offset, limit=limit)
+    logger.info(f"Received GET /match/profiles/{viewer_id} request with cursor={cursor}, limit={limit}")
+    try:
+        profile_ids, next_cursor = await feed.page(viewer_id=viewer_id, cursor=cursor, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if not profile_ids:
         raise HTTPException(status_code=404, detail="No more profiles to view")
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            headers={
-                'Content-Type': 'application/json',
-                'Accept': 'application/json',
-            },
-            url=f"{cfg.profile_service_url}/many-profiles", json=profile_ids
-        )
-        if response.status_code != 200:
-            raise HTTPException(status_code=500, detail=f'Fimoz: {response.json()}')
+    response = await http["profile_service"].post(
+        headers={
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+        },
+        url=f"{cfg.profile_service_url}/many-profiles", json=profile_ids
+    )
+    if response.status_code != 200:
+        raise HTTPException(status_code=500, detail=f'Fimoz: {response.json()}')
 
-    profiles = response.json()
-    return profiles
+    rank = {profile_id: i for i, profile_id in enumerate(profile_ids)}
+    profiles = sorted(response.json(), key=lambda profile: rank[profile["id"]])
+    return {"profiles": profiles, "next_cursor": next_cursor}
 
 @router.get("/match/stats/{profile_id}")
 async def get_stats(
@@ -213,10 +154,37 @@ async def get_stats(
 @router.get("/matches/{user_id}")
 async def get_matches(
         user_id: int,
-        matching_repo: FromDishka[LikeMatchRepository]
+        matching_repo: FromDishka[LikeMatchRepository],
+        cursor: str | None = None,
+        limit: int = 100
+):
+    try:
+        after = decode_match_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    matches = await matching_repo.get_user_match(user_id, after=after, limit=limit)
+    next_cursor = None
+    if len(matches) == limit:
+        next_cursor = encode_match_cursor(matches[-1]["matched_at"], matches[-1]["user_id"])
+    return {"matches": matches, "next_cursor": next_cursor}
+
+@router.post("/feed/reset/{user_id}", tags=["matching"])
+async def reset_feed(
+        user_id: int,
+        matching_repo: FromDishka[LikeMatchRepository],
+        seen: FromDishka[SeenFilter],
+        feed: FromDishka[CandidateFeed],
 ):
-    matches = await matching_repo.get_user_match(user_id)
-    return matches
+    epoch = await matching_repo.reset_feed(user_id)
+    if epoch is None:
+        raise HTTPException(status_code=404, detail="Info not found")
+
+    await seen.reset(user_id)
+    await feed.invalidate(user_id)
+    logger.info(f"Started feed epoch {epoch} of {user_id}")
+    return {"feed_epoch": epoch}
+
 
 @router.delete("/like/delete/{user_id}")
 async def delete_like(
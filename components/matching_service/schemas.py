@@ -1,4 +1,5 @@
-from typing import TypedDict
+from datetime import datetime
+from typing import Literal, TypedDict
 
 from pydantic import BaseModel
 
@@ -8,7 +9,7 @@ class LikeDislikePayload(BaseModel):
     rated_user_id: int
     rater_username: str
     rated_username: str
-    like_type: str
+    like_type: Literal["like", "dislike"]
 
 
 class UserMatch(TypedDict):
@@ -19,6 +20,13 @@ class UserMatch(TypedDict):
     # match_date: datetime
 
 
+class LikeResult(TypedDict):
+    # "no-match", "half-match", "match" or "match-exists"
+    status: str
+    created_at: datetime
+    match: UserMatch | None
+
+
 class UserInfoCreate(BaseModel):
     user_id: int
     age: int
@@ -0,0 +1,453 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import math
+import uuid
+from datetime import datetime
+from typing import TYPE_CHECKING
+
+from loguru import logger
+from redis.asyncio import Redis
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from components.matching_service.config import (FeedConfig, LikeWriterConfig, OutboxConfig,
+                                                RatingSyncConfig, SeenFilterConfig)
+from components.matching_service.engine import CandidateSource
+from components.matching_service.repositories import LikeMatchRepository
+from components.matching_service.schemas import LikeDislikePayload, LikeResult
+from shared.amqp import AMQPClient
+
+if TYPE_CHECKING:
+    from components.matching_service.ranking import RankingPipeline
+
+
+def encode_match_cursor(matched_at: datetime, partner_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{matched_at.isoformat()}|{partner_id}".encode()).decode()
+
+
+def decode_match_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        matched_at, partner_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(matched_at), int(partner_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+
+def encode_cursor(generation: str, position: int) -> str:
+    return base64.urlsafe_b64encode(f"{generation}:{position}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[str, int]:
+    try:
+        generation, position = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        return generation, int(position)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+
+class SeenFilter:
+    """Per-viewer Bloom filter of profiles the viewer has already rated.
+
+    Each filter is a Redis bitmap of ``m`` bits sized for ``capacity``
+    entries at ``error_rate``; bit ``m`` marks a filter that was seeded
+    from the likes table. A false positive only hides a candidate, it
+    never re-shows a rated one. Missing or expired filters are rebuilt
+    from Postgres on the next lookup.
+    """
+
+    def __init__(self, redis: Redis, sessionmaker: async_sessionmaker, cfg: SeenFilterConfig):
+        self.redis = redis
+        self.sessionmaker = sessionmaker
+        self.cfg = cfg
+        self.size = math.ceil(-cfg.capacity * math.log(cfg.error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / cfg.capacity * math.log(2)))
+
+    @staticmethod
+    def _key(viewer_id: int) -> str:
+        return f"matching:seen:{viewer_id}"
+
+    def _positions(self, profile_id: int) -> list[int]:
+        digest = hashlib.blake2b(str(profile_id).encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    async def add(self, viewer_id: int, profile_ids: list[int], seeded: bool = False) -> None:
+        key = self._key(viewer_id)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for profile_id in profile_ids:
+                for position in self._positions(profile_id):
+                    pipe.setbit(key, position, 1)
+            if seeded:
+                pipe.setbit(key, self.size, 1)
+            pipe.expire(key, self.cfg.ttl_seconds)
+            await pipe.execute()
+
+    async def contains_many(self, viewer_id: int, profile_ids: list[int]) -> list[bool]:
+        key = self._key(viewer_id)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.getbit(key, self.size)
+            for profile_id in profile_ids:
+                for position in self._positions(profile_id):
+                    pipe.getbit(key, position)
+            seeded, *bits = await pipe.execute()
+
+        if not seeded:
+            await self._seed(viewer_id)
+            return await self.contains_many(viewer_id, profile_ids)
+
+        return [
+            all(bits[i * self.hashes:(i + 1) * self.hashes])
+            for i in range(len(profile_ids))
+        ]
+
+    async def reset(self, viewer_id: int) -> None:
+        await self.redis.delete(self._key(viewer_id))
+
+    async def _seed(self, viewer_id: int) -> None:
+        async with self.sessionmaker() as session:
+            rated_ids = await LikeMatchRepository(session).get_rated_user_ids(viewer_id)
+
+        logger.info(f"Seeding seen filter of {viewer_id} with {len(rated_ids)} rated profiles")
+        await self.add(viewer_id, rated_ids, seeded=True)
+
+
+class CandidateFeed:
+    """Ranked candidate queue per active viewer, kept in Redis.
+
+    The queue is a sorted set scored by rank, so a page is a single
+    ZRANGEBYSCORE from the cursor position. It is filled in batches by the
+    ranking pipeline, which resumes candidate retrieval from the keyset
+    position of the last scanned candidate kept in the meta hash, and
+    topped up in the background when fewer than ``low_watermark``
+    candidates are left after the cursor.
+    """
+
+    def __init__(self, redis: Redis, pipeline: "RankingPipeline", cfg: FeedConfig):
+        self.redis = redis
+        self.pipeline = pipeline
+        self.cfg = cfg
+        self._refills: dict[int, asyncio.Task] = {}
+
+    @staticmethod
+    def _keys(viewer_id: int) -> tuple[str, str]:
+        return f"matching:feed:{viewer_id}", f"matching:feed:{viewer_id}:meta"
+
+    async def page(self, viewer_id: int, cursor: str | None, limit: int) -> tuple[list[int], str | None]:
+        queue_key, meta_key = self._keys(viewer_id)
+
+        meta = await self._get_meta(meta_key)
+        if meta is None:
+            meta = await self._start(viewer_id)
+
+        position = 0
+        if cursor:
+            generation, position = decode_cursor(cursor)
+            if generation != meta["generation"]:
+                logger.debug(f"Feed of {viewer_id} was rebuilt, restarting from the top")
+                position = 0
+
+        while meta["size"] - position < limit and not meta["exhausted"]:
+            generation = meta["generation"]
+            meta = await self._refill(viewer_id) or await self._start(viewer_id)
+            if meta["generation"] != generation:
+                # the feed expired or was rebuilt meanwhile, the new one starts at the top
+                position = 0
+
+        raw_ids = await self.redis.zrangebyscore(queue_key, position, "+inf", start=0, num=limit)
+        profile_ids = [int(profile_id) for profile_id in raw_ids]
+        next_position = position + len(profile_ids)
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zremrangebyscore(queue_key, "-inf", f"({position}")
+            pipe.expire(queue_key, self.cfg.ttl_seconds)
+            pipe.expire(meta_key, self.cfg.ttl_seconds)
+            await pipe.execute()
+
+        if meta["size"] - next_position < self.cfg.low_watermark and not meta["exhausted"]:
+            self._schedule_refill(viewer_id)
+
+        if meta["exhausted"] and next_position >= meta["size"]:
+            return profile_ids, None
+        return profile_ids, encode_cursor(meta["generation"], next_position)
+
+    async def invalidate(self, viewer_id: int) -> None:
+        logger.info(f"Invalidating candidate feed of {viewer_id}")
+        await self.redis.delete(*self._keys(viewer_id))
+
+    async def close(self) -> None:
+        for task in self._refills.values():
+            task.cancel()
+        await asyncio.gather(*self._refills.values(), return_exceptions=True)
+
+    async def _get_meta(self, meta_key: str) -> dict | None:
+        raw = await self.redis.hgetall(meta_key)
+        if b"generation" not in raw:
+            return None
+        after = None
+        if raw.get(b"after"):
+            distance, rating, user_id = raw[b"after"].decode().split(":")
+            after = (float(distance), float(rating), int(user_id))
+        return {
+            "generation": raw[b"generation"].decode(),
+            "after": after,
+            "size": int(raw[b"size"]),
+            "exhausted": raw[b"exhausted"] == b"1",
+        }
+
+    async def _start(self, viewer_id: int) -> dict:
+        queue_key, meta_key = self._keys(viewer_id)
+        meta = {"generation": uuid.uuid4().hex[:8], "after": None, "size": 0, "exhausted": False}
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(queue_key, meta_key)
+            pipe.hset(meta_key, mapping={**meta, "after": "", "exhausted": 0})
+            pipe.expire(meta_key, self.cfg.ttl_seconds)
+            await pipe.execute()
+
+        refilled = await self._refill(viewer_id)
+        return refilled or {**meta, "exhausted": True}
+
+    def _schedule_refill(self, viewer_id: int) -> None:
+        if viewer_id in self._refills:
+            return
+        task = asyncio.create_task(self._refill(viewer_id))
+        self._refills[viewer_id] = task
+        task.add_done_callback(lambda _: self._refills.pop(viewer_id, None))
+
+    async def _refill(self, viewer_id: int) -> dict | None:
+        queue_key, meta_key = self._keys(viewer_id)
+        lock = self.redis.lock(f"matching:feed:{viewer_id}:lock", timeout=30, blocking_timeout=30)
+
+        async with lock:
+            meta = await self._get_meta(meta_key)
+            if meta is None or meta["exhausted"]:
+                return meta
+
+            profile_ids, after, exhausted = await self.pipeline.next_batch(
+                viewer_id=viewer_id,
+                after=meta["after"],
+                size=self.cfg.batch_size,
+            )
+
+            async with self.redis.pipeline(transaction=True) as pipe:
+                if profile_ids:
+                    pipe.zadd(queue_key, {
+                        profile_id: meta["size"] + rank
+                        for rank, profile_id in enumerate(profile_ids)
+                    })
+                if after:
+                    # repr() round-trips the float exactly
+                    pipe.hset(meta_key, "after", ":".join(repr(value) for value in after))
+                pipe.hincrby(meta_key, "size", len(profile_ids))
+                pipe.hset(meta_key, "exhausted", int(exhausted))
+                pipe.expire(queue_key, self.cfg.ttl_seconds)
+                pipe.expire(meta_key, self.cfg.ttl_seconds)
+                await pipe.execute()
+
+            logger.info(
+                f"Refilled feed of {viewer_id} with {len(profile_ids)} candidates (exhausted={exhausted})"
+            )
+            meta["after"] = after
+            meta["size"] += len(profile_ids)
+            meta["exhausted"] = exhausted
+            return meta
+
+
+class LikeWriter:
+    """Group commit for swipes.
+
+    Swipes are buffered for up to ``max_delay_ms`` or until
+    ``max_batch_size`` of them are pending, then written and matched
+    with a single statement. Flushes run one at a time,
+    so swipes arriving during a flush form the next batch. Every caller
+    waits for the flush of its own swipe and gets its own result.
+    """
+
+    def __init__(self, sessionmaker: async_sessionmaker, cfg: LikeWriterConfig):
+        self.sessionmaker = sessionmaker
+        self.cfg = cfg
+        self._pending: list[tuple[LikeDislikePayload, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._flushes: set[asyncio.Task] = set()
+        self._lock = asyncio.Lock()
+
+    async def submit(self, like: LikeDislikePayload) -> LikeResult:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((like, future))
+
+        if len(self._pending) >= self.cfg.max_batch_size:
+            self._flush_pending()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.cfg.max_delay_ms / 1000, self._flush_pending)
+
+        return await future
+
+    async def close(self) -> None:
+        self._flush_pending()
+        await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    def _flush_pending(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, []
+        task = asyncio.create_task(self._flush(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: list[tuple[LikeDislikePayload, asyncio.Future]]) -> None:
+        async with self._lock:
+            try:
+                async with self.sessionmaker() as session:
+                    results = await LikeMatchRepository(session).create_likes([like for like, _ in batch])
+            except Exception as e:
+                logger.exception(f"Failed to write a batch of {len(batch)} swipes")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+class OutboxRelay:
+    """Publishes outbox events to RabbitMQ in the background.
+
+    Each round locks a batch of the oldest events, publishes them and
+    deletes them in the same transaction once the broker has confirmed
+    every message, so events are delivered at least once and survive a
+    broker outage. Several relays can run side by side.
+    """
+
+    def __init__(self, sessionmaker: async_sessionmaker, amqp: AMQPClient, cfg: OutboxConfig):
+        self.sessionmaker = sessionmaker
+        self.amqp = amqp
+        self.cfg = cfg
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                published = await self._relay_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Failed to relay outbox events")
+                published = 0
+
+            if published < self.cfg.batch_size:
+                await asyncio.sleep(self.cfg.poll_interval_ms / 1000)
+
+    async def _relay_batch(self) -> int:
+        async with self.sessionmaker() as session:
+            repo = LikeMatchRepository(session)
+            events = await repo.lock_outbox_batch(self.cfg.batch_size)
+            if not events:
+                return 0
+
+            by_route: dict[str, list[dict]] = {}
+            for event in events:
+                by_route.setdefault(event.routing_key, []).append(event.payload)
+            await asyncio.gather(*(
+                self.amqp.publish_batch(route, payloads)
+                for route, payloads in by_route.items()
+            ))
+            await repo.delete_outbox_events([event.id for event in events])
+            await session.commit()
+
+        logger.debug(f"Relayed {len(events)} outbox events")
+        return len(events)
+
+
+class RatingSync:
+    """Keeps user_infos.rating in step with rating_service.
+
+    rating_service publishes the new ratings of changed profiles to the
+    ratings route with the time of each change. Incoming ratings are
+    buffered, the most recently changed one per user wins, and written
+    every apply_interval_ms with a single UPDATE ... FROM (VALUES ...)
+    that skips ratings older than the stored one; the written ones are
+    passed to the candidate source. A message is
+    acked only once a batch containing it is committed; a failed batch is
+    retried with the next one.
+    """
+
+    route = "ratings"
+
+    def __init__(
+            self,
+            sessionmaker: async_sessionmaker,
+            amqp: AMQPClient,
+            source: CandidateSource,
+            cfg: RatingSyncConfig
+    ):
+        self.sessionmaker = sessionmaker
+        self.amqp = amqp
+        self.source = source
+        self.cfg = cfg
+        self._pending: dict[int, tuple[float, float]] = {}
+        self._taken = 0
+        self._applied = 0
+        self._written = asyncio.Condition()
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+        await self.amqp.consume(self.route, self._on_message, prefetch_count=self.cfg.prefetch_count)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def _buffer(self, user_id: int, rating: float, changed_at: float) -> None:
+        pending = self._pending.get(user_id)
+        if pending is None or pending[1] <= changed_at:
+            self._pending[user_id] = (rating, changed_at)
+
+    async def _on_message(self, event: dict) -> None:
+        for user_id, rating, *changed_at in event["ratings"]:
+            # messages published before changed_at was sent lose to any dated rating
+            self._buffer(user_id, rating, changed_at[0] if changed_at else 0)
+        # the ratings go out with the next batch taken from _pending
+        batch = self._taken
+        async with self._written:
+            await self._written.wait_for(lambda: self._applied > batch)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.cfg.apply_interval_ms / 1000)
+            if self._pending:
+                await self._apply()
+
+    async def _apply(self) -> None:
+        ratings, self._pending = self._pending, {}
+        self._taken += 1
+        try:
+            async with self.sessionmaker() as session:
+                updated = await LikeMatchRepository(session).update_rating(ratings)
+        except Exception:
+            logger.exception(f"Failed to apply {len(ratings)} ratings, retrying with the next batch")
+            for user_id, (rating, changed_at) in ratings.items():
+                self._buffer(user_id, rating, changed_at)
+            return
+
+        self.source.update_ratings(updated)
+        async with self._written:
+            self._applied = self._taken
+            self._written.notify_all()
+        logger.debug(f"Applied {len(ratings)} ratings, {len(updated)} user infos updated")
@@ -2,6 +2,8 @@ from dataclasses import dataclass
 
 import toml
 
+from shared.http import UpstreamConfig, load_upstreams
+
 
 @dataclass
 class RMQConfig:
@@ -33,6 +35,7 @@ class Config:
     rabbitmq: RMQConfig
     bot: BotConfig
     celery: CeleryConfig
+    upstreams: dict[str, UpstreamConfig]
 
 
 def load_config(config_path: str) -> Config:
@@ -44,6 +47,7 @@ def load_config(config_path: str) -> Config:
         rabbitmq=RMQConfig(**data["rmq"]),
         bot=BotConfig(**data["bot"]),
         celery=CeleryConfig(**data["celery"]),
+        upstreams=load_upstreams(data),
     )
 
 
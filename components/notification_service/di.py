@@ -1,9 +1,25 @@
 import os
+from collections.abc import AsyncIterable
 
 from aiogram import Bot
 from dishka import Provider, Scope, make_async_container
 
 from components.notification_service.config import Config, load_config
+from shared.amqp import AMQPClient
+from shared.http import UpstreamClients
+
+
+async def get_amqp_client(cfg: Config) -> AsyncIterable[AMQPClient]:
+    amqp = AMQPClient(cfg.rabbitmq.uri, routes=("likes", "matches"))
+    await amqp.connect()
+    yield amqp
+    await amqp.close()
+
+
+async def get_upstream_clients(cfg: Config) -> AsyncIterable[UpstreamClients]:
+    http = UpstreamClients(cfg.upstreams)
+    yield http
+    await http.close()
 
 
 def notification_service_provider() -> Provider:
@@ -16,6 +32,8 @@ def notification_service_provider() -> Provider:
                      scope=Scope.APP, provides=Config)
     provider.provide(lambda: Bot(token=cfg.bot.bot_token),
                      scope=Scope.APP, provides=Bot)
+    provider.provide(get_amqp_client, scope=Scope.APP)
+    provider.provide(get_upstream_clients, scope=Scope.APP)
     return provider
 
 
@@ -1,17 +1,17 @@
 import asyncio
 
-import msgpack
-import httpx
 from aiogram import Bot, types
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 from celery import Celery
 from celery.schedules import schedule
-import aio_pika
-from aio_pika.exchange import ExchangeType
 
 from components.notification_service.config import Config, DEFAULT_PROFILE_PHOTO_ID
 from components.notification_service.di import setup_di
+from shared.amqp import AMQPClient
+from shared.http import UpstreamClients
+
+LIKES_PER_RUN = 10000
 
 # Initialize Celery
 app = Celery('project')
@@ -41,68 +41,39 @@ def minutely_poll_likes_task():
     async def inner():
         cfg = await container.get(Config)
         bot = await container.get(Bot)
-        connection = await aio_pika.connect_robust(cfg.rabbitmq.uri)
-
-        async with connection:
-            # Create a channel
-            channel: aio_pika.abc.AbstractChannel = await connection.channel()
-
-            # Declare the queue
-            exchange = await channel.declare_exchange("likes", ExchangeType.DIRECT)
-            queue: aio_pika.abc.AbstractQueue = await channel.declare_queue("likes")
-
-            await queue.bind(exchange)
-
-            # Get the message count
-            queue_state = await queue.declare()  # Re-declare to get message count
-            message_count = queue_state.message_count
-            print(f"Queue has {message_count} messages")
-
-            if message_count == 0:
-                print("Queue is empty, exiting")
-                return
-
-            # Set QoS to prefetch messages (optional, adjust as needed)
-            await channel.set_qos(prefetch_count=1)
-
-
-
-            # Iterate over messages
-            liked_likers = {}
-            messages_processed = 0
-            async for message in queue.iterator():
-                async with message.process():
-                    like_dct = msgpack.unpackb(message.body)
-                    liked_id = like_dct["liked_id"]
-
-                    if liked_likers.get(liked_id) is None:
+        amqp = await container.get(AMQPClient)
+        http = await container.get(UpstreamClients)
 
-                        liked_likers[liked_id] = []
+        liked_likers = {}
 
-                    liked_likers[liked_id].append(like_dct["liker_id"])
-                    messages_processed += 1
-                    # Stop after processing all initial messages
-                    if messages_processed >= message_count:
-                        break
+        async def collect_likes(likes: list[dict]):
+            for like_dct in likes:
+                liked_likers.setdefault(like_dct["liked_id"], []).append(like_dct["liker_id"])
 
-            print("Finished processing all messages")
+        messages_processed = await amqp.drain("likes", collect_likes, limit=LIKES_PER_RUN)
+        if messages_processed == 0:
+            print("Queue is empty, exiting")
+            return
+        print(f"Finished processing {messages_processed} messages")
 
         for liked_id in liked_likers:
             likers = liked_likers[liked_id]
 
-            async with httpx.AsyncClient() as client:
-                existing_liked_user_matches_resp = await client.get(
-                    cfg.matching_service_url + f'/matches/{liked_id}'
+            # clean up from existing matches, page by page until every liker is checked
+            cursor = None
+            while likers:
+                params = {'cursor': cursor} if cursor else {}
+                existing_liked_user_matches_resp = await http["matching_service"].get(
+                    cfg.matching_service_url + f'/matches/{liked_id}', params=params
                 )
-                existing_liked_user_matches = existing_liked_user_matches_resp.json()
+                page = existing_liked_user_matches_resp.json()
 
-            print(existing_liked_user_matches)
+                matched_ids = {liked_user_match['user_id'] for liked_user_match in page['matches']}
+                likers = [liker for liker in likers if liker not in matched_ids]
 
-            # clean up from existing matches
-            for liked_user_match in existing_liked_user_matches:
-                matched_id = liked_user_match['user_id']
-                if matched_id in likers:
-                    likers.remove(matched_id)
+                cursor = page['next_cursor']
+                if cursor is None:
+                    break
 
             if len(likers) > 0:
                 await bot.send_message(
@@ -1,26 +1,24 @@
 import asyncio
-import aio_pika
-import msgpack
-from aio_pika import IncomingMessage, ExchangeType
 from aiogram import Bot, types
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-import httpx
 
 from components.notification_service.config import Config, DEFAULT_PROFILE_PHOTO_ID
 from components.notification_service.di import setup_di
+from shared.amqp import AMQPClient
+from shared.http import UpstreamClients
 
 
 async def send_match_messages(user1_id, user2_id):
     """Send a message via Telegram directly to the user ID."""
     cfg = await container.get(Config)
     bot = await container.get(Bot)
+    http = await container.get(UpstreamClients)
 
-    async with httpx.AsyncClient() as client:
-        get_user1_task = asyncio.create_task(client.get(f"{cfg.profile_service_url}/profiles/{user1_id}"))
-        get_user2_task = asyncio.create_task(client.get(f"{cfg.profile_service_url}/profiles/{user2_id}"))
+    get_user1_task = asyncio.create_task(http["profile_service"].get(f"{cfg.profile_service_url}/profiles/{user1_id}"))
+    get_user2_task = asyncio.create_task(http["profile_service"].get(f"{cfg.profile_service_url}/profiles/{user2_id}"))
 
-        user1_resp, user2_resp = await asyncio.gather(get_user1_task, get_user2_task)
-        user1, user2 = user1_resp.json(), user2_resp.json()
+    user1_resp, user2_resp = await asyncio.gather(get_user1_task, get_user2_task)
+    user1, user2 = user1_resp.json(), user2_resp.json()
 
     try:
         for user, user_id in zip([user1, user2], [user2_id, user1_id]):
@@ -69,42 +67,28 @@ async def send_match_messages(user1_id, user2_id):
         print(f"Error sending message to users {user1_id}, {user2_id}: {e}")
 
 
-async def process_match_message(message: IncomingMessage):
+async def process_match_message(body: dict):
     """Process messages received from the RabbitMQ queue."""
-    async with message.process():
-        try:
-            # Decode and parse the incoming JSON message
-            body = msgpack.unpackb(message.body)
-            user1_id = body.get("user1_id")
-            user2_id = body.get("user2_id")
-            # match_date = body.get("match_date")
+    try:
+        user1_id = body.get("user1_id")
+        user2_id = body.get("user2_id")
+        # match_date = body.get("match_date")
 
-            # Validate the message fields
-            if not all([user1_id, user2_id]):
-                raise ValueError("Message is missing required fields (user1_id, user2_id, match_date).")
+        # Validate the message fields
+        if not all([user1_id, user2_id]):
+            raise ValueError("Message is missing required fields (user1_id, user2_id, match_date).")
 
-            await send_match_messages(user1_id, user2_id)
-        except Exception as e:
-            print(f"Error processing message: {e}")
+        await send_match_messages(user1_id, user2_id)
+    except Exception as e:
+        print(f"Error processing message: {e}")
 
 
 async def main():
-    # Establish connection to RabbitMQ
-    cfg = await container.get(Config)
-    connection = await aio_pika.connect_robust(cfg.rabbitmq.uri)
-    async with connection:
-        channel = await connection.channel()
-
-        # Declare the "matches" queue
-        exchange = await channel.declare_exchange("matches", ExchangeType.DIRECT)
-        queue = await channel.declare_queue("matches")
-
-        # Bind the queue to the default exchange
-        await queue.bind(exchange)
+    amqp = await container.get(AMQPClient)
 
-        print('Consuming queue..')
-        await queue.consume(process_match_message)
-        await asyncio.Future()
+    print('Consuming queue..')
+    await amqp.consume("matches", process_match_message)
+    await asyncio.Future()
 
 
 if __name__ == "__main__":
@@ -112,4 +96,4 @@ if __name__ == "__main__":
         container = setup_di()
         asyncio.run(main())
     except KeyboardInterrupt:
-        print("Service stopped.")
\ No newline at end of file
+        print("Service stopped.")
@@ -0,0 +1,160 @@
+import argparse
+import asyncio
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from components.rating_service.config import Config
+from components.rating_service.di import setup_di
+from components.rating_service.elo import MATCH_EVENT, EloKernel
+from components.rating_service.repositories import ProfileRatingRepository
+from components.rating_service.services import (Leaderboard, ProfileRatingCalculator, RatingEventPublisher,
+                                                RatingService)
+from shared.http import UpstreamClients
+
+# matching_service's like and match history in the order it happened; the
+# reaction column already uses the kernel's LIKE_EVENT and DISLIKE_EVENT
+# values, and a match is replayed right after the like that formed it.
+# This is not the complete event history: likes keeps only the latest swipe
+# of every pair (a re-swipe overwrites the row) and likes_archive only the
+# old dislikes moved out of it, so a changed swipe is replayed once, in its
+# last state and at its last time
+HISTORY_SQL = f"""
+SELECT actor, target, kind FROM (
+    SELECT liker_telegram_id AS actor, liked_telegram_id AS target, reaction AS kind, created_at AS at, 0 AS phase
+    FROM likes
+    UNION ALL
+    SELECT liker_telegram_id, liked_telegram_id, reaction, created_at, 0
+    FROM likes_archive
+    UNION ALL
+    SELECT user_telegram_id, partner_telegram_id, {MATCH_EVENT}, matched_at, 1
+    FROM matches
+    WHERE user_telegram_id < partner_telegram_id
+) AS history
+ORDER BY at, phase
+"""
+
+PROFILES_CHUNK_SIZE = 500
+
+
+async def _base_ratings(http: UpstreamClients, cfg: Config, profile_ids: np.ndarray) -> np.ndarray:
+    """Initial score of every profile from its current profile data, BASE_RATING if it has none"""
+    calculator = ProfileRatingCalculator()
+    ratings = np.full(len(profile_ids), calculator.BASE_RATING, dtype=np.float64)
+    for start in range(0, len(profile_ids), PROFILES_CHUNK_SIZE):
+        chunk = profile_ids[start:start + PROFILES_CHUNK_SIZE]
+        response = await http["profile_service"].post(
+            f"{cfg.profile_service_url}/many-profiles", json=chunk.tolist()
+        )
+        response.raise_for_status()
+        for profile in response.json():
+            profile["photo_file_ids"] = profile["photo_file_ids"] or []
+            ratings[start + np.searchsorted(chunk, profile["id"])] = await calculator.calculate(
+                SimpleNamespace(**profile)
+            )
+    return ratings
+
+
+async def _load_history(cfg: Config, profile_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Events as indexes into profile_ids, events of profiles without a rating are dropped"""
+    engine = create_async_engine(cfg.matching_db.uri)
+    try:
+        async with engine.connect() as conn:
+            rows = (await conn.execute(text(HISTORY_SQL))).all()
+    finally:
+        await engine.dispose()
+
+    history = np.array(rows, dtype=np.int64).reshape(-1, 3)
+    actors, targets = (np.searchsorted(profile_ids, history[:, column]) for column in (0, 1))
+    known = np.zeros(len(history), dtype=bool)
+    if len(profile_ids):
+        last = len(profile_ids) - 1
+        known = profile_ids[np.minimum(actors, last)] == history[:, 0]
+        known &= profile_ids[np.minimum(targets, last)] == history[:, 1]
+    if not known.all():
+        logger.warning(f"Skipping {(~known).sum()} events of profiles without a rating")
+    return actors[known], targets[known], history[known, 2]
+
+
+async def replay_ratings(args: argparse.Namespace) -> None:
+    container = setup_di()
+    try:
+        cfg = await container.get(Config)
+        http = await container.get(UpstreamClients)
+        sessionmaker = await container.get(async_sessionmaker)
+        async with sessionmaker() as session:
+            refs_counts = await ProfileRatingRepository(session).get_refs_counts()
+
+        profile_ids = np.array(sorted(refs_counts), dtype=np.int64)
+        ratings = await _base_ratings(http, cfg, profile_ids)
+        actors, targets, kinds = await _load_history(cfg, profile_ids)
+
+        service = RatingService(ProfileRatingCalculator())
+        kernel = EloKernel(service.calculator, k=args.k or service.k, min_rating=service.min_rating)
+        started = time.perf_counter()
+        kernel.apply_refs(ratings, np.array([refs_counts[profile_id] for profile_id in profile_ids.tolist()]))
+        runs = kernel.apply(ratings, actors, targets, kinds)
+        logger.info(
+            f"Replayed {len(kinds)} events of {len(profile_ids)} profiles in {runs} runs, "
+            f"{time.perf_counter() - started:.2f}s"
+        )
+        if len(ratings):
+            logger.info(f"Ratings min {ratings.min():.2f}, mean {ratings.mean():.2f}, max {ratings.max():.2f}")
+
+        if args.dry_run:
+            return
+        events = await container.get(RatingEventPublisher)
+        async with sessionmaker() as session:
+            await ProfileRatingRepository(session, events=events).replace_ratings(
+                dict(zip(profile_ids.tolist(), ratings.tolist()))
+            )
+        logger.info(f"Rewrote {len(profile_ids)} ratings")
+    finally:
+        await container.close()
+
+
+async def rebuild_leaderboard(args: argparse.Namespace) -> None:
+    container = setup_di()
+    try:
+        leaderboard = await container.get(Leaderboard)
+        await leaderboard.rebuild()
+    finally:
+        await container.close()
+
+
+COMMANDS = {
+    "replay-ratings": replay_ratings,
+    "rebuild-leaderboard": rebuild_leaderboard,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m components.rating_service.commands",
+        description="Maintenance commands of the rating service",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    replay_parser = subparsers.add_parser(
+        "replay-ratings",
+        help="rebuild profile_ratings from the profiles, referrals and the like and match history; "
+             "run it after changing k, BASE_RATING or the calculator weights. Only the latest swipe of "
+             "every pair is stored, so earlier swipes that were later changed are not replayed",
+    )
+    replay_parser.add_argument("--k", type=float, help="defaults to the k of RatingService")
+    replay_parser.add_argument("--dry-run", action="store_true", help="compute and log the ratings without writing them")
+    subparsers.add_parser(
+        "rebuild-leaderboard",
+        help="rewrite the Redis leaderboards from profile_ratings; cached display names are kept",
+    )
+
+    args = parser.parse_args()
+    logger.info(f"Running {args.command}")
+    asyncio.run(COMMANDS[args.command](args))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,8 @@ from dataclasses import dataclass
 
 import toml
 
+from shared.http import UpstreamConfig, load_upstreams
+
 
 @dataclass
 class DatabaseConfig:
@@ -18,11 +20,53 @@ class DatabaseConfig:
         )
 
 
+@dataclass
+class RMQConfig:
+    host: str
+    port: int
+    user: str
+    password: str
+
+    def __post_init__(self) -> None:
+        self.uri = (
+            f"amqp://{self.user}:{self.password}@{self.host}:{self.port}/"
+        )
+
+
+@dataclass
+class RedisConfig:
+    host: str
+    port: int
+
+    def __post_init__(self) -> None:
+        self.uri = (
+            f"redis://{self.host}:{self.port}/"
+        )
+
+
+@dataclass
+class RatingEventsConfig:
+    flush_interval_ms: float
+    max_batch_size: int
+
+
+@dataclass
+class RatingDeltasConfig:
+    flush_interval_ms: float
+    max_staleness_ms: float
+
+
 @dataclass
 class Config:
     profile_service_url: str
     matching_service_url: str
     db: DatabaseConfig
+    matching_db: DatabaseConfig
+    rabbitmq: RMQConfig
+    redis: RedisConfig
+    rating_events: RatingEventsConfig
+    rating_deltas: RatingDeltasConfig
+    upstreams: dict[str, UpstreamConfig]
 
 
 def load_config(config_path: str) -> Config:
@@ -32,4 +76,10 @@ def load_config(config_path: str) -> Config:
         profile_service_url=data["profile_service_url"],
         matching_service_url=data["matching_service_url"],
         db=DatabaseConfig(**data["db"]),
+        matching_db=DatabaseConfig(**data["matching_db"]),
+        rabbitmq=RMQConfig(**data["rmq"]),
+        redis=RedisConfig(**data["redis"]),
+        rating_events=RatingEventsConfig(**data["rating_events"]),
+        rating_deltas=RatingDeltasConfig(**data["rating_deltas"]),
+        upstreams=load_upstreams(data),
     )
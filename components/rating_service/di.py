@@ -1,13 +1,19 @@
 import os
-from collections.abc import AsyncGenerator
+from collections.abc import AsyncGenerator, AsyncIterable
 
 from dishka import Provider, Scope, make_async_container, provide
+from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio import (AsyncEngine, AsyncSession,
                                     async_sessionmaker, create_async_engine)
 
 from components.rating_service.config import Config, load_config
 from components.rating_service.models import Base, ProfileRating  # noqa
 from components.rating_service.repositories import ProfileRatingRepository
+from components.rating_service.services import (MATCH_EVENTS_QUEUE, Leaderboard, MatchEventConsumer,
+                                                ProfileRatingCalculator, RatingDeltaBuffer, RatingEventPublisher,
+                                                RatingService)
+from shared.amqp import AMQPClient
+from shared.http import UpstreamClients
 
 
 def config_provider() -> Provider:
@@ -40,8 +46,78 @@ class RatingServiceProvider(Provider):
             yield session
 
     @provide(scope=Scope.REQUEST)
-    async def get_repository(self, session: AsyncSession) -> ProfileRatingRepository:
-        return ProfileRatingRepository(db=session)
+    async def get_repository(
+            self,
+            session: AsyncSession,
+            events: RatingEventPublisher,
+            deltas: RatingDeltaBuffer
+    ) -> ProfileRatingRepository:
+        return ProfileRatingRepository(db=session, events=events, deltas=deltas)
+
+    @provide(scope=Scope.APP)
+    async def get_upstream_clients(self, cfg: Config) -> AsyncIterable[UpstreamClients]:
+        http = UpstreamClients(cfg.upstreams)
+        yield http
+        await http.close()
+
+    @provide(scope=Scope.APP)
+    async def get_amqp_client(self, cfg: Config) -> AsyncIterable[AMQPClient]:
+        amqp = AMQPClient(
+            cfg.rabbitmq.uri,
+            routes=(RatingEventPublisher.route,),
+            subscriptions={MATCH_EVENTS_QUEUE: "matches"}
+        )
+        await amqp.connect()
+        yield amqp
+        await amqp.close()
+
+    @provide(scope=Scope.APP)
+    async def get_redis_client(self, cfg: Config) -> AsyncIterable[Redis]:
+        redis = Redis.from_url(cfg.redis.uri)
+        yield redis
+        await redis.aclose()
+
+    @provide(scope=Scope.APP)
+    async def get_leaderboard(self, redis: Redis, sessionmaker: async_sessionmaker) -> Leaderboard:
+        leaderboard = Leaderboard(redis=redis, sessionmaker=sessionmaker)
+        await leaderboard.ensure_built()
+        return leaderboard
+
+    @provide(scope=Scope.APP)
+    async def get_rating_event_publisher(
+            self,
+            amqp: AMQPClient,
+            leaderboard: Leaderboard,
+            cfg: Config
+    ) -> AsyncIterable[RatingEventPublisher]:
+        events = RatingEventPublisher(amqp, cfg.rating_events, leaderboard)
+        events.start()
+        yield events
+        await events.close()
+
+    @provide(scope=Scope.APP)
+    async def get_rating_delta_buffer(
+            self,
+            sessionmaker: async_sessionmaker,
+            events: RatingEventPublisher,
+            cfg: Config
+    ) -> AsyncIterable[RatingDeltaBuffer]:
+        deltas = RatingDeltaBuffer(sessionmaker, events, cfg.rating_deltas)
+        deltas.start()
+        yield deltas
+        await deltas.close()
+
+    @provide(scope=Scope.APP)
+    async def get_match_event_consumer(
+            self,
+            sessionmaker: async_sessionmaker,
+            amqp: AMQPClient,
+            events: RatingEventPublisher,
+            deltas: RatingDeltaBuffer
+    ) -> MatchEventConsumer:
+        consumer = MatchEventConsumer(sessionmaker, amqp, RatingService(ProfileRatingCalculator()), events, deltas)
+        await consumer.start()
+        return consumer
 
 
 def setup_di():
@@ -0,0 +1,76 @@
+import numpy as np
+
+from components.rating_service.services import ProfileRatingCalculator
+
+LIKE_EVENT = 1
+DISLIKE_EVENT = 0
+MATCH_EVENT = 2
+
+
+def order_preserving_batches(actors: np.ndarray, targets: np.ndarray, kinds: np.ndarray) -> list[slice]:
+    """Splits an event sequence into the longest runs that can be applied at once.
+
+    A run ends before the first event that reads a rating an earlier
+    event of the run has changed: the rated profile of a swipe, both
+    sides of a match. Applying the runs one after another gives the same
+    ratings as applying the events one by one.
+    """
+    bounds, changed = [0], set()
+    for i, (actor, target, kind) in enumerate(zip(actors.tolist(), targets.tolist(), kinds.tolist())):
+        if actor in changed or target in changed:
+            bounds.append(i)
+            changed = set()
+        changed.add(target)
+        if kind == MATCH_EVENT:
+            changed.add(actor)
+    bounds.append(len(kinds))
+    return [slice(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+class EloKernel:
+    """Applies rating events to a ratings array, a run of independent events at a time.
+
+    Events are (actor, target, kind) rows, where actor and target are
+    indexes into the ratings array: a like or dislike is an Elo update of
+    the target against the actor, a match moves both sides towards each
+    other. The formulas and rounding follow RatingService.
+    """
+
+    def __init__(self, calculator: ProfileRatingCalculator, k: float = 32, min_rating: float = 100):
+        self.calculator = calculator
+        self.k = k
+        self.min_rating = min_rating
+
+    def apply(self, ratings: np.ndarray, actors: np.ndarray, targets: np.ndarray, kinds: np.ndarray) -> int:
+        """Updates ratings in place in event order, returns the number of runs"""
+        runs = order_preserving_batches(actors, targets, kinds)
+        for run in runs:
+            self._apply_run(ratings, actors[run], targets[run], kinds[run])
+        return len(runs)
+
+    def apply_refs(self, ratings: np.ndarray, refs_count: np.ndarray) -> None:
+        """Applies refs_count referral bonuses to every profile"""
+        for round_ in range(1, int(refs_count.max(initial=0)) + 1):
+            rows = refs_count >= round_
+            old = ratings[rows]
+            bonus = np.minimum(self.calculator.REF_BONUS / (1 + old / 1000), self.calculator.REF_MAX_BONUS)
+            ratings[rows] = np.maximum(np.round(old + bonus, 2), self.min_rating)
+
+    def _apply_run(self, ratings: np.ndarray, actors: np.ndarray, targets: np.ndarray, kinds: np.ndarray) -> None:
+        actor_ratings, target_ratings = ratings[actors], ratings[targets]
+
+        swipes = kinds != MATCH_EVENT
+        if swipes.any():
+            expected = np.round(1 / (1 + 10 ** ((target_ratings[swipes] - actor_ratings[swipes]) / 400)), 2)
+            outcome = (kinds[swipes] == LIKE_EVENT).astype(np.float64)
+            delta = np.round(self.k * (outcome - expected), 2)
+            ratings[targets[swipes]] = np.maximum(target_ratings[swipes] + delta, self.min_rating)
+
+        matches = ~swipes
+        if matches.any():
+            ratings[targets[matches]] = self._match(target_ratings[matches], actor_ratings[matches])
+            ratings[actors[matches]] = self._match(actor_ratings[matches], target_ratings[matches])
+
+    def _match(self, own: np.ndarray, other: np.ndarray) -> np.ndarray:
+        new = own + self.calculator.MATCH_BONUS + (other - own) * self.calculator.MATCH_RATING_ADJUSTMENT
+        return np.maximum(np.round(new, 2), self.min_rating)
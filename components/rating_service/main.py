@@ -9,6 +9,7 @@ from prometheus_fastapi_instrumentator import Instrumentator
 
 from components.rating_service.di import setup_di
 from components.rating_service.routers import router as rating_router
+from components.rating_service.services import MatchEventConsumer
 from shared.logging_config import setup_logging
 
 SERVICE_NAME = "rating-service"
@@ -17,6 +18,7 @@ setup_logging(SERVICE_NAME)
 
 @asynccontextmanager
 async def lifespan(app_: FastAPI) -> AsyncGenerator[None, None]:
+    await app_.container.get(MatchEventConsumer)
     yield
 
     await app_.container.close()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, BigInteger, TIMESTAMP, Float, Integer
+from sqlalchemy import Column, BigInteger, TIMESTAMP, Float, Integer, String
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 
@@ -24,3 +24,14 @@ class ProfileStats(Base):
     matches_count = Column(Integer, nullable=False, default=0)
     chats_count = Column(Integer, nullable=False, default=0)
     refs_count = Column(Integer, nullable=False, default=0)
+
+
+# match events whose bonus has been applied, a redelivered event is skipped
+class ProcessedMatch(Base):
+    __tablename__ = 'processed_matches'
+
+    user1_id = Column(BigInteger, primary_key=True)
+    user2_id = Column(BigInteger, primary_key=True)
+    # a pair matching again after a profile was deleted is a new match
+    matched_at = Column(String, primary_key=True)
+    processed_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
@@ -1,18 +1,170 @@
+from collections.abc import AsyncIterator
 from datetime import datetime
+from typing import TYPE_CHECKING
 
 from loguru import logger
-from sqlalchemy import delete
+from sqlalchemy import delete, text, update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import update, delete
-from datetime import datetime
-from components.rating_service.models import ProfileRating, ProfileStats
-from components.rating_service.models import ProfileRating
+
+from components.rating_service.models import ProcessedMatch, ProfileRating, ProfileStats
+
+if TYPE_CHECKING:
+    from components.rating_service.services import RatingDeltaBuffer, RatingEventPublisher
+
+# Every rating event computes the new score from the stored score plus the
+# deltas RatingDeltaBuffer still holds and buffers the difference as a
+# per-profile delta, written with APPLY_DELTAS_SQL. Adding deltas keeps
+# concurrent writers, other processes included, from overwriting each
+# other; a delta is clamped against the score its event saw, so the sum
+# can still go below :min_rating when another process lowered the stored
+# score meanwhile, and the statement floors it again.
+APPLY_DELTAS_SQL = """
+UPDATE profile_ratings AS p
+SET rating_score = GREATEST(p.rating_score + v.delta, CAST(:min_rating AS DOUBLE PRECISION)),
+    last_calculated_at = now()
+FROM unnest(CAST(:ids AS BIGINT[]), CAST(:deltas AS DOUBLE PRECISION[])) AS v(profile_telegram_id, delta)
+WHERE p.profile_telegram_id = v.profile_telegram_id
+RETURNING p.profile_telegram_id, p.rating_score
+"""
+
+
+STATS_COLUMNS = (
+    "likes_given", "dislikes_given", "likes_received", "dislikes_received",
+    "matches_count", "chats_count", "refs_count",
+)
+
+
+def _stats_increment_sql(column: str, id_param: str) -> str:
+    """Adds 1 to one counter, the first event of a profile creates its row with that counter at 1"""
+    values = ", ".join("1" if name == column else "0" for name in STATS_COLUMNS)
+    return f"""
+    INSERT INTO profile_stats AS s (profile_telegram_id, {", ".join(STATS_COLUMNS)})
+    VALUES ({id_param}, {values})
+    ON CONFLICT (profile_telegram_id) DO UPDATE SET {column} = s.{column} + 1
+    """
+
+
+# overwrites many scores at once, used by the replay command
+REPLACE_RATINGS_SQL = """
+UPDATE profile_ratings AS p
+SET rating_score = v.rating_score, last_calculated_at = now()
+FROM unnest(CAST(:ids AS BIGINT[]), CAST(:scores AS DOUBLE PRECISION[])) AS v(profile_telegram_id, rating_score)
+WHERE p.profile_telegram_id = v.profile_telegram_id
+"""
 
 
 class ProfileRatingRepository:
-    def __init__(self, db: AsyncSession):
+    def __init__(
+            self,
+            db: AsyncSession,
+            events: "RatingEventPublisher | None" = None,
+            deltas: "RatingDeltaBuffer | None" = None
+    ):
         self.db = db
+        self.events = events
+        self.deltas = deltas
+
+    def _rating_changed(self, profile_id: int, rating_score: float) -> None:
+        if self.events is not None:
+            self.events.add(profile_id, rating_score)
+
+    async def _apply(self, statement: str, params: dict) -> dict[int, float]:
+        """Runs one rating event statement, returns the new scores by profile.
+
+        The scores include the deltas still buffered for the profiles, so a
+        direct write publishes the same score reads return.
+        """
+        result = await self.db.execute(text(statement), params)
+        ratings = {
+            row.profile_telegram_id: row.rating_score + self._pending(row.profile_telegram_id)
+            for row in result
+        }
+        await self.db.commit()
+
+        for profile_id, rating_score in ratings.items():
+            self._rating_changed(profile_id, rating_score)
+        return ratings
+
+    async def _read_settled(self, read):
+        """Runs read so that its result plus the buffered deltas gives the current scores.
+
+        A flush moves deltas from the buffer into the table; a read that
+        overlaps one could see a delta twice or not at all, so it waits for
+        the flush and is repeated.
+        """
+        if self.deltas is None:
+            return await read()
+        while True:
+            version = await self.deltas.settled()
+            result = await read()
+            if self.deltas.version == version:
+                return result
+
+    async def get_scores(self, profile_ids: list[int]) -> dict[int, float]:
+        """Current scores including buffered deltas, profiles without a rating are left out"""
+        async def read():
+            result = await self.db.execute(
+                select(ProfileRating.profile_telegram_id, ProfileRating.rating_score)
+                .where(ProfileRating.profile_telegram_id.in_(profile_ids))
+            )
+            return result.all()
+
+        rows = await self._read_settled(read)
+        return {
+            row.profile_telegram_id: row.rating_score + self._pending(row.profile_telegram_id)
+            for row in rows
+        }
+
+    def _pending(self, profile_id: int) -> float:
+        return self.deltas.pending(profile_id) if self.deltas is not None else 0
+
+    async def add_deltas(self, deltas: dict[int, float], min_rating: float) -> None:
+        """Buffers score changes, or writes them at once when there is no buffer"""
+        if self.deltas is None:
+            await self.apply_deltas(deltas, min_rating)
+            return
+        await self.deltas.add(deltas)
+
+    async def apply_deltas(self, deltas: dict[int, float], min_rating: float) -> dict[int, float]:
+        """Adds the deltas to the stored scores in one statement, no score drops below min_rating"""
+        return await self._apply(APPLY_DELTAS_SQL, {
+            "ids": list(deltas), "deltas": list(deltas.values()), "min_rating": min_rating
+        })
+
+    async def increment_stats(self, column: str, profile_id: int) -> None:
+        """Adds 1 to a profile_stats counter, creating the profile's stats if needed"""
+        await self.db.execute(text(_stats_increment_sql(column, ":profile_id")), {"profile_id": profile_id})
+        await self.db.commit()
+
+    async def get_refs_counts(self) -> dict[int, int]:
+        """Returns refs_count of every rated profile, 0 for profiles without stats"""
+        result = await self.db.execute(
+            select(ProfileRating.profile_telegram_id, ProfileStats.refs_count)
+            .outerjoin(ProfileStats, ProfileStats.profile_telegram_id == ProfileRating.profile_telegram_id)
+        )
+        return {row.profile_telegram_id: row.refs_count or 0 for row in result}
+
+    async def replace_ratings(self, ratings: dict[int, float]) -> None:
+        """Overwrites the scores of the given profiles in one statement"""
+        await self.db.execute(text(REPLACE_RATINGS_SQL), {
+            "ids": list(ratings), "scores": list(ratings.values())
+        })
+        await self.db.commit()
+
+        for profile_id, rating_score in ratings.items():
+            self._rating_changed(profile_id, rating_score)
+
+    async def claim_match(self, user1_id: int, user2_id: int, matched_at: str) -> bool:
+        """Records a match event as processed without committing, False if it already was"""
+        result = await self.db.execute(
+            insert(ProcessedMatch)
+            .values(user1_id=user1_id, user2_id=user2_id, matched_at=matched_at)
+            .on_conflict_do_nothing()
+            .returning(ProcessedMatch.user1_id)
+        )
+        return result.first() is not None
 
     async def create_rating(
             self,
@@ -33,6 +185,7 @@ class ProfileRatingRepository:
         await self.db.commit()
         await self.db.refresh(new_rating)
         logger.info(f"Successfully created and committed rating entry for telegram_id: {profile_telegram_id}")
+        self._rating_changed(new_rating.profile_telegram_id, new_rating.rating_score)
 
         return new_rating
 
@@ -51,6 +204,25 @@ class ProfileRatingRepository:
 
         return rating
 
+    async def get_current_rating(self, profile_id: int) -> ProfileRating | None:
+        """The stored rating with buffered deltas added, as a detached copy"""
+        async def read():
+            result = await self.db.execute(
+                select(ProfileRating)
+                .where(ProfileRating.profile_telegram_id == profile_id)
+                .execution_options(populate_existing=True)
+            )
+            return result.scalars().first()
+
+        rating = await self._read_settled(read)
+        if not rating:
+            return None
+        return ProfileRating(
+            profile_telegram_id=rating.profile_telegram_id,
+            rating_score=rating.rating_score + self._pending(profile_id),
+            last_calculated_at=rating.last_calculated_at
+        )
+
     async def update_rating(
             self,
             profile_id: int,
@@ -58,21 +230,22 @@ class ProfileRatingRepository:
     ) -> ProfileRating:
 
         logger.info(f"Attempting to update rating for profile_id: {profile_id} to new score: {new_rating}")
-        rating = await self.get_rating_by_profile_id(profile_id)
+        result = await self.db.execute(
+            update(ProfileRating)
+            .where(ProfileRating.profile_telegram_id == profile_id)
+            .values(rating_score=new_rating, last_calculated_at=datetime.now())
+            .returning(ProfileRating)
+        )
+        rating = result.scalars().first()
 
         if not rating:
             logger.warning(
                 f"Rating not found for profile_id: {profile_id} during update attempt. Creating new rating instead.")
             return await self.create_rating(profile_id, new_rating)
 
-        logger.debug(
-            f"Found existing rating for profile_id {profile_id}. Current score: {rating.rating_score}. Proceeding with update.")
-        rating.rating_score = new_rating
-        rating.last_calculated_at = datetime.now()
-
         await self.db.commit()
-        await self.db.refresh(rating)
         logger.info(f"Successfully updated and committed rating for profile_id: {profile_id}")
+        self._rating_changed(rating.profile_telegram_id, rating.rating_score)
         return rating
 
     async def delete_rating(self, profile_id: int) -> bool:
@@ -85,6 +258,12 @@ class ProfileRatingRepository:
         await self.db.commit()
         return result.rowcount > 0
 
+    async def iter_ratings(self, batch_size: int = 5000) -> AsyncIterator[dict[int, float]]:
+        """Streams every stored score in batches of {profile_id: rating_score}"""
+        result = await self.db.stream(select(ProfileRating.profile_telegram_id, ProfileRating.rating_score))
+        async for partition in result.partitions(batch_size):
+            yield {row.profile_telegram_id: row.rating_score for row in partition}
+
     async def get_top_ratings(self, limit: int = 10) -> list[ProfileRating]:
         logger.info(f"Attempting to retrieve top {limit} ratings.")
         result = await self.db.execute(
@@ -152,34 +331,6 @@ class ProfileRatingRepository:
             await self.db.refresh(stats)
             return stats
 
-    async def add_chat(self, user_id):
-        stats = await self.get_stats_by_profile_id(user_id)
-        if not stats:
-            stats = ProfileStats(chats_count=0)
-            self.db.add(stats)
-
-        stats.chats_count = stats.chats_count + 1 if stats.chats_count else 1
-
-        await self.db.commit()
-        await self.db.refresh(stats)
-
-        print('Zdravo')
-        return
-
-    async def add_ref(self, user_id):
-        stats = await self.get_stats_by_profile_id(user_id)
-        if not stats:
-            stats = ProfileStats(refs_count=0)
-            self.db.add(stats)
-
-        stats.refs_count = stats.refs_count + 1 if stats.refs_count else 1
-
-        await self.db.commit()
-        await self.db.refresh(stats)
-
-        print('Zdravo')
-        return
-
     async def delete_stats(self, profile_id: int) -> bool:
         logger.info(f"Attempting to delete stats for profile_id: {profile_id}")
         result = await self.db.execute(
@@ -1,4 +1,3 @@
-import httpx
 from dishka import FromDishka
 from dishka.integrations.fastapi import DishkaRoute
 from fastapi import HTTPException, APIRouter
@@ -9,9 +8,9 @@ from components.rating_service.repositories import ProfileRatingRepository
 
 from components.rating_service.schemas import RatingCreate, RatingResponse, RatingBase, ProfileInfoCreate, \
     LikeDislikePayload, ProfileInfoUpdate, StatsInfo, MatchingPayload, ChatPayload
-from components.rating_service.schemas import RatingResponse, RatingBase, ProfileInfoCreate, \
-    LikeDislikePayload
-from components.rating_service.services import RatingService, ProfileRatingCalculator
+from components.rating_service.services import (Leaderboard, RatingDeltaBuffer, RatingEventPublisher, RatingService,
+                                                ProfileRatingCalculator)
+from shared.http import UpstreamClients
 
 service = RatingService(ProfileRatingCalculator())
 router = APIRouter(route_class=DishkaRoute)
@@ -21,6 +20,7 @@ router = APIRouter(route_class=DishkaRoute)
 async def create_rating(
         rating_data: ProfileInfoCreate,
         rating_repo: FromDishka[ProfileRatingRepository],
+        leaderboard: FromDishka[Leaderboard],
 ):
     telegram_id = rating_data.telegram_id
     logger.info(f"Attempting to create initial rating for telegram_id: {telegram_id}")
@@ -35,6 +35,9 @@ async def create_rating(
     rating = await service.init_rating(rating_data)
     logger.info(f"Calculated initial rating for telegram_id {telegram_id}: {rating}")
 
+    await leaderboard.set_profile(
+        telegram_id, rating_data.first_name, rating_data.last_name, rating_data.city, rating_data.gender
+    )
     logger.debug(f"Creating rating entry in database for telegram_id: {telegram_id}")
     profile_rating = await rating_repo.create_rating(
         profile_telegram_id=rating_data.telegram_id,
@@ -50,7 +53,9 @@ async def create_rating(
 async def create_rating(
         rating_data: ProfileInfoCreate,
         rating_repo: FromDishka[ProfileRatingRepository],
-        cfg: FromDishka[Config]
+        leaderboard: FromDishka[Leaderboard],
+        cfg: FromDishka[Config],
+        http: FromDishka[UpstreamClients]
 ):
     telegram_id = rating_data.telegram_id
     logger.info(f"Attempting to update rating based on profile changes for telegram_id: {telegram_id}")
@@ -59,31 +64,34 @@ async def create_rating(
     if not profile:
         raise HTTPException(status_code=404, detail="No Profile")
 
+    await leaderboard.set_profile(
+        telegram_id, rating_data.first_name, rating_data.last_name, rating_data.city, rating_data.gender
+    )
+
     profile_service_url = f"{cfg.profile_service_url}/profiles/{telegram_id}"
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(profile_service_url)
-
-        if response.status_code == 404:
-            logger.error(
-                f"Profile not found in Profile Service (URL: {profile_service_url}) but rating exists for telegram_id: {telegram_id}.")
-
-        elif response.status_code == 200:
-            answer = response.json()
-            logger.debug(
-                f"Received profile data from Profile Service for telegram_id {telegram_id}: {answer}")
-            old_rating = profile.rating_score
-            logger.debug(f"Calculating updated rating for telegram_id {telegram_id}. Old rating: {old_rating}")
-            rating = service.update_rating(old_rating, answer)
-            logger.info(f"Calculated updated rating for telegram_id {telegram_id}: {rating}")
-
-            logger.debug(f"Updating rating entry in database for telegram_id: {telegram_id}")
-            profile_rating = await rating_repo.update_rating(
-                profile_id=rating_data.telegram_id,
-                new_rating=rating
-            )
-            logger.info(f"Successfully updated rating for telegram_id: {telegram_id}")
-            return profile_rating
+    response = await http["profile_service"].get(profile_service_url)
+
+    if response.status_code == 404:
+        logger.error(
+            f"Profile not found in Profile Service (URL: {profile_service_url}) but rating exists for telegram_id: {telegram_id}.")
+
+    elif response.status_code == 200:
+        answer = response.json()
+        logger.debug(
+            f"Received profile data from Profile Service for telegram_id {telegram_id}: {answer}")
+        old_rating = profile.rating_score
+        logger.debug(f"Calculating updated rating for telegram_id {telegram_id}. Old rating: {old_rating}")
+        rating = service.update_rating(old_rating, answer)
+        logger.info(f"Calculated updated rating for telegram_id {telegram_id}: {rating}")
+
+        logger.debug(f"Updating rating entry in database for telegram_id: {telegram_id}")
+        profile_rating = await rating_repo.update_rating(
+            profile_id=rating_data.telegram_id,
+            new_rating=rating
+        )
+        logger.info(f"Successfully updated rating for telegram_id: {telegram_id}")
+        return profile_rating
 
 
 @router.get("/ratings/{profile_id}", response_model=RatingResponse)
@@ -92,7 +100,7 @@ async def get_rating(
         rating_repo: FromDishka[ProfileRatingRepository]
 ):
     logger.info(f"Attempting to get rating for profile_id: {profile_id}")
-    rating = await rating_repo.get_rating_by_profile_id(profile_id)
+    rating = await rating_repo.get_current_rating(profile_id)
     if not rating:
         logger.warning(f"Rating not found for profile_id: {profile_id}")
         raise HTTPException(status_code=404, detail="Rating not found")
@@ -100,6 +108,25 @@ async def get_rating(
     return rating
 
 
+@router.get("/ratings/{profile_id}/rank")
+async def get_rank(
+        profile_id: int,
+        leaderboard: FromDishka[Leaderboard],
+        city: str | None = None,
+        gender: str | None = None
+):
+    if city and gender:
+        raise HTTPException(status_code=400, detail="Boards are kept per city or per gender, not both")
+
+    place = await leaderboard.rank(profile_id, city=city, gender=gender)
+    if place is None:
+        raise HTTPException(status_code=404, detail="Rating not found")
+
+    rank, total = place
+    # share of the board's profiles ranked below this one
+    return {"rank": rank, "total": total, "percentile": round(100 * (total - rank) / total, 1)}
+
+
 @router.put("/ratings/{profile_id}", response_model=RatingResponse)
 async def update_rating(
         profile_id: int,
@@ -115,48 +142,54 @@ async def update_rating(
 @router.delete("/ratings/{profile_id}")
 async def delete_rating(
         profile_id: int,
-        rating_repo: FromDishka[ProfileRatingRepository]
+        rating_repo: FromDishka[ProfileRatingRepository],
+        leaderboard: FromDishka[Leaderboard],
+        deltas: FromDishka[RatingDeltaBuffer],
+        events: FromDishka[RatingEventPublisher]
 ):
     logger.info(f"Attempting to delete rating for profile_id: {profile_id}")
     success = await rating_repo.delete_rating(profile_id)
     if not success:
         logger.warning(f"Rating not found for deletion attempt for profile_id: {profile_id}")
         raise HTTPException(status_code=404, detail="Rating not found")
+
+    # pending changes would put the profile back on the leaderboards
+    deltas.discard(profile_id)
+    events.discard(profile_id)
+    await leaderboard.remove(profile_id)
     logger.info(f"Successfully deleted rating for profile_id: {profile_id}")
     return {"message": "Rating deleted successfully"}
 
 
 @router.get("/top")
 async def get_top_ratings(
-        rating_repo: FromDishka[ProfileRatingRepository],
+        leaderboard: FromDishka[Leaderboard],
         cfg: FromDishka[Config],
-        limit: int = 10
+        http: FromDishka[UpstreamClients],
+        limit: int = 10,
+        city: str | None = None,
+        gender: str | None = None
 ):
+    if city and gender:
+        raise HTTPException(status_code=400, detail="Boards are kept per city or per gender, not both")
+
     logger.info(f"Attempting to get top {limit} ratings.")
-    profile_ratings = await rating_repo.get_top_ratings(limit)
+    top_profiles = await leaderboard.top(limit, city=city, gender=gender)
 
-    profiles_ids = [profile.profile_telegram_id for profile in profile_ratings]
-    print(profiles_ids)
-    async with httpx.AsyncClient() as client:
-        response = await client.post(f"{cfg.profile_service_url}/many-profiles", json=profiles_ids)
+    # names of profiles rated before the leaderboard existed are cached on first use
+    missing = {profile["profile_telegram_id"]: profile for profile in top_profiles if profile["first_name"] is None}
+    if missing:
+        response = await http["profile_service"].post(f"{cfg.profile_service_url}/many-profiles", json=list(missing))
         if response.status_code != 200:
             raise HTTPException(status_code=500, detail=f'Fimoz: {response.json()}')
+        for profile in response.json():
+            await leaderboard.set_profile(
+                profile["id"], profile["first_name"], profile["last_name"], profile["city"], profile["gender"]
+            )
+            missing[profile["id"]].update(first_name=profile["first_name"], last_name=profile["last_name"])
 
-    profiles = response.json()
-    top_profiles = []
-    for profile in profiles:
-        target_rating = 0
-        for rating in profile_ratings:
-            if rating.profile_telegram_id == profile['id']:
-                target_rating = rating.rating_score
-                break
-        top_profiles.append({"first_name": profile["first_name"], "last_name": profile["last_name"], "rating": target_rating})
-
-    top_top_profiles = sorted(top_profiles, key=lambda x: x["rating"], reverse=True)
-    logger.info(f"Retrieved {len(profiles)} top profiles.")
-    logger.debug(f"Top profile IDs and ratings: {[(p.profile_telegram_id, p.rating_score) for p in profile_ratings]}")
-
-    return top_top_profiles
+    logger.info(f"Retrieved {len(top_profiles)} top profiles.")
+    return [profile for profile in top_profiles if profile["first_name"] is not None]
 
 
 @router.post("/ratings/like")
@@ -164,15 +197,13 @@ async def rate_like(
         payload: LikeDislikePayload,
         rating_repo: FromDishka[ProfileRatingRepository]
 ):
-    rater_rating = await rating_repo.get_rating_by_profile_id(payload.rater_user_id)
-    rated_rating = await rating_repo.get_rating_by_profile_id(payload.rated_user_id)
-    logger.info(
-        f"Processing 'like' from rater_id {rater_rating.profile_telegram_id} to rated_id {rated_rating.profile_telegram_id}")
+    logger.info(f"Processing 'like' from rater_id {payload.rater_user_id} to rated_id {payload.rated_user_id}")
     logger.debug(f"Like payload: {payload.model_dump()}")
 
-    rating = await service.add_like(rater_rating.rating_score, rated_rating.rating_score)
-    await rating_repo.update_rating(payload.rated_user_id, rated_rating.rating_score + rating)
-    logger.info(f"Successfully updated rating for rated_id {rated_rating.profile_telegram_id} after like.")
+    ratings = await service.apply_like(rating_repo, payload.rater_user_id, payload.rated_user_id)
+    if not ratings:
+        raise HTTPException(status_code=404, detail="Rating not found")
+    logger.info(f"Successfully updated rating for rated_id {payload.rated_user_id} after like.")
     return
 
 
@@ -181,15 +212,13 @@ async def rate_dislike(
         payload: LikeDislikePayload,
         rating_repo: FromDishka[ProfileRatingRepository]
 ):
-    rater_rating = await rating_repo.get_rating_by_profile_id(payload.rater_user_id)
-    rated_rating = await rating_repo.get_rating_by_profile_id(payload.rated_user_id)
-    logger.info(
-        f"Processing 'dislike' from rater_id {rater_rating.profile_telegram_id} to rated_id {rated_rating.profile_telegram_id}")
+    logger.info(f"Processing 'dislike' from rater_id {payload.rater_user_id} to rated_id {payload.rated_user_id}")
     logger.debug(f"Dislike payload: {payload.model_dump()}")
 
-    rating = await service.add_dislike(rater_rating.rating_score, rated_rating.rating_score)
-    await rating_repo.update_rating(payload.rated_user_id, rated_rating.rating_score + rating)
-    logger.info(f"Successfully updated rating for rated_id {rated_rating.profile_telegram_id} after dislike.")
+    ratings = await service.apply_dislike(rating_repo, payload.rater_user_id, payload.rated_user_id)
+    if not ratings:
+        raise HTTPException(status_code=404, detail="Rating not found")
+    logger.info(f"Successfully updated rating for rated_id {payload.rated_user_id} after dislike.")
     return
 
 
@@ -197,11 +226,11 @@ async def rate_dislike(
 async def stat_info(
         profile_id: int,
         rating_repo: FromDishka[ProfileRatingRepository],
-        cfg: FromDishka[Config]
+        cfg: FromDishka[Config],
+        http: FromDishka[UpstreamClients]
 ):
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{cfg.matching_service_url}/match/stats/{profile_id}")
-        stats = response.json()
+    response = await http["matching_service"].get(f"{cfg.matching_service_url}/match/stats/{profile_id}")
+    stats = response.json()
 
     stats_info = await rating_repo.get_stats_by_profile_id(profile_id)
     if not stats_info:
@@ -217,13 +246,7 @@ async def note_match(
         payload: MatchingPayload,
         rating_repo: FromDishka[ProfileRatingRepository]
 ):
-    rating1 = await rating_repo.get_rating_by_profile_id(payload.user1_id)
-    rating2 = await rating_repo.get_rating_by_profile_id(payload.user2_id)
-
-    new_rating = await service.match(rating1, rating2)
-
-    await rating_repo.update_rating(payload.user1_id, new_rating['user1'])
-    await rating_repo.update_rating(payload.user2_id, new_rating['user2'])
+    await service.apply_match(rating_repo, payload.user1_id, payload.user2_id)
 
     return
 
@@ -232,13 +255,7 @@ async def note_chat(
         payload: ChatPayload,
         rating_repo: FromDishka[ProfileRatingRepository]
 ):
-
-    watcher_rating = await rating_repo.get_rating_by_profile_id(payload.watcher_id)
-    watched_rating = await rating_repo.get_rating_by_profile_id(payload.watched_id)
-    new_rating = await service.chat(watcher_rating, watched_rating)
-    await rating_repo.add_chat(payload.watched_id)
-
-    await rating_repo.update_rating(payload.watched_id, new_rating)
+    await service.apply_chat(rating_repo, payload.watcher_id, payload.watched_id)
 
     return
 
@@ -247,11 +264,7 @@ async def note_ref(
     user_id: int,
     rating_repo: FromDishka[ProfileRatingRepository]
 ):
-    user = await rating_repo.get_rating_by_profile_id(user_id)
-    new_rating = await service.ref(user)
-    await rating_repo.add_ref(user_id)
-
-    await rating_repo.update_rating(user_id, new_rating)
+    await service.apply_ref(rating_repo, user_id)
 
     return
 
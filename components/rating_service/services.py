@@ -1,7 +1,29 @@
+import asyncio
+import time
+
+from loguru import logger
+from redis.asyncio import Redis
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from components.rating_service.config import RatingDeltasConfig, RatingEventsConfig
+from components.rating_service.repositories import ProfileRatingRepository
+from shared.amqp import AMQPClient
+
+MATCH_EVENTS_QUEUE = "rating_matches"
+
+
 class ProfileRatingCalculator:
     BASE_RATING = 800
+    MIN_RATING = 100
     MAX_BONUS = 200
 
+    MATCH_BONUS = 25
+    MATCH_RATING_ADJUSTMENT = 0.05
+    REF_BONUS = 50
+    REF_MAX_BONUS = 250
+    CHAT_BONUS = 10
+    CHAT_ACTIVITY_BONUS = 0.1
+
     WEIGHTS = {
         'profile_completeness': 0.30,
         'photo_quality': 0.25,
@@ -40,32 +62,23 @@ class ProfileRatingCalculator:
 
     @classmethod
     async def update_match(cls, old_rating, match_rating):
-        rating_adjustment = 0.05
-        base_match_bonus = 25
-
         rating_diff = match_rating - old_rating
-        adjustment = rating_diff * rating_adjustment
-        return old_rating + base_match_bonus + adjustment
+        adjustment = rating_diff * cls.MATCH_RATING_ADJUSTMENT
+        return old_rating + cls.MATCH_BONUS + adjustment
 
     @classmethod
     async def update_ref(cls, old_rating):
-        base_ref_bonus = 50
-        max_ref_bonus = 250
-
-        bonus = base_ref_bonus / (1 + old_rating / 1000)
-        return min(old_rating + bonus, old_rating + max_ref_bonus)
+        bonus = cls.REF_BONUS / (1 + old_rating / 1000)
+        return min(old_rating + bonus, old_rating + cls.REF_MAX_BONUS)
 
     @classmethod
     async def update_chat(cls, old_rating, chat_rating):
-        activity_bonus = 0.1
-        base_chat_bonus = 10
-
-        mutual_bonus = (old_rating + chat_rating) * activity_bonus
-        return old_rating + base_chat_bonus + mutual_bonus
+        mutual_bonus = (old_rating + chat_rating) * cls.CHAT_ACTIVITY_BONUS
+        return old_rating + cls.CHAT_BONUS + mutual_bonus
 
 
 class RatingService:
-    def __init__(self, calculator: ProfileRatingCalculator, k=32, min_rating=100):
+    def __init__(self, calculator: ProfileRatingCalculator, k=32, min_rating=ProfileRatingCalculator.MIN_RATING):
         self.calculator = calculator
         self.ratings = {}
         self.k = k
@@ -120,4 +133,436 @@ class RatingService:
 
         new_rating = await self.calculator.update_ref(old_rating)
 
-        return round(max(new_rating, self.min_rating), 2)
\ No newline at end of file
+        return round(max(new_rating, self.min_rating), 2)
+
+    # The apply_* methods return the new scores by profile; an empty dict
+    # means a profile had no rating. Every event is computed from the
+    # current scores, buffered deltas included, and buffered as deltas.
+
+    async def apply_like(self, repo: ProfileRatingRepository, rater_id: int, rated_id: int) -> dict[int, float]:
+        return await self._apply_elo(repo, rater_id, rated_id, outcome=1)
+
+    async def apply_dislike(self, repo: ProfileRatingRepository, rater_id: int, rated_id: int) -> dict[int, float]:
+        return await self._apply_elo(repo, rater_id, rated_id, outcome=0)
+
+    async def _apply_elo(
+            self,
+            repo: ProfileRatingRepository,
+            rater_id: int,
+            rated_id: int,
+            outcome: float
+    ) -> dict[int, float]:
+        scores = await repo.get_scores([rater_id, rated_id])
+        if rater_id not in scores or rated_id not in scores:
+            return {}
+
+        expected = round(1 / (1 + 10 ** ((scores[rated_id] - scores[rater_id]) / 400)), 2)
+        delta = round(self.k * (outcome - expected), 2)
+        return await self._add_deltas(repo, scores, {rated_id: max(scores[rated_id] + delta, self.min_rating)})
+
+    async def apply_match(
+            self,
+            repo: ProfileRatingRepository,
+            user1_id: int,
+            user2_id: int,
+            buffered: bool = True
+    ) -> dict[int, float]:
+        scores = await repo.get_scores([user1_id, user2_id])
+        if user1_id not in scores or user2_id not in scores:
+            return {}
+
+        def moved(own: float, other: float) -> float:
+            new = own + self.calculator.MATCH_BONUS + (other - own) * self.calculator.MATCH_RATING_ADJUSTMENT
+            return max(round(new, 2), self.min_rating)
+
+        return await self._add_deltas(repo, scores, {
+            user1_id: moved(scores[user1_id], scores[user2_id]),
+            user2_id: moved(scores[user2_id], scores[user1_id]),
+        }, buffered=buffered)
+
+    async def _add_deltas(
+            self,
+            repo: ProfileRatingRepository,
+            scores: dict[int, float],
+            ratings: dict[int, float],
+            buffered: bool = True
+    ) -> dict[int, float]:
+        deltas = {profile_id: rating - scores[profile_id] for profile_id, rating in ratings.items()}
+        if buffered:
+            # RatingDeltaBuffer.add takes the deltas in before its first await, so
+            # nothing runs between reading the scores and buffering them and
+            # concurrent events on a profile see each other's changes
+            await repo.add_deltas(deltas, self.min_rating)
+        else:
+            # committed at once, together with anything else pending in the session
+            await repo.apply_deltas(deltas, self.min_rating)
+        return ratings
+
+    async def apply_chat(self, repo: ProfileRatingRepository, watcher_id: int, watched_id: int) -> dict[int, float]:
+        await repo.increment_stats("chats_count", watched_id)
+        scores = await repo.get_scores([watcher_id, watched_id])
+        if watcher_id not in scores or watched_id not in scores:
+            return {}
+
+        own = scores[watched_id]
+        new = own + self.calculator.CHAT_BONUS + (own + scores[watcher_id]) * self.calculator.CHAT_ACTIVITY_BONUS
+        return await self._add_deltas(repo, scores, {watched_id: max(round(new, 2), self.min_rating)})
+
+    async def apply_ref(self, repo: ProfileRatingRepository, user_id: int) -> dict[int, float]:
+        await repo.increment_stats("refs_count", user_id)
+        scores = await repo.get_scores([user_id])
+        if user_id not in scores:
+            return {}
+
+        own = scores[user_id]
+        new = own + min(self.calculator.REF_BONUS / (1 + own / 1000), self.calculator.REF_MAX_BONUS)
+        return await self._add_deltas(repo, scores, {user_id: max(round(new, 2), self.min_rating)})
+
+
+class Leaderboard:
+    """Redis sorted sets of rated profiles by score, for /top.
+
+    rating:top holds every rated profile, rating:top:city:<city> and
+    rating:top:gender:<gender> only the profiles of that city or gender.
+    Display names, city and gender are cached in rating:profile:<id>
+    whenever profile data reaches rating_service, so a board is read with
+    one ZREVRANGE and one pipelined HMGET per entry. Scores are written
+    with every flush of RatingEventPublisher. Postgres stays the source
+    of truth: an empty board is rebuilt from profile_ratings.
+    """
+
+    KEY = "rating:top"
+    PROFILE_FIELDS = ("first_name", "last_name", "city", "gender")
+
+    def __init__(self, redis: Redis, sessionmaker: async_sessionmaker):
+        self.redis = redis
+        self.sessionmaker = sessionmaker
+
+    @classmethod
+    def board_key(cls, city: str | None = None, gender: str | None = None) -> str:
+        if city:
+            return f"{cls.KEY}:city:{cls._normalize(city)}"
+        if gender:
+            return f"{cls.KEY}:gender:{cls._normalize(gender)}"
+        return cls.KEY
+
+    @staticmethod
+    def _profile_key(profile_id: int) -> str:
+        return f"rating:profile:{profile_id}"
+
+    @staticmethod
+    def _normalize(value: str | bytes | None) -> str:
+        if isinstance(value, bytes):
+            value = value.decode()
+        return (value or "").strip().lower()
+
+    @classmethod
+    def _group_keys(cls, city: str | bytes | None, gender: str | bytes | None) -> set[str]:
+        city, gender = cls._normalize(city), cls._normalize(gender)
+        return {
+            key for key, value in ((cls.board_key(city=city), city), (cls.board_key(gender=gender), gender)) if value
+        }
+
+    async def update(self, ratings: dict[int, float]) -> None:
+        """Writes new scores to the global board and the boards of each profile's city and gender"""
+        profile_ids = list(ratings)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for profile_id in profile_ids:
+                pipe.hmget(self._profile_key(profile_id), "city", "gender")
+            groups = await pipe.execute()
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(self.KEY, ratings)
+            for profile_id, (city, gender) in zip(profile_ids, groups):
+                for key in self._group_keys(city, gender):
+                    pipe.zadd(key, {profile_id: ratings[profile_id]})
+            await pipe.execute()
+
+    async def set_profile(
+            self,
+            profile_id: int,
+            first_name: str | None,
+            last_name: str | None,
+            city: str | None,
+            gender: str | None
+    ) -> None:
+        """Caches the display name and moves the profile to the boards of its city and gender"""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hmget(self._profile_key(profile_id), "city", "gender")
+            pipe.zscore(self.KEY, profile_id)
+            (old_city, old_gender), score = await pipe.execute()
+
+        old_keys, new_keys = self._group_keys(old_city, old_gender), self._group_keys(city, gender)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._profile_key(profile_id), mapping={
+                "first_name": first_name or "",
+                "last_name": last_name or "",
+                "city": self._normalize(city),
+                "gender": self._normalize(gender),
+            })
+            for key in old_keys - new_keys:
+                pipe.zrem(key, profile_id)
+            if score is not None:
+                for key in new_keys:
+                    pipe.zadd(key, {profile_id: score})
+            await pipe.execute()
+
+    async def remove(self, profile_id: int) -> None:
+        city, gender = await self.redis.hmget(self._profile_key(profile_id), "city", "gender")
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for key in self._group_keys(city, gender) | {self.KEY}:
+                pipe.zrem(key, profile_id)
+            pipe.delete(self._profile_key(profile_id))
+            await pipe.execute()
+
+    async def top(self, limit: int, city: str | None = None, gender: str | None = None) -> list[dict]:
+        """Best profiles of a board with their cached names, None names when not cached yet"""
+        entries = await self.redis.zrevrange(self.board_key(city, gender), 0, limit - 1, withscores=True)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for member, _ in entries:
+                pipe.hmget(self._profile_key(int(member)), "first_name", "last_name")
+            names = await pipe.execute()
+
+        return [
+            {
+                "profile_telegram_id": int(member),
+                "first_name": first_name.decode() if first_name is not None else None,
+                "last_name": last_name.decode() if last_name is not None else None,
+                "rating": score,
+            }
+            for (member, score), (first_name, last_name) in zip(entries, names)
+        ]
+
+    async def rank(
+            self,
+            profile_id: int,
+            city: str | None = None,
+            gender: str | None = None
+    ) -> tuple[int, int] | None:
+        """1-based place of the profile on a board and the board's size, None if it is not on the board"""
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zrevrank(self.board_key(city, gender), profile_id)
+            pipe.zcard(self.board_key(city, gender))
+            rank, total = await pipe.execute()
+        if rank is None:
+            return None
+        return rank + 1, total
+
+    async def ensure_built(self) -> None:
+        if not await self.redis.exists(self.KEY):
+            await self.rebuild()
+
+    async def rebuild(self) -> int:
+        """Rewrites every board from profile_ratings, returns the number of profiles"""
+        async for key in self.redis.scan_iter(match=f"{self.KEY}*"):
+            await self.redis.delete(key)
+
+        profiles = 0
+        async with self.sessionmaker() as session:
+            async for ratings in ProfileRatingRepository(session).iter_ratings():
+                await self.update(ratings)
+                profiles += len(ratings)
+        logger.info(f"Rebuilt rating leaderboards for {profiles} profiles")
+        return profiles
+
+
+class RatingEventPublisher:
+    """Publishes changed ratings to the ratings route for matching_service.
+
+    Changes are coalesced per profile, the newest rating wins, and sent
+    every flush_interval_ms as msgpack messages of up to max_batch_size
+    [profile_id, rating, changed_at] entries, changed_at being the epoch
+    seconds of the change. The new rating rather than the delta is sent,
+    so a redelivered message does no harm, and matching_service skips a
+    rating older than the one it has, as messages of several processes
+    or a retried flush can arrive out of order. Changes that fail to
+    publish are retried with the next flush, pending ones are flushed
+    on close. Each flush also writes the changes to the leaderboard.
+    """
+
+    route = "ratings"
+
+    def __init__(self, amqp: AMQPClient, cfg: RatingEventsConfig, leaderboard: Leaderboard | None = None):
+        self.amqp = amqp
+        self.cfg = cfg
+        self.leaderboard = leaderboard
+        self._pending: dict[int, tuple[float, float]] = {}
+        self._task: asyncio.Task | None = None
+
+    def add(self, profile_id: int, rating: float) -> None:
+        self._pending[profile_id] = (rating, time.time())
+
+    def discard(self, profile_id: int) -> None:
+        self._pending.pop(profile_id, None)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await self._flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.cfg.flush_interval_ms / 1000)
+            await self._flush()
+
+    async def _flush(self) -> None:
+        if not self._pending:
+            return
+
+        ratings, self._pending = self._pending, {}
+        if self.leaderboard is not None:
+            try:
+                await self.leaderboard.update({profile_id: rating for profile_id, (rating, _) in ratings.items()})
+            except Exception:
+                logger.exception(f"Failed to update the leaderboard with {len(ratings)} rating changes")
+
+        items = [[profile_id, rating, changed_at] for profile_id, (rating, changed_at) in ratings.items()]
+        size = self.cfg.max_batch_size
+        try:
+            await self.amqp.publish_batch(self.route, [
+                {"ratings": items[start:start + size]} for start in range(0, len(items), size)
+            ])
+        except Exception:
+            logger.exception(f"Failed to publish {len(items)} rating changes, retrying with the next flush")
+            for profile_id, change in ratings.items():
+                self._pending.setdefault(profile_id, change)
+
+
+class RatingDeltaBuffer:
+    """Write-behind buffer for rating changes.
+
+    Changes are kept as deltas coalesced per profile and written every
+    flush_interval_ms with one UPDATE, so a popular profile's row is
+    locked and committed once per flush instead of once per swipe.
+    Reads add the buffered deltas to the stored scores. Once the oldest
+    buffered delta is max_staleness_ms old, e.g. while flushes fail,
+    writers wait for a flush themselves. The buffer is per process:
+    deltas are flushed on close but lost if the process dies.
+    """
+
+    def __init__(
+            self,
+            sessionmaker: async_sessionmaker,
+            events: RatingEventPublisher,
+            cfg: RatingDeltasConfig,
+            min_rating: float = ProfileRatingCalculator.MIN_RATING
+    ):
+        self.sessionmaker = sessionmaker
+        self.events = events
+        self.cfg = cfg
+        self.min_rating = min_rating
+        # bumped when a flush starts and ends, see ProfileRatingRepository._read_settled
+        self.version = 0
+        self._pending: dict[int, float] = {}
+        self._pending_since: float | None = None
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    def pending(self, profile_id: int) -> float:
+        return self._pending.get(profile_id, 0)
+
+    def discard(self, profile_id: int) -> None:
+        self._pending.pop(profile_id, None)
+
+    async def add(self, deltas: dict[int, float]) -> None:
+        for profile_id, delta in deltas.items():
+            self._pending[profile_id] = self._pending.get(profile_id, 0) + delta
+
+        if self._pending_since is None:
+            self._pending_since = time.monotonic()
+        elif (time.monotonic() - self._pending_since) * 1000 >= self.cfg.max_staleness_ms:
+            await self._try_flush()
+
+    async def settled(self) -> int:
+        """Waits for a running flush, returns the version to check after a read"""
+        async with self._lock:
+            return self.version
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await self._try_flush()
+        if self._pending:
+            logger.error(f"Lost buffered rating changes of {len(self._pending)} profiles on shutdown")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.cfg.flush_interval_ms / 1000)
+            await self._try_flush()
+
+    async def _try_flush(self) -> None:
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception(f"Failed to flush rating changes of {len(self._pending)} profiles, retrying later")
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self._pending:
+                return
+
+            deltas, self._pending = self._pending, {}
+            pending_since, self._pending_since = self._pending_since, None
+            self.version += 1
+            try:
+                async with self.sessionmaker() as session:
+                    await ProfileRatingRepository(session, events=self.events).apply_deltas(deltas, self.min_rating)
+            except Exception:
+                for profile_id, delta in deltas.items():
+                    self._pending[profile_id] = self._pending.get(profile_id, 0) + delta
+                self._pending_since = pending_since
+                raise
+            finally:
+                self.version += 1
+
+
+class MatchEventConsumer:
+    """Applies the match bonus for every match event published by matching_service.
+
+    The events come from matching_service's outbox through a queue of
+    our own bound to the matches exchange, so the swipe path does not
+    wait for rating_service. Delivery is at least once, so every event
+    is recorded in processed_matches together with its bonus and a
+    redelivered one is skipped.
+    """
+
+    def __init__(
+            self,
+            sessionmaker: async_sessionmaker,
+            amqp: AMQPClient,
+            service: RatingService,
+            events: RatingEventPublisher,
+            deltas: RatingDeltaBuffer
+    ):
+        self.sessionmaker = sessionmaker
+        self.amqp = amqp
+        self.service = service
+        self.events = events
+        self.deltas = deltas
+
+    async def start(self) -> None:
+        await self.amqp.consume(MATCH_EVENTS_QUEUE, self._on_match)
+
+    async def _on_match(self, event: dict) -> None:
+        user1_id, user2_id = sorted((event["user1_id"], event["user2_id"]))
+        async with self.sessionmaker() as session:
+            rating_repo = ProfileRatingRepository(session, events=self.events, deltas=self.deltas)
+            # events published before matched_at was added are told apart by the pair only
+            if not await rating_repo.claim_match(user1_id, user2_id, event.get("matched_at", "")):
+                logger.info(f"Skipped redelivered match event of {user1_id} and {user2_id}")
+                return
+            # written before the event is acked, a buffered bonus would be lost with the process
+            ratings = await self.service.apply_match(rating_repo, user1_id, user2_id, buffered=False)
+            await session.commit()
+        if not ratings:
+            logger.warning(f"Skipped match event, no rating for {user1_id} or {user2_id}")
+            return
+        logger.info(f"Applied match bonus for {user1_id} and {user2_id}")
@@ -0,0 +1,153 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Iterable
+
+import aio_pika
+import msgpack
+from aio_pika import DeliveryMode, ExchangeType
+from aio_pika.abc import AbstractChannel, AbstractIncomingMessage, AbstractRobustConnection
+from aio_pika.pool import Pool
+from loguru import logger
+
+
+class AMQPClient:
+    """One robust RabbitMQ connection per process with a pool of channels.
+
+    Every route is a direct exchange with a queue of the same name bound
+    by that routing key, as all services already use them; the topology
+    is declared once in connect(). A service that needs its own copy of
+    another service's route declares a subscription, a separately named
+    queue bound to that route's exchange. Messages are msgpack-encoded
+    dicts, exchanges and queues are durable and messages persistent, and
+    publishing waits for publisher confirms, so a confirmed message
+    survives a broker restart.
+    """
+
+    def __init__(
+            self,
+            uri: str,
+            routes: Iterable[str],
+            pool_size: int = 4,
+            subscriptions: dict[str, str] | None = None,
+            max_retries: int = 5,
+            retry_delay_ms: float = 1000
+    ):
+        self.uri = uri
+        self.routes = tuple(routes)
+        self.subscriptions = subscriptions or {}
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.retry_delay_ms = retry_delay_ms
+        self._connection: AbstractRobustConnection | None = None
+        self._channels: Pool[AbstractChannel] | None = None
+        self._consumer_channels: list[AbstractChannel] = []
+
+    async def connect(self) -> None:
+        self._connection = await aio_pika.connect_robust(self.uri)
+        self._channels = Pool(self._open_channel, max_size=self.pool_size)
+
+        async with self._channels.acquire() as channel:
+            bindings = {route: route for route in self.routes} | self.subscriptions
+            for queue_name, route in bindings.items():
+                exchange = await channel.declare_exchange(route, ExchangeType.DIRECT, durable=True)
+                queue = await channel.declare_queue(queue_name, durable=True)
+                await queue.bind(exchange, route)
+                await channel.declare_queue(self.dead_letter_queue(queue_name), durable=True)
+        logger.info(f"Connected to RabbitMQ, declared {', '.join(bindings)}")
+
+    async def close(self) -> None:
+        for channel in self._consumer_channels:
+            await channel.close()
+        if self._channels is not None:
+            await self._channels.close()
+        if self._connection is not None:
+            await self._connection.close()
+
+    @staticmethod
+    def dead_letter_queue(queue_name: str) -> str:
+        return f"{queue_name}.dead"
+
+    async def _open_channel(self) -> AbstractChannel:
+        return await self._connection.channel(publisher_confirms=True)
+
+    async def publish(self, route: str, payload: dict) -> None:
+        await self.publish_batch(route, [payload])
+
+    async def publish_batch(self, route: str, payloads: list[dict]) -> None:
+        """Publishes the messages on one channel and waits until the broker has confirmed all of them"""
+        async with self._channels.acquire() as channel:
+            exchange = await channel.get_exchange(route, ensure=False)
+            await asyncio.gather(*(
+                exchange.publish(
+                    aio_pika.Message(msgpack.packb(payload), delivery_mode=DeliveryMode.PERSISTENT),
+                    routing_key=route
+                )
+                for payload in payloads
+            ))
+
+    async def consume(
+            self,
+            queue_name: str,
+            handler: Callable[[dict], Awaitable[None]],
+            prefetch_count: int = 32
+    ) -> None:
+        """Calls handler for every message of a route's or subscription's queue.
+
+        A message whose handler fails is put back at the end of its queue
+        after retry_delay_ms; after max_retries failed attempts it goes to
+        the queue's dead letter queue instead. Either way the retry is
+        published before the original is acked, so it is never lost.
+        """
+        channel = await self._connection.channel(publisher_confirms=True)
+        self._consumer_channels.append(channel)
+        await channel.set_qos(prefetch_count=prefetch_count)
+        queue = await channel.get_queue(queue_name, ensure=False)
+
+        async def on_message(message: AbstractIncomingMessage) -> None:
+            try:
+                await handler(msgpack.unpackb(message.body))
+            except Exception:
+                retries = int((message.headers or {}).get("x-retries", 0)) + 1
+                target = queue_name if retries <= self.max_retries else self.dead_letter_queue(queue_name)
+                logger.exception(f"Failed to handle a message from {queue_name} (attempt {retries}), moving it to {target}")
+                await asyncio.sleep(self.retry_delay_ms / 1000)
+                try:
+                    # the default exchange routes to the queue by name, other subscribers get no copy
+                    await channel.default_exchange.publish(
+                        aio_pika.Message(
+                            message.body, headers={"x-retries": retries}, delivery_mode=DeliveryMode.PERSISTENT
+                        ),
+                        routing_key=target
+                    )
+                except Exception:
+                    logger.exception(f"Failed to requeue a message from {queue_name}, leaving it to the broker")
+                    await message.nack(requeue=True)
+                    return
+            await message.ack()
+
+        await queue.consume(on_message)
+
+    async def drain(
+            self,
+            route: str,
+            handler: Callable[[list[dict]], Awaitable[None]],
+            limit: int = 1000
+    ) -> int:
+        """Passes up to limit queued messages to handler at once and acks them if it succeeds"""
+        async with self._channels.acquire() as channel:
+            queue = await channel.get_queue(route, ensure=False)
+            messages = []
+            while len(messages) < limit:
+                message = await queue.get(fail=False)
+                if message is None:
+                    break
+                messages.append(message)
+            if not messages:
+                return 0
+
+            try:
+                await handler([msgpack.unpackb(message.body) for message in messages])
+            except Exception:
+                await messages[-1].nack(multiple=True, requeue=True)
+                raise
+            await messages[-1].ack(multiple=True)
+            return len(messages)
@@ -0,0 +1,113 @@
+import time
+from dataclasses import dataclass
+
+import httpx
+from prometheus_client import Counter, Gauge, Histogram
+
+UPSTREAM_REQUESTS = Counter(
+    "upstream_requests_total",
+    "Inter-service HTTP requests by upstream and response status",
+    ["upstream", "method", "status"],
+)
+UPSTREAM_LATENCY = Histogram(
+    "upstream_request_seconds",
+    "Latency of inter-service HTTP requests until the response headers arrive",
+    ["upstream"],
+)
+UPSTREAM_IN_FLIGHT = Gauge(
+    "upstream_requests_in_flight",
+    "Inter-service HTTP requests currently holding a pooled connection",
+    ["upstream"],
+)
+UPSTREAM_POOL_CONNECTIONS = Gauge(
+    "upstream_pool_connections",
+    "Open connections in the upstream's pool",
+    ["upstream"],
+)
+UPSTREAM_POOL_LIMIT = Gauge(
+    "upstream_pool_max_connections",
+    "Configured connection limit of the upstream's pool",
+    ["upstream"],
+)
+
+
+@dataclass
+class UpstreamConfig:
+    base_url: str
+    timeout: float = 5.0
+    connect_timeout: float = 2.0
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    http2: bool = False
+
+
+def load_upstreams(data: dict) -> dict[str, UpstreamConfig]:
+    """Builds upstream configs from the [upstreams.<name>] sections, the base url comes from <name>_url"""
+    return {
+        name: UpstreamConfig(base_url=data[f"{name}_url"], **params)
+        for name, params in data.get("upstreams", {}).items()
+    }
+
+
+class _InstrumentedTransport(httpx.AsyncBaseTransport):
+    def __init__(self, upstream: str, transport: httpx.AsyncHTTPTransport):
+        self.upstream = upstream
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        in_flight = UPSTREAM_IN_FLIGHT.labels(upstream=self.upstream)
+        in_flight.inc()
+        started = time.perf_counter()
+        status = "error"
+        try:
+            response = await self.transport.handle_async_request(request)
+            status = str(response.status_code)
+            return response
+        finally:
+            in_flight.dec()
+            UPSTREAM_LATENCY.labels(upstream=self.upstream).observe(time.perf_counter() - started)
+            UPSTREAM_REQUESTS.labels(upstream=self.upstream, method=request.method, status=status).inc()
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+class UpstreamClients:
+    """One long-lived httpx.AsyncClient per upstream service.
+
+    Clients keep their connections alive between requests, so handlers
+    reuse warm connections instead of opening a pool per call. Timeouts
+    and pool limits are set per upstream; HTTP/2 needs the h2 package
+    and is off unless enabled in the upstream's config.
+    """
+
+    def __init__(self, upstreams: dict[str, UpstreamConfig]):
+        self._clients: dict[str, httpx.AsyncClient] = {}
+        for name, cfg in upstreams.items():
+            limits = httpx.Limits(
+                max_connections=cfg.max_connections,
+                max_keepalive_connections=cfg.max_keepalive_connections,
+                keepalive_expiry=cfg.keepalive_expiry,
+            )
+            transport = httpx.AsyncHTTPTransport(limits=limits, http2=cfg.http2)
+            self._clients[name] = httpx.AsyncClient(
+                base_url=cfg.base_url,
+                timeout=httpx.Timeout(cfg.timeout, connect=cfg.connect_timeout),
+                transport=_InstrumentedTransport(name, transport),
+            )
+            UPSTREAM_POOL_LIMIT.labels(upstream=name).set(cfg.max_connections)
+            UPSTREAM_POOL_CONNECTIONS.labels(upstream=name).set_function(self._pool_size(transport))
+
+    @staticmethod
+    def _pool_size(transport: httpx.AsyncHTTPTransport):
+        # httpx keeps its httpcore pool private, report nothing if that changes
+        pool = getattr(transport, "_pool", None)
+        return lambda: len(getattr(pool, "connections", ()))
+
+    def __getitem__(self, upstream: str) -> httpx.AsyncClient:
+        return self._clients[upstream]
+
+    async def close(self) -> None:
+        for client in self._clients.values():
+            await client.aclose()